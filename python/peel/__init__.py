@@ -1,4 +1,3 @@
-import maya.cmds as m
 import os
 import os.path
 import re
@@ -7,6 +6,9 @@ import re
 def load_plugin():
     """ Loads the PeelSolve and fbx plugins """
 
+    # maya is imported here so the headless modules (e.g. cleanup.c3dParser) can be used without it
+    import maya.cmds as m
+
     m.loadPlugin("fbxmaya")
 
     if 'peelsolve' in ''.join(m.pluginInfo(q=True, ls=True)).lower():
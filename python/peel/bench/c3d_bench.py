@@ -0,0 +1,260 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+""" Benchmarks for cleanup.c3dParser
+
+Synthesizes c3d files for each combination of processor type, int/float storage, marker count, frame count
+and analog on/off, then times header parsing, a full point decode, windowed access through the memory map
+and reading one marker, and measures the peak memory of the full decode.  The results are written as json
+so they can be compared between versions of the parser.
+
+    mayapy -m peel.bench.c3d_bench --out c3d_bench.json
+    python -m peel.bench.c3d_bench --markers 10 50 --frames 1000 10000 --out quick.json
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from peel.cleanup import c3dParser
+
+
+PROC_TYPES = (84, 85, 86)
+STORAGE = ('int', 'float')
+MARKERS = (10, 50, 120, 300)
+FRAMES = (1000, 10000, 100000, 1000000)
+ANALOG = (False, True)
+
+RATE = 240.0
+ANALOG_CHANNELS = 16
+ANALOG_SAMPLES = 8          # analog samples per frame, 1920 Hz at 240 Hz
+WINDOW = 1000               # frames read for each windowed access
+
+
+class SyntheticPoints(object):
+    """ (frames, markers, 4) point data generated a slice at a time, so takes larger than memory can be
+    written.  Markers move on smooth paths and drop out for a few frames at regular intervals """
+
+    def __init__(self, frames, markers):
+        self.shape = (frames, markers, 4)
+
+    def __getitem__(self, key):
+
+        start, stop, _ = key.indices(self.shape[0])
+        frames = np.arange(start, stop, dtype=np.float32)[:, None]
+        markers = np.arange(self.shape[1], dtype=np.float32)[None, :]
+
+        out = np.empty((stop - start, self.shape[1], 4), dtype=np.float32)
+        phase = frames / RATE + markers * 0.1
+        out[..., 0] = np.sin(phase) * 500 + markers * 10
+        out[..., 1] = np.cos(phase * 0.7) * 300 + 1000
+        out[..., 2] = np.sin(phase * 1.3) * 200
+        out[..., 3] = 0.5
+
+        # a gap of 5 frames every 997 frames, offset per marker
+        gap = ((frames + markers * 37) % 997) < 5
+        out[..., 3][gap] = -1.0
+
+        return out
+
+
+class SyntheticAnalog(object):
+    """ (samples, channels) analog data generated a slice at a time """
+
+    def __init__(self, frames):
+        self.shape = (frames * ANALOG_SAMPLES, ANALOG_CHANNELS)
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(self.shape[0])
+        samples = np.arange(start, stop, dtype=np.float32)[:, None]
+        channels = np.arange(ANALOG_CHANNELS, dtype=np.float32)[None, :]
+        return np.round(np.sin(samples * 0.01 + channels) * 1000).astype(np.float32)
+
+
+def synthesize(c3d_path, proc_type, storage, markers, frames, analog):
+    """ Writes a synthetic c3d file """
+
+    labels = ["M%03d" % i for i in range(markers)]
+    scale = 0.1 if storage == 'int' else -0.1
+    analog_data = SyntheticAnalog(frames) if analog else None
+
+    c3dParser.C3DWriter(SyntheticPoints(frames, markers), labels, RATE, analog=analog_data, scale=scale,
+                        proc_type=proc_type).write(c3d_path)
+
+
+def file_size(proc_type, storage, markers, frames, analog):
+    """ Approximate size of a synthetic file in bytes """
+
+    values = markers * 4 + (ANALOG_CHANNELS * ANALOG_SAMPLES if analog else 0)
+    return frames * values * (2 if storage == 'int' else 4)
+
+
+def timed(fn, repeat=1):
+    """ Returns (best time in seconds, result of the last call) """
+
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_header(c3d_path, repeat):
+    return timed(lambda: c3dParser.load(c3d_path), repeat)[0]
+
+
+def bench_decode(c3d_path):
+    """ Returns (seconds, peak bytes allocated) for a full point decode """
+
+    def decode():
+        c3d = c3dParser.C3D()
+        c3d.load(c3d_path)
+        try:
+            c3d.read_header()
+            return c3d.read_points()
+        finally:
+            c3d.close()
+
+    tracemalloc.start()
+    try:
+        elapsed, points = timed(decode)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    del points
+    return elapsed, peak
+
+
+def bench_window(c3d_path, windows=10):
+    """ Returns (seconds for windows random frame windows, seconds to read one marker for the whole take) """
+
+    c3d = c3dParser.mmap(c3d_path)
+    window = c3d.point_data
+    frames = len(window)
+
+    starts = np.random.RandomState(0).randint(0, max(1, frames - WINDOW), windows)
+    window_time = timed(lambda: [window[i:i + WINDOW] for i in starts])[0]
+    marker_time = timed(lambda: window[:, c3d.points // 2])[0]
+
+    # release the memory map before the file is removed
+    del window
+    c3d.point_data = None
+
+    return window_time, marker_time
+
+
+def run(proc_types=PROC_TYPES, storage=STORAGE, markers=MARKERS, frames=FRAMES, analog=ANALOG,
+        max_bytes=2 * 1024 * 1024 * 1024, repeat=5, work_dir=None, verbose=True):
+    """ Runs the benchmarks and returns the report as a dict """
+
+    temp_dir = tempfile.mkdtemp(prefix="c3d_bench_", dir=work_dir)
+
+    results = []
+    skipped = []
+
+    try:
+        for proc_type in proc_types:
+            for store in storage:
+                for marker_count in markers:
+                    for frame_count in frames:
+                        for has_analog in analog:
+
+                            case = {'proc_type': proc_type, 'storage': store, 'markers': marker_count,
+                                    'frames': frame_count, 'analog': has_analog}
+
+                            if file_size(proc_type, store, marker_count, frame_count, has_analog) > max_bytes:
+                                skipped.append(case)
+                                continue
+
+                            c3d_path = os.path.join(temp_dir, "bench.c3d")
+                            synthesize(c3d_path, proc_type, store, marker_count, frame_count, has_analog)
+
+                            case['file_size'] = os.path.getsize(c3d_path)
+                            case['header_s'] = bench_header(c3d_path, repeat)
+                            case['decode_s'], case['decode_peak_bytes'] = bench_decode(c3d_path)
+                            case['window_s'], case['marker_s'] = bench_window(c3d_path)
+                            case['decode_mb_per_s'] = case['file_size'] / case['decode_s'] / 1e6
+
+                            os.remove(c3d_path)
+                            results.append(case)
+
+                            if verbose:
+                                print("%(proc_type)d %(storage)-5s markers: %(markers)4d  frames: %(frames)8d  "
+                                      "analog: %(analog)-5s  header: %(header_s).5fs  decode: %(decode_s).4fs  "
+                                      "window: %(window_s).4fs  marker: %(marker_s).4fs" % case)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'max_bytes': max_bytes,
+        'results': results,
+        'skipped': skipped,
+    }
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark the c3d parser with synthetic files")
+    parser.add_argument("--proc", type=int, nargs="+", default=PROC_TYPES, help="processor types (84, 85, 86)")
+    parser.add_argument("--storage", nargs="+", default=STORAGE, choices=STORAGE)
+    parser.add_argument("--markers", type=int, nargs="+", default=MARKERS)
+    parser.add_argument("--frames", type=int, nargs="+", default=FRAMES)
+    parser.add_argument("--analog", choices=('on', 'off', 'both'), default='both')
+    parser.add_argument("--max-bytes", type=int, default=2 * 1024 * 1024 * 1024,
+                        help="skip cases where the c3d would be larger than this")
+    parser.add_argument("--repeat", type=int, default=5, help="header parse repeats, the best time is kept")
+    parser.add_argument("--dir", default=None, help="directory for the temporary c3d files")
+    parser.add_argument("--out", default=None, help="json report file, printed if not set")
+    args = parser.parse_args(argv)
+
+    analog = {'on': (True,), 'off': (False,), 'both': ANALOG}[args.analog]
+
+    report = run(args.proc, args.storage, args.markers, args.frames, analog, args.max_bytes, args.repeat,
+                 args.dir, verbose=args.out is not None)
+
+    if args.out is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.out, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+""" Benchmarks for the cleanup tools
+
+Runs the cleanup tools on an in memory scene (util.scene.MemoryScene), so they can be timed without maya.
+Each take has markers on smooth paths with gaps, spikes and swapped labels added, then the spike and swap
+detectors, the gap index, setting the active keys and linear gap filling are timed.  The results are
+written as json so they can be compared between versions.
+
+    python -m peel.bench.cleanup_bench --out cleanup_bench.json
+    python -m peel.bench.cleanup_bench --markers 60 --frames 10000 --out quick.json
+
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import time
+import argparse
+import platform
+
+import numpy as np
+
+from peel.util import curve, scene
+from peel.cleanup import key_tools
+from peel.bench.c3d_bench import timed
+
+
+MARKERS = (60, 200)
+FRAMES = (10000, 100000)
+
+RATE = 120.0
+FPS = 24.0
+RADIUS = 30.0               # swap search radius, mm
+GAP_QUERIES = 1000          # gap navigation queries timed per marker
+
+
+def synthesize(frames, markers, seed=0):
+    """ Returns (names, points, valid) for a take with gaps every few hundred frames, a spike on each
+    marker and a pair of markers swapping labels every 1000 frames """
+
+    rng = np.random.RandomState(seed)
+
+    phase = np.arange(frames, dtype=np.float64)[:, None] / RATE + np.arange(markers)[None, :] * 0.1
+    points = np.empty((frames, markers, 3), dtype=np.float64)
+    points[..., 0] = np.sin(phase) * 500 + np.arange(markers) * 20
+    points[..., 1] = np.cos(phase * 0.7) * 300 + 1000
+    points[..., 2] = np.sin(phase * 1.3) * 200
+    points += rng.normal(0, 0.1, points.shape)
+
+    spikes = rng.randint(1, frames - 1, markers)
+    points[spikes, np.arange(markers)] += 100.0
+
+    for frame in range(500, frames, 1000):
+        a = rng.randint(0, markers - 1)
+        points[frame:, [a, a + 1]] = points[frame:, [a + 1, a]]
+
+    valid = ((np.arange(frames)[:, None] + np.arange(markers)[None, :] * 37) % 397) >= 5
+
+    return ["M%03d" % i for i in range(markers)], points, valid
+
+
+def bench_gaps(scn, names, queries):
+    """ Returns seconds for queries next/previous gap lookups on every marker """
+
+    times = scn.fetch_keys([names[0] + '.tx'])[names[0] + '.tx'][0]
+    frames = np.random.RandomState(0).uniform(times[0], times[-1], queries)
+    interval = FPS / RATE
+
+    def query():
+        for name in names:
+            index = curve.gap_index(name + '.tx', interval)
+            for frame in frames:
+                index.next_gap(frame)
+                index.previous_gap(frame)
+
+    curve.clear_gap_indexes()
+    return timed(query)[0]
+
+
+def bench_fill(scn, names):
+    """ Returns seconds to linear fill the first gap on every marker """
+
+    interval = FPS / RATE
+    gaps = [(name, curve.gap_index(name + '.tx', interval).gaps()) for name in names]
+
+    def fill():
+        for name, marker_gaps in gaps:
+            if marker_gaps:
+                start, end = marker_gaps[0]
+                key_tools.fill_gap_linear(name, interval, start, end)
+
+    return timed(fill)[0]
+
+
+def run(markers=MARKERS, frames=FRAMES, verbose=True):
+    """ Runs the benchmarks and returns the report as a dict """
+
+    results = []
+
+    for marker_count in markers:
+        for frame_count in frames:
+
+            names, points, valid = synthesize(frame_count, marker_count)
+            scn = scene.MemoryScene.from_arrays(names, points, valid, rate=RATE, fps=FPS)
+            for name in names:
+                scn.set_attr(name + '.active', 0)
+
+            previous = scene.current
+            scene.use(scn)
+
+            try:
+                case = {'markers': marker_count, 'frames': frame_count}
+
+                case['fetch_s'], (times, pts, mask) = timed(lambda: scn.fetch_points(names))
+                case['spikes_s'], found = timed(lambda: curve.markerset_spikes(times, pts, mask))
+                case['spikes'] = int(sum(len(i) for i in found))
+                case['swaps_s'], found = timed(lambda: curve.markerset_swaps(pts, RADIUS, mask, times))
+                case['swaps'] = len(found)
+                case['gaps_s'] = bench_gaps(scn, names, GAP_QUERIES)
+                case['active_s'] = timed(lambda: [key_tools.set_active_keys(i) for i in names])[0]
+                case['fill_s'] = bench_fill(scn, names)
+            finally:
+                scene.use(previous)
+                curve.clear_gap_indexes()
+
+            results.append(case)
+
+            if verbose:
+                print("markers: %(markers)4d  frames: %(frames)8d  fetch: %(fetch_s).4fs  "
+                      "spikes: %(spikes_s).4fs  swaps: %(swaps_s).4fs  gaps: %(gaps_s).4fs  "
+                      "active: %(active_s).4fs  fill: %(fill_s).4fs" % case)
+
+    return {
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'results': results,
+    }
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark the cleanup tools on an in memory scene")
+    parser.add_argument("--markers", type=int, nargs="+", default=MARKERS)
+    parser.add_argument("--frames", type=int, nargs="+", default=FRAMES)
+    parser.add_argument("--out", default=None, help="json report file, printed if not set")
+    args = parser.parse_args(argv)
+
+    report = run(args.markers, args.frames, verbose=args.out is not None)
+
+    if args.out is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.out, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
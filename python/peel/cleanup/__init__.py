@@ -1,13 +1,14 @@
 # Mocap Cleanup - Alastair Macleod 2016
 # GPL License = http://www.gnu.org/licenses/gpl.txt 
 
-import maya.cmds as m
-import maya.mel as mel
-
 def shelf() :
 
     """ Creates a peelMocapTools shelf """
 
+    # maya is imported here so the headless modules (e.g. c3dParser) can be used without it
+    import maya.cmds as m
+    import maya.mel as mel
+
     shelf_tab_name = "peelMocapTools"
     if not m.shelfLayout(shelf_tab_name, exists=True):
         shelf_tab_name = mel.eval("addNewShelfTab(\"%s\")" % shelf_tab_name)
@@ -58,6 +59,8 @@ def keys():
 
     ''' creates some useful keyboard shortcuts (removing existing ones if they exist) '''
 
+    import maya.cmds as m
+
     kt = "import mocapCleanup.key_tools as kt;kt."
     la = "import mocapCleanup.labeler as la;la."
 
@@ -2,8 +2,13 @@
 # GPL License = http://www.gnu.org/licenses/gpl.txt 
 
 from peel.cleanup import key_tools, datarate
-from peel.util import curve
-import maya.cmds as m
+from peel.util import curve, scene
+
+try:
+    import maya.cmds as m
+except ImportError:
+    # getSourceRange also works on the in memory scene (util.scene)
+    m = None
 
 
 def getSourceRange(source, rangemode):
@@ -26,8 +31,10 @@ def getSourceRange(source, rangemode):
     if rangemode not in ['all', 'spike', 'segment']:
         raise ValueError("Invalid range mode: " + rangemode)
 
-    if not m.objExists(source):
-        print(m.error("Source does not exist: " + source))
+    scn = scene.get()
+
+    if not scn.exists(source):
+        raise RuntimeError("Source does not exist: " + source)
 
     source_rate = datarate.nodeRate(source)
 
@@ -38,9 +45,11 @@ def getSourceRange(source, rangemode):
         raise RuntimeError("No rate found for node")
 
     if rangemode == 'all':
-        keys = m.keyframe(source, q=True, tc=True)
-        source_in = min(keys)
-        source_out = max(keys)
+        keys = scn.fetch_keys([source + '.tx'])[source + '.tx'][0]
+        if len(keys) == 0:
+            raise RuntimeError("No keys on: " + source)
+        source_in = float(keys[0])
+        source_out = float(keys[-1])
 
     if rangemode == 'spike':
 
@@ -59,8 +68,7 @@ def getSourceRange(source, rangemode):
 
     if source_in is None or source_out is None:
         print("Mode        " + rangemode)
-        m.error("Could not determine range")
-        return
+        raise RuntimeError("Could not determine range")
 
     return source_in, source_out
 
@@ -0,0 +1,169 @@
+# Mocap Cleanup - Alastair Macleod 2016
+# GPL License = http://www.gnu.org/licenses/gpl.txt
+
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+
+from peel.cleanup import c3dParser
+
+"""
+C3D Cache Module
+
+Once a c3d has been decoded the point data is saved as a cache so the take can be opened again without
+parsing it.  Each cache is a directory holding:
+
+ * points.npy  - (frames, points, 4) little endian float32 x, y, z, residual
+ * valid.npy   - (frames, points) bool, see c3dParser.valid_mask
+ * header.json - the c3d header (C3D.to_dict) and the size/mtime of the c3d it was made from
+
+The arrays are loaded with np.load(mmap_mode='r'), so opening a cached take is a memory map.
+
+If CACHE_DIR (or the PEEL_C3D_CACHE environment variable) is set the caches are kept there and the least
+recently used are removed when the total size goes over MAX_CACHE_SIZE.  Otherwise the cache is a sidecar
+directory next to the c3d file (take.c3d.cache).
+
+"""
+
+CACHE_DIR = os.environ.get("PEEL_C3D_CACHE")
+MAX_CACHE_SIZE = 20 * 1024 * 1024 * 1024
+VERSION = 1
+
+
+def cache_path(c3d_path):
+    """ Returns the cache directory for the c3d file """
+
+    c3d_path = os.path.abspath(c3d_path)
+
+    if CACHE_DIR is None:
+        return c3d_path + ".cache"
+
+    key = hashlib.md5(os.path.normcase(c3d_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, os.path.basename(c3d_path) + "-" + key)
+
+
+def read(c3d_path):
+    """ Returns (c3d, points, valid) from the cache, or None if there is no cache or the c3d has changed.
+    points and valid are read only memory maps and c3d.point_data is set to points """
+
+    path = cache_path(c3d_path)
+    header_path = os.path.join(path, "header.json")
+
+    try:
+        with open(header_path) as fp:
+            header = json.load(fp)
+        stat = os.stat(c3d_path)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if header.get('version') != VERSION or header['size'] != stat.st_size or header['mtime'] != stat.st_mtime:
+        return None
+
+    try:
+        points = np.load(os.path.join(path, "points.npy"), mmap_mode='r')
+        valid = np.load(os.path.join(path, "valid.npy"), mmap_mode='r')
+    except (IOError, OSError, ValueError):
+        return None
+
+    # the modified time of the header is used as the last access time
+    try:
+        os.utime(header_path, None)
+    except OSError:
+        pass
+
+    c3d = c3dParser.C3D.from_dict(header['header'], c3d_path)
+    c3d.point_data = points
+    return c3d, points, valid
+
+
+def write(c3d_path, c3d, points):
+    """ Saves the decoded points of the c3d file to its cache, returns the valid mask """
+
+    path = cache_path(c3d_path)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+    stat = os.stat(c3d_path)
+    valid = c3dParser.valid_mask(points)
+
+    np.save(os.path.join(path, "points.npy"), np.asarray(points, dtype='<f4'))
+    np.save(os.path.join(path, "valid.npy"), valid)
+
+    # the header is written last, a cache without one is not used
+    header = {'version': VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'header': c3d.to_dict()}
+    temp_path = os.path.join(path, "header.json.tmp")
+    with open(temp_path, 'w') as fp:
+        json.dump(header, fp)
+    os.replace(temp_path, os.path.join(path, "header.json"))
+
+    if CACHE_DIR is not None:
+        evict()
+
+    return valid
+
+
+def load(c3d_path, cache=True):
+    """ Returns (c3d, points, valid) for the c3d file, from the cache if it is current, otherwise the file is
+    decoded and (if cache is True) the cache is written """
+
+    if cache:
+        cached = read(c3d_path)
+        if cached is not None:
+            return cached
+
+    c3d = c3dParser.C3D()
+    c3d.load(c3d_path)
+    try:
+        c3d.read_header()
+        points = c3d.read_points()
+    finally:
+        c3d.close()
+
+    c3d.point_data = points
+
+    if not cache:
+        return c3d, points, c3dParser.valid_mask(points)
+
+    try:
+        valid = write(c3d_path, c3d, points)
+    except (IOError, OSError) as e:
+        print("Could not write c3d cache for " + str(c3d_path) + ": " + str(e))
+        valid = c3dParser.valid_mask(points)
+
+    return c3d, points, valid
+
+
+def evict(max_size=None):
+    """ Removes the least recently used caches in CACHE_DIR until the total size is under max_size """
+
+    if CACHE_DIR is None or not os.path.isdir(CACHE_DIR):
+        return
+
+    if max_size is None:
+        max_size = MAX_CACHE_SIZE
+
+    caches = []
+    total = 0
+
+    for entry in os.scandir(CACHE_DIR):
+        if not entry.is_dir():
+            continue
+        size = 0
+        accessed = 0
+        for item in os.scandir(entry.path):
+            stat = item.stat()
+            size += stat.st_size
+            if item.name == "header.json":
+                accessed = stat.st_mtime
+        caches.append((accessed, size, entry.path))
+        total += size
+
+    for accessed, size, path in sorted(caches):
+        if total <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
@@ -0,0 +1,128 @@
+# Mocap Cleanup - Alastair Macleod 2016
+# GPL License = http://www.gnu.org/licenses/gpl.txt
+
+import os
+import json
+import zlib
+import hashlib
+import threading
+
+from peel.cleanup import c3dParser
+
+"""
+C3D Index Module
+
+Caches the parsed c3d headers of a session in an index file so a session can be browsed again without
+opening every c3d file.  Entries are keyed by the path relative to the session and are only used if the
+size and mtime of the file have not changed.
+
+The index files are kept in INDEX_DIR (or the PEEL_C3D_INDEX environment variable), not in the session,
+as writing to the session directory would change its mtime and make watcher.Watcher see it as hot.
+
+The index is compressed json, written to a temp file and renamed so readers never see a partial file.
+
+"""
+
+INDEX_DIR = os.environ.get("PEEL_C3D_INDEX", os.path.join(os.path.expanduser("~"), ".peel", "c3d-index"))
+VERSION = 1
+
+
+def index_path(session_path):
+    """ Returns the path of the index file for the session directory """
+
+    key = hashlib.md5(os.path.normcase(os.path.abspath(session_path)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INDEX_DIR, os.path.basename(os.path.normpath(session_path)) + "-" + key + ".dat")
+
+
+class C3DIndex(object):
+    """ Index of c3d headers for a session directory """
+
+    def __init__(self, session_path):
+        self.session_path = session_path
+        self.index_path = index_path(session_path)
+        self.entries = {}
+        self.seen = set()
+        self.dirty = False
+        self.lock = threading.Lock()  # headers may be added from the parse thread while the index is saved
+        self.read()
+
+    def read(self):
+        """ Loads the index from disk, an invalid or missing index is ignored """
+
+        try:
+            with open(self.index_path, 'rb') as fp:
+                data = json.loads(zlib.decompress(fp.read()).decode('utf-8'))
+        except (IOError, OSError, ValueError, zlib.error):
+            return
+
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            return
+
+        self.entries = data.get('files', {})
+
+    def save(self):
+        """ Writes the index if it has changed, removing entries for files that were not seen """
+
+        with self.lock:
+            for key in set(self.entries) - self.seen:
+                del self.entries[key]
+                self.dirty = True
+
+            if not self.dirty:
+                return
+
+            data = json.dumps({'version': VERSION, 'files': self.entries}).encode('utf-8')
+            self.dirty = False
+
+        temp_path = self.index_path + ".tmp"
+        try:
+            index_dir = os.path.dirname(self.index_path)
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            with open(temp_path, 'wb') as fp:
+                fp.write(zlib.compress(data))
+            os.replace(temp_path, self.index_path)
+        except (IOError, OSError) as e:
+            print("Could not save c3d index: " + str(e))
+            with self.lock:
+                self.dirty = True
+
+    def get(self, task, entry):
+        """ Returns the c3dParser.C3D header for an os.DirEntry in the task directory, or None if the file
+        is not in the index or its stat has changed """
+
+        key = task + "/" + entry.name
+        with self.lock:
+            self.seen.add(key)
+            cached = self.entries.get(key)
+
+        if cached is None:
+            return None
+
+        stat = entry.stat()
+        if cached['size'] != stat.st_size or cached['mtime'] != stat.st_mtime:
+            return None
+
+        return c3dParser.C3D.from_dict(cached['header'], entry.path)
+
+    def set(self, task, entry, c3d):
+        """ Stores the header parsed from the os.DirEntry """
+
+        key = task + "/" + entry.name
+        stat = entry.stat()
+        with self.lock:
+            self.seen.add(key)
+            self.entries[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'header': c3d.to_dict()}
+            self.dirty = True
+
+    def clear_seen(self):
+        """ Starts a new parse of the session, entries that are not seen again are removed by save() """
+        with self.lock:
+            self.seen = set()
+
+    def keep(self, task, names):
+        """ Marks the entries for the file names in the task directory as seen without checking them, for
+        directories that have not changed since they were last parsed """
+
+        with self.lock:
+            self.seen.update(task + "/" + name for name in names)
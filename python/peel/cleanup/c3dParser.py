@@ -1,6 +1,79 @@
 import struct
 import binascii
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from peel.util import time_util
+
+
+def intel_to_float32(buf):
+    """ Converts a buffer of Intel (little endian IEEE) floats to a float32 array """
+    return np.frombuffer(buf, dtype='<f4').astype(np.float32)
+
+
+def dec_to_float32(buf):
+    """ Converts a buffer of DEC (VAX F) floats to a float32 array.
+
+    A DEC float has its two 16 bit words swapped compared to a little endian IEEE float, and an exponent
+    bias two higher.  The words are swapped with a view, then 2 is subtracted from the exponent bits.
+    A zero exponent is zero in DEC, small exponents that would underflow are divided as floats. """
+
+    words = np.frombuffer(buf, dtype='<u2').reshape(-1, 2)
+    bits = np.ascontiguousarray(words[:, ::-1]).view('<u4').ravel()
+
+    out = bits - np.uint32(2 << 23)
+
+    # exponents of 2 or less (including zero) are rare, fix them up separately
+    small = (bits & np.uint32(0x7f800000)) <= np.uint32(2 << 23)
+    if small.any():
+        exponent = (bits[small] >> 23) & 0xff
+        values = np.where(exponent == 0, np.float32(0.0), bits[small].view('<f4') / np.float32(4.0))
+        out[small] = values.astype('<f4').view('<u4')
+
+    return out.view('<f4')
+
+
+def mips_to_float32(buf):
+    """ Converts a buffer of MIPS (big endian IEEE) floats to a float32 array """
+    return np.frombuffer(buf, dtype='>f4').astype(np.float32)
+
+
+def float32_to_intel(values):
+    """ Converts an array of floats to a buffer of Intel floats """
+    return np.asarray(values, dtype='<f4').tobytes()
+
+
+def float32_to_dec(values):
+    """ Converts an array of floats to a buffer of DEC floats, the reverse of dec_to_float32.
+    Values too small for a DEC float are written as zero. """
+
+    bits = np.ascontiguousarray(values, dtype='<f4').view('<u4').ravel()
+
+    exponent = (bits >> 23) & 0xff
+    bits = np.where(exponent > 0, bits + np.uint32(2 << 23), np.uint32(0)).astype('<u4')
+
+    return np.ascontiguousarray(bits.view('<u2').reshape(-1, 2)[:, ::-1]).tobytes()
+
+
+def float32_to_mips(values):
+    """ Converts an array of floats to a buffer of MIPS floats """
+    return np.asarray(values, dtype='>f4').tobytes()
+
+
+# rotates z up data to maya's y up: (x, y, z) -> (x, z, -y)
+Z_UP_TO_Y_UP = np.array([[1, 0, 0], [0, 0, 1], [0, -1, 0]], dtype=np.float32)
+
+# axis matrix for data from each MANUFACTURER:SOFTWARE, matching convert_axis()
+AXIS_MATRICES = {"Motive": Z_UP_TO_Y_UP}
+
+# POINT:UNITS in meters
+UNITS = {'mm': 0.001, 'cm': 0.01, 'm': 1.0, 'in': 0.0254, 'ft': 0.3048}
+
+# 84 - Intel,  85 - DEC,  86 - MIPS(SGI)
+FLOAT_CONVERTERS = {84: intel_to_float32, 85: dec_to_float32, 86: mips_to_float32}
+FLOAT_ENCODERS = {84: float32_to_intel, 85: float32_to_dec, 86: float32_to_mips}
 
 
 class C3D(object):
@@ -9,6 +82,7 @@ class C3D(object):
         fp : file parser
         proc_type : processor environment endian format"""
         self.fp = None
+        self.file_name = None
         self.header = None
         self.proc_type = None
 
@@ -37,6 +111,9 @@ class C3D(object):
         self.group_dict = {}
         self.data = {}
 
+        self.point_data = None
+        self.transform = None
+
     def conform(self, value):
 
         if self.proc_type == 86:
@@ -47,51 +124,11 @@ class C3D(object):
             return struct.unpack('<h', value)
 
     def to_float(self, value):
-
-        ret = ""
-
-        if self.proc_type == 84:
-            return struct.unpack('f', value)[0]
-
-        elif self.proc_type == 85:
-            # 2 3 0 1
-            t = list(struct.unpack("4B", value))
-            #print([hex(i) for i in t])
-            if t[0] or t[1] or t[2] or t[3]:
-                t[1] = t[1] - 1
-            tt = struct.pack("4B", t[2], t[3], t[0], t[1])
-            #print([hex(i) for i in tt])
-
-            return struct.unpack("<f", tt)[0]
-
-        elif self.proc_type == 86:
-            # 3 2 1 0
-            t = struct.unpack("4B", value)
-            tmp2 = struct.pack("4B", t[3], t[2], t[1], t[0])
-
-            ret += value[3]
-            ret += value[2]
-            ret += value[1]
-            ret += value[0]
-
-        else:
-            raise ValueError("Unknown data type: " + str(self.proc_type))
-
-        return struct.unpack('f', ret)[0]
-
-    def read_byte(self):
-        return struct.unpack('b', self.fp.read(1))[0]
-
-    def read_ubyte(self):
-        return struct.unpack('B', self.fp.read(1))[0]
-
-    def read_short(self):
-        return struct.unpack('h', self.fp.read(2))[0]
-
-    def read_float(self):
-        return self.to_float(self.fp.read(4))
+        """ Converts a single 4 byte float in the file's processor format """
+        return float(self.float_array(value)[0])
 
     def load(self, file_name):
+        self.file_name = file_name
         self.fp = open(file_name, 'rb')              # opens file in binary format.
 
     def close(self):
@@ -104,11 +141,14 @@ class C3D(object):
         contain the following:
         Word 1: Byte 1 : pointer to first parameter block, defines the endian format of the C3D file
                 Byte 2 : always 0x50h (decimal 80), indicating that the file is written in the ADTech format.
-        Words 2 to 11: refer to in-line comments.
+        Words 2 to 12: refer to in-line comments.
+
+        The header block and the parameter section are each read with a single call and decoded from the buffer.
         """
-        self.header = self.fp.read(2)                # read two-bytes at a time.
-        #h1 = struct.unpack('b', self.header[0])[0]
-        #h2 = struct.unpack('b', self.header[1])[0]
+        self.fp.seek(0)
+        self.header = self.fp.read(512)              # the header is the first block
+        if len(self.header) < 512:
+            raise ValueError("Truncated c3d header: " + str(self.file_name))
         h1 = self.header[0]
         h2 = self.header[1]
         if h1 != 2 and h2 != 128:
@@ -116,182 +156,451 @@ class C3D(object):
             print(str(h2))
             raise RuntimeError("Invalid c3d file")
 
-        # header
-        self.points = self.read_short()              # 2 Number of 3D points in the file
-        self.analog = self.read_short()              # 3 Number of analog measurements per 3D frame
-        self.frame1 = self.read_short()              # 4 First frame of raw data
-        self.frameN = self.read_short()              # 5 Last frame of raw data
-        self.max_interpolation = self.read_short()   # 6 Maximum interpolation gap in 3D frames
-        self.scale_factor = self.fp.read(4)          # 7-8 Scale factor: converts signed int 3D data to ref system unit
-        self.body_data_offset = self.read_short()    # 9 Number of the first block of the analog-and-3D-data section
-        self.frames_per_field = self.read_short()    # 10 Number of analog samples per 3D frame
-        self.frame_rate = self.fp.read(4)            # 11-12 Frame rate in Hz
-
-        param_data_offset = struct.unpack_from('b', self.header, 0)[0]
+        param_data_offset = self.header[0]
 
-        self.fp.seek(param_data_offset * 256)
+        self.fp.seek((param_data_offset - 1) * 512)
 
         param_header = self.fp.read(4)
+        if len(param_header) < 4:
+            raise ValueError("Truncated c3d parameters: " + str(self.file_name))
         param_blocks = param_header[2]
 
         # 84 - Intel,  85 - DEC,  86 - MIPS(SGI)
-        self.proc_type = struct.unpack_from('b', param_header, 3)[0]
+        self.proc_type = param_header[3]
 
-        self.frame_rate = self.to_float(self.frame_rate)
-        #
+        e = self.endian()
 
-        last_param = False
+        # header
+        (self.points,                                # 2 Number of 3D points in the file
+         self.analog,                                # 3 Number of analog measurements per 3D frame
+         self.frame1,                                # 4 First frame of raw data
+         self.frameN,                                # 5 Last frame of raw data
+         self.max_interpolation) = struct.unpack_from(e + '5h', self.header, 2)   # 6 Maximum interpolation gap
+        self.scale_factor = float(self.float_array(self.header[12:16])[0])   # 7-8 Scale factor for int 3D data
+        (self.body_data_offset,                      # 9 Number of the first block of the analog-and-3D-data section
+         self.frames_per_field) = struct.unpack_from(e + '2h', self.header, 16)  # 10 Analog samples per 3D frame
+        self.frame_rate = float(self.float_array(self.header[20:24])[0])     # 11-12 Frame rate in Hz
 
-        while not last_param:
+        section = param_header + self.fp.read(param_blocks * 512 - 4)
 
-            num_char = self.read_byte()
+        pos = 4
 
-            if num_char < 0:
-                num_char = -num_char
-                param_locked = True
-            else:
-                param_locked = False
+        while pos + 2 <= len(section):
 
-            param_group_id = self.read_byte()
+            num_char, param_group_id = struct.unpack_from('bb', section, pos)
 
-            param_name = None
-            if num_char > 0:
-                param_name = self.fp.read(num_char).decode("ascii").strip()
+            # a negative number of characters means the parameter is locked
+            num_char = abs(num_char)
+            if num_char == 0:
+                break
 
-            current_pos = self.fp.tell()
+            param_name = section[pos + 2:pos + 2 + num_char].decode("ascii").strip()
 
-            next_offset = self.read_short()
+            offset_pos = pos + 2 + num_char
+            next_offset = struct.unpack_from(e + 'h', section, offset_pos)[0]
+
+            # parameters may come before the group they belong to
+            if param_group_id < 0:
+                self.data[param_name] = self.group_dict.setdefault(-param_group_id, {})
+            else:
+                param_dict = self.group_dict.setdefault(param_group_id, {})
+                param_dict[param_name] = self.read_param(section, offset_pos + 2)
 
             if next_offset <= 0:
-                last_param = True
+                break
 
-                if param_name is None:
-                    break
+            pos = offset_pos + next_offset
 
-            if param_group_id < 0:
-                newGroup = {}
-                self.group_dict[-param_group_id] = newGroup
-                # print "GROUP: %d " % param_group_id + str(param_name)
-                self.data[param_name] = newGroup
-            else:
-                param_dict = self.group_dict[param_group_id]
-                param_dict[param_name] = self.read_param()
+        self.read_timecode()
+
+    def endian(self):
+        """ struct/numpy byte order prefix for the processor type """
+        return '>' if self.proc_type == 86 else '<'
+
+    def param_array(self, buf, param_ele):
+        """ Decodes a buffer of numeric parameter values to a numpy array """
+
+        if param_ele == 2:
+            return np.frombuffer(buf, dtype=self.endian() + 'i2')
+
+        return self.float_array(buf)
+
+    def point_dtype(self):
+        """ numpy dtype of a single stored value in the data section """
+
+        if self.scale_factor < 0:
+            if self.proc_type == 86:
+                return np.dtype('>f4')
+            # dec floats are decoded from raw bytes, see float_array
+            return np.dtype('<f4')
+
+        if self.proc_type == 86:
+            return np.dtype('>i2')
+        return np.dtype('<i2')
+
+    def float_array(self, buf):
+        """ Converts a buffer of 4 byte floats stored in the file's processor format to a float32 array """
+
+        if self.proc_type not in FLOAT_CONVERTERS:
+            raise ValueError("Unknown data type: " + str(self.proc_type))
+
+        return FLOAT_CONVERTERS[self.proc_type](buf)
+
+    def trial_range(self):
+        """ Returns the (first, last) frame from TRIAL:ACTUAL_START_FIELD/ACTUAL_END_FIELD, or None.
+        Each value is stored as two 16 bit words so it can exceed the header's frame range """
+
+        trial = self.data.get('TRIAL', {})
+        start = trial.get('ACTUAL_START_FIELD')
+        end = trial.get('ACTUAL_END_FIELD')
+        if isinstance(start, list) and isinstance(end, list) and len(start) == 2 and len(end) == 2:
+            start = (start[0] & 0xffff) + ((start[1] & 0xffff) << 16)
+            end = (end[0] & 0xffff) + ((end[1] & 0xffff) << 16)
+            if end >= start:
+                return start, end
+
+        return None
+
+    def first_frame(self):
+        """ Frame number of the first frame in the data section """
+
+        trial = self.trial_range()
+        if trial is not None:
+            return trial[0]
+
+        return self.frame1 & 0xffff
+
+    def frame_count(self):
+        """ Number of 3D frames in the data section.
+
+        The header only has 16 bit frame numbers, long takes store the real range in
+        TRIAL:ACTUAL_START_FIELD/ACTUAL_END_FIELD (two words each) or POINT:FRAMES """
+
+        trial = self.trial_range()
+        if trial is not None:
+            return trial[1] - trial[0] + 1
+
+        frames = self.data.get('POINT', {}).get('FRAMES')
+        if isinstance(frames, float):
+            return int(frames)
+        if isinstance(frames, int):
+            return frames & 0xffff
+
+        return max(0, (self.frameN & 0xffff) - (self.frame1 & 0xffff) + 1)
+
+    def read_timecode(self):
+        """ Sets the timecode_ values from the TIMECODE group.  The start timecode is TIMECODE:TIMECODE, as
+        h, m, s, f words or an hh:mm:ss:ff string, and STANDARD is a name (see TIMECODE_STANDARDS) or a rate """
+
+        group = self.data.get('TIMECODE', {})
+
+        def scalar(name, default):
+            value = group.get(name, default)
+            if isinstance(value, list):
+                value = value[0] if len(value) > 0 else default
+            return value
+
+        self.timecode_used = bool(scalar('USED', 0))
+        self.timecode_dropframe = bool(scalar('DROP_FRAMES', 0))
+        self.timecode_subframesample = int(scalar('SUBFRAMESPERFRAME', 0))
+        self.timecode_offset = scalar('OFFSETS', 0)
+
+        field_numbers = group.get('FIELD_NUMBERS', [])
+        self.timecode_fieldNumbers = field_numbers if isinstance(field_numbers, list) else [field_numbers]
+
+        standard = scalar('STANDARD', 30)
+        if isinstance(standard, str):
+            standard = time_util.TIMECODE_STANDARDS.get(standard.strip().upper(), 30.0)
+        self.timecode_standard = float(standard) if standard > 0 else 30.0
+
+        timecode = group.get('TIMECODE', [])
+        if isinstance(timecode, str):
+            timecode = timecode.replace(';', ':').split(':')
+        elif not isinstance(timecode, list):
+            timecode = [timecode]
+        try:
+            self.timecode = [int(i) for i in timecode][:4]
+        except (TypeError, ValueError):
+            print("Invalid timecode: " + str(timecode))
+            self.timecode = []
+
+        if len(self.timecode) != 4:
+            self.timecode = []
 
-            self.fp.seek(current_pos + next_offset, 0)
+    def timecodes(self, frames=None):
+        """ Returns the timecode of each frame as (h, m, s, f, subframe) int arrays, see time_util.take_timecodes.
 
-    def read_data(self):
+        :param frames: frame numbers, by default every frame in the take.  As with time_util.c3d_start frame
+            n is n frames at frame_rate after the start timecode """
 
-        self.fp.seek((self.body_data_offset-1)*512, os.SEEK_SET)
+        if frames is None:
+            frames = np.arange(self.frame_count()) + self.first_frame()
 
-        scale_value = self.to_float(self.scale_factor)
+        start = self.timecode if self.timecode else [0, 0, 0, 0]
+        return time_util.take_timecodes(frames, self.frame_rate, start, self.timecode_standard,
+                                        self.timecode_dropframe, self.timecode_subframesample)
 
-        size_marker = self.points
-        size_analog = self.analog
+    def analog_channels(self):
+        """ Number of analog channels.  The header stores channels * samples per 3D frame """
 
-        if scale_value < 0:
-            size_marker *= 16
-            size_analog *= 4
+        used = self.data.get('ANALOG', {}).get('USED')
+        if isinstance(used, int) and used > 0:
+            return used
+
+        if self.frames_per_field > 0:
+            return self.analog // self.frames_per_field
+
+        return self.analog
+
+    def frame_values(self):
+        """ Number of stored values (x, y, z, residual for each point, then analog samples) per 3D frame """
+        return self.points * 4 + self.analog
+
+    def decode_points(self, values):
+        """ Converts stored point values (..., points * 4) in to a (..., points, 4) float32 array of
+        x, y, z and residual.  Int data is scaled by the scale factor, invalid points have a residual of -1 """
+
+        values = np.asarray(values)
+        return self.decode_records(values.reshape(values.shape[:-1] + (self.points, 4)))
+
+    def decode_records(self, records):
+        """ Converts point records (..., 4) of stored values in to float32 x, y, z, residual """
+
+        values = np.asarray(records, dtype=np.float32)
+
+        scale = abs(self.scale_factor)
+
+        if self.scale_factor >= 0:
+            out = values * np.float32(scale)
         else:
-            size_marker *= 8
-            size_analog *= 2
+            out = values.copy()
 
-        data = []
+        word = values[..., 3].astype(np.int32)
+        out[..., 3] = np.where(word < 0, -1.0, (word & 0xff) * scale)
 
-        for i in range(self.frameN - self.frame1):
+        if self.transform is not None:
+            out[..., :3] = np.matmul(out[..., :3], self.transform)
 
-            if size_marker > 0:
+        return out
 
-                for mark_n in range(self.points):
+    def stored_values(self, raw):
+        """ Converts a (frames, bytes) uint8 block of stored values in to a (frames, values) array """
 
-                    if scale_value < 0.0:
+        if self.scale_factor < 0:
+            return self.float_array(raw).reshape(raw.shape[0], -1)
 
-                        valx = self.read_float()
-                        valy = self.read_float()
-                        valz = self.read_float()
-                        extra = self.read_float()
+        return raw.view(self.point_dtype())
 
-                        if valx == 0.0 and valy == 0.0 and valz == 0.0:
-                            continue
+    def analog_param(self, name, default):
+        """ Returns ANALOG:name as a float array with a value per channel, missing values use the default """
 
-                        #print(valx, valy, valz, extra)
+        channels = self.analog_channels()
+        ret = np.full(channels, default, dtype=np.float64)
 
-                    else:
+        value = self.data.get('ANALOG', {}).get(name)
+        if value is None:
+            return ret
 
-                        valx = self.fp.read(2) * self.scale_factor
-                        valy = self.fp.read(2) * self.scale_factor
-                        valz = self.fp.read(2) * self.scale_factor
-                        extra = self.fp.read(2)
+        value = np.ravel(np.asarray(value, dtype=np.float64))[:channels]
+        ret[:len(value)] = value
+        return ret
 
-                    if len(data) <= mark_n:
-                        data.append([])
+    def decode_analog(self, values):
+        """ Converts stored analog values (frames, analog) in to a (samples, channels) float32 array of
+        real world values: (value - ANALOG:OFFSET) * ANALOG:SCALE * ANALOG:GEN_SCALE """
 
-                    data[mark_n].append((valx, valy, valz))
+        channels = self.analog_channels()
+        values = np.asarray(values)
 
-    def read_param(self):
+        params = self.data.get('ANALOG', {})
+        fmt = params.get('FORMAT')
+        offset = self.analog_param('OFFSET', 0.0)
 
-        param_ele = self.read_byte()
-        param_dims = self.read_byte()
+        if self.scale_factor >= 0 and isinstance(fmt, str) and fmt.upper() == 'UNSIGNED':
+            # int data and offsets are stored as 16 bit words, read them as unsigned
+            values = values.astype(np.int32) & 0xffff
+            offset = offset.astype(np.int32) & 0xffff
 
-        # print "PARAM: %d  %d" % (param_ele, param_dims)
+        scale = self.analog_param('SCALE', 1.0) * float(params.get('GEN_SCALE', 1.0))
 
-        fn = None
+        samples = values.reshape(-1, channels)
+        return ((samples - offset) * scale).astype(np.float32)
 
-        if param_ele == -1 or param_ele == 1:
-            fn = self.read_byte
+    def decode_block(self, raw, points=True):
+        """ Decodes a (frames, frame bytes) uint8 block from the data section.  Returns the points as
+        (frames, points, 4), or None if points is False, and the analog samples as
+        (frames * samples per frame, channels), see decode_analog """
 
-        if param_ele == 2:
-            fn = self.read_short
+        point_bytes = self.points * 4 * self.point_dtype().itemsize
 
-        if param_ele == 4:
-            fn = self.read_float
+        point_values = None
+        if points:
+            point_values = self.decode_points(self.stored_values(np.ascontiguousarray(raw[:, :point_bytes])))
 
-        if fn is None:
-            print("Invalid Parameter")
+        channels = self.analog_channels()
+        if channels == 0 or self.analog == 0:
+            analog = np.zeros((0, channels), dtype=np.float32)
+        else:
+            analog = self.decode_analog(self.stored_values(np.ascontiguousarray(raw[:, point_bytes:])))
+
+        return point_values, analog
+
+    def read_points(self):
+        """ Reads the 3D point data in one pass and returns a (frames, points, 4) float32 array.
+
+        The last column is the residual, which is -1 when the point is not valid for that frame """
+
+        frames = self.frame_count()
+        value_size = self.point_dtype().itemsize
+        frame_bytes = self.frame_values() * value_size
+
+        if self.points == 0 or frame_bytes == 0:
+            return np.zeros((frames, self.points, 4), dtype=np.float32)
+
+        self.fp.seek((self.body_data_offset - 1) * 512, os.SEEK_SET)
+        buf = self.fp.read(frames * frame_bytes)
+
+        # a truncated file returns the complete frames only
+        frames = len(buf) // frame_bytes
+        raw = np.frombuffer(buf, dtype=np.uint8, count=frames * frame_bytes).reshape(frames, frame_bytes)
+        raw = np.ascontiguousarray(raw[:, :self.points * 4 * value_size])
+
+        return self.decode_points(self.stored_values(raw))
+
+    def iter_frames(self, chunk=1000, points=True):
+        """ Generator that reads the data section chunk frames at a time, so a whole take can be processed
+        in constant memory.  Yields (frame_numbers, points, analog) for each chunk, see decode_block.
+        If points is False only the analog data is decoded.
+
+        The file is opened separately, so this can be used after the header has been loaded and closed """
+
+        if self.file_name is None:
+            raise RuntimeError("No file loaded")
+
+        if chunk < 1:
+            raise ValueError("Invalid chunk size: " + str(chunk))
+
+        frames = self.frame_count()
+        frame_bytes = self.frame_values() * self.point_dtype().itemsize
+        first = self.first_frame()
+
+        if frame_bytes == 0:
             return
 
-        if param_dims == 0:
-            # single
-            return fn()
+        with open(self.file_name, 'rb') as fp:
 
-        if param_dims == 1:
+            fp.seek((self.body_data_offset - 1) * 512, os.SEEK_SET)
 
-            len = self.read_byte()
+            for start in range(0, frames, chunk):
 
-            if param_ele == -1 or param_ele == 1:
-                # string
-                return self.fp.read(len).decode("ascii").strip()
+                buf = fp.read(min(chunk, frames - start) * frame_bytes)
+                count = len(buf) // frame_bytes
+                if count == 0:
+                    return
 
-            # array
-            return [fn() for i in range(abs(len))]
+                raw = np.frombuffer(buf, dtype=np.uint8, count=count * frame_bytes).reshape(count, frame_bytes)
+                point_values, analog = self.decode_block(raw, points)
 
-        if param_dims == 2:
+                yield np.arange(first + start, first + start + count), point_values, analog
 
-            # matrix
+    def read_analog(self, chunk=10000):
+        """ Reads all the analog samples as a (samples, channels) float32 array with the
+        ANALOG:OFFSET/SCALE/GEN_SCALE parameters applied """
+
+        blocks = [analog for _, _, analog in self.iter_frames(chunk, points=False)]
+        if len(blocks) == 0:
+            return np.zeros((0, self.analog_channels()), dtype=np.float32)
+
+        return np.concatenate(blocks)
+
+    def segment_index(self, chunk=10000):
+        """ Reads the point data in chunks and returns a SegmentIndex of the valid frames of each point """
+
+        masks = [valid_mask(points) for _, points, _ in self.iter_frames(chunk)]
+        if len(masks) == 0:
+            mask = np.zeros((0, self.points), dtype=bool)
+        else:
+            mask = np.concatenate(masks)
+
+        return SegmentIndex(mask, self.first_frame())
+
+    def map_points(self):
+        """ Memory maps the data section of the file and returns a PointWindow, which decodes
+        only the frames/points that are sliced from it.  The header needs to have been read first. """
+
+        if self.file_name is None:
+            raise RuntimeError("No file loaded")
 
-            unit_size = self.read_ubyte()
-            num_units = self.read_ubyte()
+        offset = (self.body_data_offset - 1) * 512
+        dtype = self.point_dtype()
+        frame_values = self.frame_values()
 
-            if param_ele == -1 or param_ele == 1:
+        frames = self.frame_count()
+        if frame_values > 0:
+            available = (os.path.getsize(self.file_name) - offset) // (frame_values * dtype.itemsize)
+            frames = max(0, min(frames, available))
 
+        if frames == 0 or frame_values == 0:
+            raw = np.zeros((frames, frame_values), dtype=dtype)
+        else:
+            raw = np.memmap(self.file_name, dtype=dtype, mode='r', offset=offset, shape=(frames, frame_values))
+
+        self.point_data = PointWindow(self, raw)
+        return self.point_data
+
+    def read_param(self, buf, pos):
+        """ Decodes the value of the parameter that starts at buf[pos] (type, dimensions, data) """
+
+        param_ele, param_dims = struct.unpack_from('bB', buf, pos)
+        dims = struct.unpack_from('%dB' % param_dims, buf, pos + 2)
+        pos += 2 + param_dims
+
+        # print "PARAM: %d  %d" % (param_ele, param_dims)
+
+        if param_ele == -1 or param_ele == 1:
+
+            if param_dims == 0:
+                # single
+                return struct.unpack_from('b', buf, pos)[0]
+
+            if param_dims == 1:
+                # string
+                return buf[pos:pos + dims[0]].decode("ascii").strip()
+
+            if param_dims == 2:
                 # array of strings
+                unit_size, num_units = dims
+                return [buf[pos + i * unit_size:pos + (i + 1) * unit_size].decode("ascii").strip()
+                        for i in range(num_units)]
 
-                data = []
+            return None
 
-                for i in range(num_units):
-                    item = self.fp.read(unit_size)
-                    data.append(item.decode("ascii").strip())
+        if param_ele not in (2, 4):
+            print("Invalid Parameter")
+            return
 
-                return data
+        if param_dims == 0 and param_ele == 2:
+            # single, struct is cheaper than numpy for one value
+            return struct.unpack_from(self.endian() + 'h', buf, pos)[0]
 
-            data = []
+        count = 1
+        for i in dims:
+            count *= i
 
-            for i in range(num_units):
-                row = []
-                for j in range(unit_size):
-                    row.append(fn())
-                data.append(row)
+        values = self.param_array(buf[pos:pos + count * param_ele], param_ele)
 
-            return data
+        if param_dims == 0:
+            # single
+            return values[0].item()
+
+        if param_dims == 1:
+            # array
+            return values.tolist()
+
+        if param_dims == 2:
+            # matrix
+            unit_size, num_units = dims
+            return values.reshape(num_units, unit_size).tolist()
 
         return None
 
@@ -302,7 +611,7 @@ class C3D(object):
         print("Frame1:       %d" % self.frame1)
         print("FrameN:       %d" % self.frameN)
         print("Max Interp:   %d" % self.max_interpolation)
-        # print("Scale Factor: %f" % self.scale_factor)
+        print("Scale Factor: %f" % self.scale_factor)
         print("data offset   %d" % self.body_data_offset)
         print("frames_field  %d" % self.frames_per_field)
         print("frame_rate    %f" % self.frame_rate)
@@ -310,6 +619,26 @@ class C3D(object):
     def close(self):
         self.fp.close()
 
+    HEADER_FIELDS = ('points', 'analog', 'frame1', 'frameN', 'max_interpolation', 'scale_factor',
+                     'body_data_offset', 'frames_per_field', 'frame_rate', 'proc_type')
+
+    def to_dict(self):
+        """ Returns the parsed header and parameter groups as a json friendly dict """
+        ret = dict((i, getattr(self, i)) for i in self.HEADER_FIELDS)
+        ret['data'] = self.data
+        return ret
+
+    @classmethod
+    def from_dict(cls, values, file_name=None):
+        """ Creates a C3D from the output of to_dict() without reading the file """
+        c3d = cls()
+        for i in cls.HEADER_FIELDS:
+            setattr(c3d, i, values[i])
+        c3d.data = values['data']
+        c3d.file_name = file_name
+        c3d.read_timecode()
+        return c3d
+
     def convert_axis(self):
 
         if 'MANUFACTURER' in self.data:
@@ -319,6 +648,424 @@ class C3D(object):
 
         return False
 
+    def axis_matrix(self):
+        """ Returns the 3x3 axis matrix for the software that wrote the file (see AXIS_MATRICES), or None """
+
+        software = self.data.get('MANUFACTURER', {}).get('SOFTWARE')
+        if not isinstance(software, str):
+            return None
+
+        return AXIS_MATRICES.get(software.strip())
+
+    def unit_scale(self, units):
+        """ Returns the scale from the file's POINT:UNITS to units, e.g. 'cm'.  Unknown units are not scaled """
+
+        source = self.data.get('POINT', {}).get('UNITS')
+        if not isinstance(source, str):
+            return 1.0
+
+        source = source.strip().lower()
+        units = units.strip().lower()
+        if source not in UNITS or units not in UNITS:
+            print("Unknown units: %s -> %s" % (source, units))
+            return 1.0
+
+        return UNITS[source] / UNITS[units]
+
+    def set_transform(self, matrix='auto', scale=1.0, units=None):
+        """ Sets an axis matrix and scale that is applied to the points as they are decoded (read_points,
+        iter_frames, point_data), so the data is in scene space without transforming it again later.
+
+        :param matrix: 3x3 matrix applied as point = matrix * point, 'auto' to use axis_matrix(), or None
+        :param scale: scale applied after the matrix
+        :param units: scale from POINT:UNITS to these units as well, e.g. 'cm' for maya """
+
+        if isinstance(matrix, str):
+            if matrix != 'auto':
+                raise ValueError("Invalid axis matrix: " + matrix)
+            matrix = self.axis_matrix()
+
+        if matrix is None:
+            matrix = np.identity(3)
+
+        if units is not None:
+            scale *= self.unit_scale(units)
+
+        # points are rows, so they are multiplied by the transpose
+        transform = (np.asarray(matrix, dtype=np.float64) * scale).T.astype(np.float32)
+        if transform.shape != (3, 3):
+            raise ValueError("Axis matrix should be 3x3")
+
+        self.transform = None if np.array_equal(transform, np.identity(3)) else transform
+
+
+def valid_mask(points):
+    """ Returns a (frames, points) bool array that is True where a (frames, points, 4) array has data.
+    A negative residual means the point was not seen for that frame """
+    return np.asarray(points)[..., 3] >= 0
+
+
+class SegmentIndex(object):
+    """ Run length index of the valid frames of each point, built from a (frames, points) valid mask.
+
+    segments[i] is an (n, 2) int array of the first and last frame of each run of data for point i.
+    Queries use a binary search, so they do not depend on the length of the take. """
+
+    def __init__(self, mask, first_frame=0):
+
+        mask = np.asarray(mask, dtype=bool)
+        frames, points = mask.shape
+
+        # pad each point's row with False so every run has a start and an end
+        padded = np.zeros((points, frames + 2), dtype=np.int8)
+        padded[:, 1:-1] = mask.T
+        delta = np.diff(padded, axis=1)
+
+        start_point, start_frame = np.nonzero(delta == 1)
+        end_frame = np.nonzero(delta == -1)[1] - 1
+
+        runs = np.stack([start_frame, end_frame], axis=1) + first_frame
+        split = np.searchsorted(start_point, np.arange(1, points))
+
+        self.first_frame = first_frame
+        self.frames = frames
+        # np.split always returns at least one array, so there are no segments without points
+        self.segments = np.split(runs, split) if points > 0 else []
+
+    def __len__(self):
+        return len(self.segments)
+
+    def gaps(self, point):
+        """ Returns an (n, 2) array of the last frame before, and first frame after each gap in the data """
+
+        runs = self.segments[point]
+        return np.stack([runs[:-1, 1], runs[1:, 0]], axis=1)
+
+    def segment_at(self, point, frame):
+        """ Returns the (first, last) frame of the run of data containing frame, or None """
+
+        runs = self.segments[point]
+        i = np.searchsorted(runs[:, 0], frame, side='right') - 1
+        if i < 0 or runs[i, 1] < frame:
+            return None
+        return int(runs[i, 0]), int(runs[i, 1])
+
+    def gap_at(self, point, frame):
+        """ Returns the (last frame before, first frame after) of the gap containing frame, or None """
+
+        runs = self.segments[point]
+        i = np.searchsorted(runs[:, 0], frame, side='right')
+        if i == 0 or i == len(runs) or runs[i - 1, 1] >= frame:
+            return None
+        return int(runs[i - 1, 1]), int(runs[i, 0])
+
+    def next_gap(self, point, frame):
+        """ Returns the first gap that starts at or after frame as (last frame before, first frame after),
+        or None.  Matches key_tools.next_gap """
+
+        runs = self.segments[point]
+        i = np.searchsorted(runs[:-1, 1], frame, side='left')
+        if i >= len(runs) - 1:
+            return None
+        return int(runs[i, 1]), int(runs[i + 1, 0])
+
+    def previous_gap(self, point, frame):
+        """ Returns the last gap that ends at or before frame, or None """
+
+        runs = self.segments[point]
+        i = np.searchsorted(runs[1:, 0], frame, side='right') - 1
+        if i < 0:
+            return None
+        return int(runs[i, 1]), int(runs[i + 1, 0])
+
+
+class PointWindow(object):
+    """ Lazy (frames, points, 4) view of the point data of a memory mapped c3d file.
+
+    Slicing reads and decodes only the requested part of the file, e.g. window[1000:2000, marker_idx]
+    The returned arrays are float32 x, y, z, residual as returned by C3D.read_points() """
+
+    def __init__(self, c3d, raw):
+        self.c3d = c3d
+        self.raw = raw
+
+    @property
+    def shape(self):
+        return self.raw.shape[0], self.c3d.points, 4
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def __getitem__(self, key):
+
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        if len(key) > 3:
+            raise IndexError("Too many indices for point data: " + str(key))
+
+        points = self.c3d.points
+
+        # only the point values of the selected frames are touched
+        records = self.raw[key[0], :points * 4]
+        records = records.reshape(records.shape[:-1] + (points, 4))
+
+        if len(key) > 1:
+            records = records[(Ellipsis, key[1], slice(None))]
+
+        if self.c3d.scale_factor < 0:
+            shape = records.shape
+            records = self.c3d.float_array(np.ascontiguousarray(records).tobytes()).reshape(shape)
+
+        values = self.c3d.decode_records(records)
+
+        if len(key) > 2:
+            values = values[..., key[2]]
+
+        return values
+
+
+class C3DWriter(object):
+    """ Writes a (frames, points, 4) array of x, y, z, residual to a c3d file.
+
+    Parameter groups from a loaded file (C3D.data) can be passed in and are written back, with the
+    POINT, ANALOG and TRIAL values that describe the data replaced.  Analog samples are optional and
+    are written as real values, (samples, channels) with a whole number of samples per frame.
+
+    A negative scale (the default) writes float data, a positive scale writes scaled int16 data, in which
+    case the analog values are rounded to ints.  proc_type is 84 (Intel), 85 (DEC) or 86 (MIPS). """
+
+    def __init__(self, points, labels, rate, data=None, analog=None, analog_rate=None, first_frame=1,
+                 scale=-0.1, proc_type=84):
+
+        # arrays are only read a chunk of frames at a time, so a memmap can be written without loading it
+        if not hasattr(points, 'shape'):
+            points = np.asarray(points, dtype=np.float32)
+        self.points = points
+        if len(self.points.shape) != 3 or self.points.shape[2] != 4:
+            raise ValueError("Points should be a (frames, points, 4) array, got: " + str(self.points.shape))
+
+        if len(labels) != self.points.shape[1]:
+            raise ValueError("Expected %d labels, got %d" % (self.points.shape[1], len(labels)))
+
+        self.labels = list(labels)
+        self.rate = float(rate)
+        self.data = data or {}
+        self.first_frame = first_frame
+
+        # negative scale means float data, the value is used for the residual units
+        if scale == 0:
+            raise ValueError("Invalid scale: " + str(scale))
+        self.scale = float(scale)
+
+        if proc_type not in FLOAT_ENCODERS:
+            raise ValueError("Unknown data type: " + str(proc_type))
+        self.proc_type = proc_type
+        self.endian = '>' if proc_type == 86 else '<'
+
+        self.analog = None
+        self.samples_per_frame = 0
+        if analog is not None:
+            if not hasattr(analog, 'shape'):
+                analog = np.asarray(analog, dtype=np.float32)
+            self.analog = analog
+            frames = self.points.shape[0]
+            if frames == 0 or len(self.analog.shape) != 2 or self.analog.shape[0] % frames != 0:
+                raise ValueError("Analog should be (samples, channels) with a whole number of samples per frame")
+            self.samples_per_frame = self.analog.shape[0] // frames
+            if analog_rate is None:
+                analog_rate = self.rate * self.samples_per_frame
+        self.analog_rate = analog_rate
+
+    def parameters(self, data_start):
+        """ Returns the parameter groups to write, as {group: {name: value}} """
+
+        groups = dict((group, dict(params)) for group, params in self.data.items())
+
+        frames, count = self.points.shape[:2]
+        last_frame = self.first_frame + frames - 1
+
+        point = groups.setdefault('POINT', {})
+        for key in list(point):
+            if key.startswith('LABELS') or key.startswith('DESCRIPTIONS'):
+                del point[key]
+
+        point['USED'] = count
+        point['FRAMES'] = frames if frames < 32768 else float(frames)
+        point['SCALE'] = self.scale
+        point['RATE'] = self.rate
+        point['DATA_START'] = data_start
+
+        # more than 255 labels are split over LABELS, LABELS2, ...
+        for i in range(0, max(1, count), 255):
+            key = 'LABELS' if i == 0 else 'LABELS%d' % (i // 255 + 1)
+            point[key] = self.labels[i:i + 255]
+
+        # frame numbers that do not fit in the header are stored as two words
+        trial = groups.setdefault('TRIAL', {})
+        trial['ACTUAL_START_FIELD'] = self.words(self.first_frame)
+        trial['ACTUAL_END_FIELD'] = self.words(last_frame)
+
+        if self.analog is None:
+            if 'ANALOG' in groups:
+                groups['ANALOG']['USED'] = 0
+        else:
+            channels = self.analog.shape[1]
+            analog = groups.setdefault('ANALOG', {})
+            analog['USED'] = channels
+            analog['RATE'] = float(self.analog_rate)
+            analog['GEN_SCALE'] = 1.0
+            analog['SCALE'] = [1.0] * channels
+            analog['OFFSET'] = [0] * channels
+            if 'FORMAT' in analog:
+                del analog['FORMAT']
+            for key in ('LABELS', 'DESCRIPTIONS', 'UNITS'):
+                if key in analog and len(analog[key]) != channels:
+                    del analog[key]
+
+        return groups
+
+    @staticmethod
+    def words(value):
+        """ Splits a value in to two signed 16 bit words """
+        return [struct.unpack('<h', struct.pack('<H', i))[0] for i in (value & 0xffff, (value >> 16) & 0xffff)]
+
+    def encode_floats(self, values):
+        """ Converts floats to a buffer in the processor format """
+        return FLOAT_ENCODERS[self.proc_type](values)
+
+    def encode_param(self, value):
+        """ Returns (type, dimensions, data) bytes for a parameter value """
+
+        if isinstance(value, str):
+            data = value.encode("ascii")
+            return -1, [len(data)], data
+
+        if isinstance(value, (list, tuple)) and len(value) > 0 and all(isinstance(i, str) for i in value):
+            # array of strings, padded to the longest
+            width = max(1, max(len(i) for i in value))
+            return -1, [width, len(value)], b''.join(i.encode("ascii").ljust(width) for i in value)
+
+        array = np.asarray(value)
+        if array.dtype.kind not in 'biuf':
+            raise ValueError("Cannot write parameter value: " + str(value))
+
+        dims = list(reversed(array.shape))
+        if array.dtype.kind in 'biu' and array.size > 0 and -32768 <= array.min() and array.max() < 32768:
+            return 2, dims, array.astype(self.endian + 'i2').tobytes()
+
+        if array.dtype.kind in 'biu' and array.size == 0:
+            return 2, dims, b''
+
+        return 4, dims, self.encode_floats(array.ravel())
+
+    def parameter_section(self, data_start):
+        """ Returns the parameter section as bytes, padded to whole blocks """
+
+        entries = []
+
+        e = self.endian
+
+        for group_id, (group, params) in enumerate(sorted(self.parameters(data_start).items()), 1):
+
+            name = group.encode("ascii")
+            entries.append(struct.pack('bb', len(name), -group_id) + name + struct.pack(e + 'hB', 3, 0))
+
+            for key, value in sorted(params.items()):
+                if value is None:
+                    continue
+                param_type, dims, data = self.encode_param(value)
+                if any(i > 255 for i in dims):
+                    print("Skipping parameter that is too large to write: " + group + ":" + key)
+                    continue
+                name = key.encode("ascii")
+                body = struct.pack('bB', param_type, len(dims)) + bytes(bytearray(dims)) + data + b'\0'
+                entries.append(struct.pack('bb', len(name), group_id) + name + struct.pack(e + 'h', 2 + len(body))
+                               + body)
+
+        # the last entry points nowhere
+        last = entries[-1]
+        name_size = abs(struct.unpack_from('b', last, 0)[0])
+        entries[-1] = last[:2 + name_size] + struct.pack(e + 'h', 0) + last[4 + name_size:]
+
+        section = b''.join(entries)
+        blocks = (len(section) + 4 + 511) // 512
+        return (struct.pack('BBBB', 1, 0x50, blocks, self.proc_type) + section).ljust(blocks * 512, b'\0')
+
+    def header(self, data_start):
+        """ Returns the 512 byte header block """
+
+        frames, count = self.points.shape[:2]
+        channels = 0 if self.analog is None else self.analog.shape[1]
+
+        first = min(self.first_frame, 0xffff)
+        last = min(self.first_frame + frames - 1, 0xffff)
+
+        e = self.endian
+        header = struct.pack(e + 'BBhhHHh', 2, 0x50, count, channels * self.samples_per_frame, first, last, 10)
+        header += self.encode_floats([self.scale])
+        header += struct.pack(e + 'hh', data_start, self.samples_per_frame)
+        header += self.encode_floats([self.rate])
+
+        return header.ljust(512, b'\0')
+
+    def frame_values(self, start, end):
+        """ Returns the stored values for frames start to end as a (frames, values) float32 array """
+
+        points = np.array(self.points[start:end], dtype=np.float32)
+
+        # residual word: -1 if the point is not valid, otherwise the residual in scale units
+        residual = points[..., 3]
+        word = np.clip(np.round(residual / abs(self.scale)), 0, 255)
+        points[..., 3] = np.where(residual < 0, -1.0, word)
+
+        if self.scale > 0:
+            points[..., :3] = np.round(points[..., :3] / self.scale)
+
+        values = points.reshape(end - start, -1)
+
+        if self.analog is not None:
+            analog = np.asarray(self.analog[start * self.samples_per_frame:end * self.samples_per_frame])
+            values = np.concatenate([values, analog.reshape(end - start, -1)], axis=1)
+
+        return values
+
+    def encode_values(self, values):
+        """ Converts a (frames, values) array from frame_values to the bytes of the data section """
+
+        if self.scale > 0:
+            return np.clip(np.round(values), -32768, 32767).astype(self.endian + 'i2').tobytes()
+
+        return self.encode_floats(values)
+
+    def write(self, file_name, chunk=10000):
+        """ Writes the file, the data section is written chunk frames at a time """
+
+        frames = self.points.shape[0]
+
+        # the size of the parameters does not depend on the value of DATA_START
+        data_start = 2 + len(self.parameter_section(0)) // 512
+
+        with open(file_name, 'wb') as fp:
+            fp.write(self.header(data_start))
+            fp.write(self.parameter_section(data_start))
+
+            size = 0
+            for start in range(0, frames, chunk):
+                block = self.encode_values(self.frame_values(start, min(frames, start + chunk)))
+                fp.write(block)
+                size += len(block)
+
+            # pad the data section to a whole block
+            if size % 512:
+                fp.write(b'\0' * (512 - size % 512))
+
+
+def write(c3d_path, points, labels, rate, data=None, analog=None, first_frame=1, scale=-0.1, proc_type=84):
+    """ Writes a c3d file, see C3DWriter """
+    C3DWriter(points, labels, rate, data=data, analog=analog, first_frame=first_frame, scale=scale,
+              proc_type=proc_type).write(c3d_path)
+
 
 def load(c3d_path):
     c3d = C3D()
@@ -328,6 +1075,68 @@ def load(c3d_path):
     return c3d
 
 
+def load_many(c3d_paths, workers=16, points=False, progress=None, axis=None, units=None, return_exceptions=False):
+    """ Loads many c3d files on a thread pool, as reading headers from network storage is bound by latency.
+
+    :param c3d_paths: list of paths to load
+    :param workers: number of files to read at the same time
+    :param points: also read the point data in to c3d.point_data
+    :param progress: called with (current, total, path) on the calling thread as each file completes, if it
+        raises the files that have not started are not read
+    :param axis: axis matrix for the points, 'auto' or a 3x3 matrix, see C3D.set_transform
+    :param units: convert the points to these units, e.g. 'cm'
+    :param return_exceptions: put the exception in the list in place of a file that fails, rather than raising it
+    :return: list of C3D objects in the same order as c3d_paths.  If a file fails its exception is raised
+        after all the files have been read, unless return_exceptions is set """
+
+    def load_one(c3d_path):
+        c3d = C3D()
+        c3d.load(c3d_path)
+        try:
+            c3d.read_header()
+            if axis is not None or units is not None:
+                c3d.set_transform(axis, units=units)
+            if points:
+                c3d.point_data = c3d.read_points()
+        finally:
+            c3d.close()
+        return c3d
+
+    if len(c3d_paths) == 0:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(c3d_paths)))) as executor:
+        futures = dict((executor.submit(load_one, c3d_path), i) for i, c3d_path in enumerate(c3d_paths))
+
+        try:
+            for count, future in enumerate(as_completed(futures)):
+                if progress is not None:
+                    progress(count, len(c3d_paths), c3d_paths[futures[future]])
+        except BaseException:
+            # e.g. the progress callback cancelling the load, don't start the files that are waiting
+            for future in futures:
+                future.cancel()
+            raise
+
+        results = [None] * len(c3d_paths)
+        for future, i in futures.items():
+            if return_exceptions and future.exception() is not None:
+                results[i] = future.exception()
+            else:
+                results[i] = future.result()
+
+    return results
+
+
+def mmap(c3d_path, axis=None, units=None):
+    """ Reads the header and memory maps the point data, see C3D.point_data and C3D.set_transform """
+    c3d = load(c3d_path)
+    if axis is not None or units is not None:
+        c3d.set_transform(axis, units=units)
+    c3d.map_points()
+    return c3d
+
+
 def test():
 
     import json
@@ -338,10 +1147,12 @@ def test():
     d = os.path.join(d, "../data/Josh_ROM_Out-01.c3d")    # revert to this
 
     d = os.path.abspath(d)
-    c3d.read_header(d)
+    c3d.load(d)
+    c3d.read_header()
     c3d.dump()
 
-    c3d.read_data()
+    points = c3d.read_points()
+    print(points.shape)
 
     c3d.close()
 
@@ -0,0 +1,334 @@
+# Mocap Cleanup - Alastair Macleod 2016
+# GPL License = http://www.gnu.org/licenses/gpl.txt
+
+import os
+import json
+import sqlite3
+import datetime
+import contextlib
+
+"""
+Catalog Module
+
+A local sqlite database of the sessions that mocapData.Parser has read, so takes can be found across many
+sessions without walking the base directory:
+
+ * sessions     - base directory, title and date (the earliest take) of each session
+ * takes        - c3d files with their header metadata (rate, frames, points, subjects), range and note
+ * maya_files   - versions of the maya files in the cleaning, solving and template directories
+ * session_data - the contents of range-data.json and notes-data.json
+
+The parser updates a session after parsing it.  Takes whose size and mtime have not changed keep their
+metadata, so a refresh only reads the headers of new or modified files.
+
+The database is local (CATALOG_PATH or the PEEL_CATALOG environment variable), sqlite locking is not
+reliable on network drives.  Each call opens its own connection so the catalog can be updated from the
+parse thread while the Loader queries it.
+
+"""
+
+CATALOG_PATH = os.environ.get("PEEL_CATALOG", os.path.join(os.path.expanduser("~"), ".peel", "catalog.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    base_dir TEXT NOT NULL,
+    title TEXT NOT NULL,
+    mtime REAL,
+    date TEXT,
+    UNIQUE (base_dir, title)
+);
+
+CREATE TABLE IF NOT EXISTS takes (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    task TEXT NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    date TEXT,
+    rate REAL,
+    first_frame INTEGER,
+    last_frame INTEGER,
+    points INTEGER,
+    subjects TEXT,
+    range_in REAL,
+    range_out REAL,
+    note TEXT,
+    UNIQUE (session_id, path)
+);
+
+CREATE TABLE IF NOT EXISTS maya_files (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    task TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version INTEGER,
+    path TEXT NOT NULL,
+    UNIQUE (session_id, path)
+);
+
+CREATE TABLE IF NOT EXISTS session_data (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    data TEXT,
+    PRIMARY KEY (session_id, kind)
+);
+
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+CREATE INDEX IF NOT EXISTS takes_session ON takes (session_id);
+CREATE INDEX IF NOT EXISTS takes_name ON takes (name);
+CREATE INDEX IF NOT EXISTS takes_date ON takes (date);
+CREATE INDEX IF NOT EXISTS takes_rate ON takes (rate);
+CREATE INDEX IF NOT EXISTS maya_files_take ON maya_files (session_id, name, task);
+"""
+
+
+class Catalog(object):
+    """ sqlite catalog of parsed sessions """
+
+    def __init__(self, path=None):
+        self.path = path or CATALOG_PATH
+
+        parent = os.path.dirname(self.path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self):
+        """ Context manager for a new connection, commits the changes and closes it """
+
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA foreign_keys=ON")
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def session_id(self, db, base_dir, title, mtime=None):
+        """ Returns the id of the session, adding it if it is not in the catalog """
+
+        db.execute("INSERT OR IGNORE INTO sessions (base_dir, title) VALUES (?, ?)", (base_dir, title))
+        if mtime is not None:
+            db.execute("UPDATE sessions SET mtime=? WHERE base_dir=? AND title=?", (mtime, base_dir, title))
+        return db.execute("SELECT id FROM sessions WHERE base_dir=? AND title=?", (base_dir, title)).fetchone()[0]
+
+    def changed_takes(self, base_dir, session_obj):
+        """ Returns the C3DFiles of the session that are new or have changed since they were cataloged """
+
+        session_path = os.path.join(base_dir, session_obj.title)
+        takes = session_obj.getTask("raw") or []
+
+        with self.connect() as db:
+            rows = db.execute("SELECT t.path, t.size, t.mtime FROM takes t JOIN sessions s ON s.id = t.session_id "
+                              "WHERE s.base_dir=? AND s.title=?", (base_dir, session_obj.title)).fetchall()
+        known = dict((row['path'], (row['size'], row['mtime'])) for row in rows)
+
+        ret = []
+        for item in takes:
+            stat = file_stat(item)
+            if stat is None:
+                continue
+            if known.get(os.path.relpath(item.path(), session_path)) != (stat.st_size, stat.st_mtime):
+                ret.append(item)
+
+        return ret
+
+    def update_session(self, base_dir, session_obj, range_data=None, notes_data=None, changed=None):
+        """ Updates the catalog from a session parsed by mocapData.Parser.
+
+        Takes that are not in changed_takes() only have their range and note updated.  Files that are no
+        longer in the session are removed.  Pass changed if changed_takes() has already been called, so the
+        catalog is not read and the takes are not stat'd again. """
+
+        session_path = os.path.join(base_dir, session_obj.title)
+
+        try:
+            session_mtime = os.stat(session_path).st_mtime
+        except OSError:
+            session_mtime = None
+
+        if changed is None:
+            changed = self.changed_takes(base_dir, session_obj)
+        changed = set(id(i) for i in changed)
+
+        with self.connect() as db:
+
+            sid = self.session_id(db, base_dir, session_obj.title, session_mtime)
+
+            # takes
+            paths = []
+            for item in session_obj.getTask("raw") or []:
+
+                path = os.path.relpath(item.path(), session_path)
+                paths.append(path)
+
+                in_frame, out_frame = None, None
+                if range_data is not None and item.name in range_data:
+                    in_frame, out_frame = range_data[item.name]
+
+                if id(item) not in changed:
+                    db.execute("UPDATE takes SET range_in=?, range_out=?, note=? WHERE path=? AND session_id=?",
+                               (in_frame, out_frame, item.note, path, sid))
+                    continue
+
+                stat = file_stat(item)
+                c3d = item.c3d_file
+                first, last = item.range()
+                subjects = None
+                if c3d is not None and 'SUBJECTS' in c3d.data:
+                    subjects = json.dumps(c3d.data['SUBJECTS'])
+
+                db.execute("INSERT OR REPLACE INTO takes (session_id, task, name, path, size, mtime, date, rate, "
+                           "first_frame, last_frame, points, subjects, range_in, range_out, note) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (sid, item.task, item.get_name(), path, stat.st_size, stat.st_mtime,
+                            date_string(stat.st_mtime), item.data_rate(), first, last, item.points(), subjects,
+                            in_frame, out_frame, item.note))
+
+            remove_missing(db, "takes", sid, paths)
+
+            # maya files
+            paths = []
+            for task in ("cleaning", "solving", "template"):
+                for item in session_obj.getTask(task) or []:
+                    path = os.path.relpath(item.path(), session_path)
+                    paths.append(path)
+                    db.execute("INSERT OR REPLACE INTO maya_files (session_id, task, name, version, path) "
+                               "VALUES (?, ?, ?, ?, ?)", (sid, task, item.name, item.get_version(), path))
+
+            remove_missing(db, "maya_files", sid, paths)
+
+            # json
+            for kind, data in (("range", range_data), ("notes", notes_data)):
+                if data is None:
+                    db.execute("DELETE FROM session_data WHERE session_id=? AND kind=?", (sid, kind))
+                else:
+                    db.execute("INSERT OR REPLACE INTO session_data (session_id, kind, data) VALUES (?, ?, ?)",
+                               (sid, kind, json.dumps(data)))
+
+            db.execute("UPDATE sessions SET date=(SELECT MIN(date) FROM takes WHERE session_id=?) WHERE id=?",
+                       (sid, sid))
+
+    def remove_session(self, base_dir, title):
+        with self.connect() as db:
+            db.execute("DELETE FROM sessions WHERE base_dir=? AND title=?", (base_dir, title))
+
+    def sessions(self, base_dir=None):
+        """ Returns the sessions as a list of dicts (id, base_dir, title, mtime, date) """
+
+        with self.connect() as db:
+            if base_dir is None:
+                rows = db.execute("SELECT * FROM sessions ORDER BY title").fetchall()
+            else:
+                rows = db.execute("SELECT * FROM sessions WHERE base_dir=? ORDER BY title", (base_dir,)).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def takes(self, base_dir=None, session=None, name=None, rate=None, date_from=None, date_to=None,
+              has_task=None, missing_task=None):
+        """ Returns the takes that match all the arguments as a list of dicts, with the session's base_dir and
+        title.  For example the 240Hz takes that have been cleaned but not solved:
+
+            catalog.takes(rate=240, has_task='cleaning', missing_task='solving')
+
+        :param base_dir: base directory of the sessions
+        :param session: session title
+        :param name: take name, may use sql wildcards (%)
+        :param rate: frame rate
+        :param date_from: first date, YYYY-MM-DD
+        :param date_to: last date, YYYY-MM-DD
+        :param has_task: task name or list of task names that must have a maya file for the take
+        :param missing_task: task name or list of task names that must not have a maya file for the take """
+
+        where = []
+        values = []
+
+        for column, op, value in (("s.base_dir", "=", base_dir), ("s.title", "=", session),
+                                  ("t.name", "LIKE", name), ("t.rate", "=", rate),
+                                  ("t.date", ">=", date_from), ("t.date", "<=", date_to)):
+            if value is not None:
+                where.append("%s %s ?" % (column, op))
+                values.append(value)
+
+        exists = "EXISTS (SELECT 1 FROM maya_files m WHERE m.session_id = t.session_id AND m.name = t.name " \
+                 "AND m.task = ?)"
+
+        for tasks, test in ((has_task, exists), (missing_task, "NOT " + exists)):
+            if tasks is None:
+                continue
+            if isinstance(tasks, str):
+                tasks = [tasks]
+            for task in tasks:
+                where.append(test)
+                values.append(task)
+
+        sql = "SELECT t.*, s.base_dir, s.title AS session FROM takes t JOIN sessions s ON s.id = t.session_id"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY s.title, t.name"
+
+        with self.connect() as db:
+            rows = db.execute(sql, values).fetchall()
+
+        ret = []
+        for row in rows:
+            row = dict(row)
+            if row['subjects'] is not None:
+                row['subjects'] = json.loads(row['subjects'])
+            ret.append(row)
+
+        return ret
+
+    def versions(self, base_dir, session, name, task):
+        """ Returns the sorted versions of the maya files for a take in a task directory """
+
+        with self.connect() as db:
+            rows = db.execute("SELECT m.version FROM maya_files m JOIN sessions s ON s.id = m.session_id "
+                              "WHERE s.base_dir=? AND s.title=? AND m.name=? AND m.task=? AND m.version IS NOT NULL "
+                              "ORDER BY m.version", (base_dir, session, name, task)).fetchall()
+
+        return [row[0] for row in rows]
+
+    def session_data(self, base_dir, session, kind):
+        """ Returns the range ('range') or notes ('notes') json of a session, or None """
+
+        with self.connect() as db:
+            row = db.execute("SELECT d.data FROM session_data d JOIN sessions s ON s.id = d.session_id "
+                             "WHERE s.base_dir=? AND s.title=? AND d.kind=?", (base_dir, session, kind)).fetchone()
+
+        if row is None or row[0] is None:
+            return None
+
+        return json.loads(row[0])
+
+
+def file_stat(item):
+    """ Returns the stat of a mocapData.File, from its directory entry if it has one """
+
+    try:
+        entry = getattr(item, 'entry', None)
+        if entry is not None:
+            return entry.stat()
+        return os.stat(item.path())
+    except OSError:
+        return None
+
+
+def date_string(mtime):
+    return datetime.date.fromtimestamp(mtime).isoformat()
+
+
+def remove_missing(db, table, session_id, paths):
+    """ Deletes the rows of the session that do not have one of the paths """
+
+    existing = [row[0] for row in db.execute("SELECT path FROM %s WHERE session_id=?" % table, (session_id,))]
+    removed = set(existing) - set(paths)
+    db.executemany("DELETE FROM %s WHERE session_id=? AND path=?" % table, [(session_id, i) for i in removed])
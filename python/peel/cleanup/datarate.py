@@ -2,8 +2,16 @@
 # GPL License = http://www.gnu.org/licenses/gpl.txt 
 
 
-import maya.cmds as m
-import maya.OpenMaya as om
+try:
+    import maya.cmds as m
+    import maya.OpenMaya as om
+except ImportError:
+    # the rates are read from the in memory scene (util.scene) outside of maya
+    m = om = None
+
+import numpy as np
+
+from peel.util import scene
 
 
 INTERVAL = None
@@ -33,7 +41,7 @@ def setSceneRate( fps = None ) :
         
     
 def mayaUnit() :
-    return om.MTime( 1, om.MTime.kSeconds).asUnits( om.MTime.uiUnit() )
+    return scene.get().fps()
 
 def framesPerSecond( interval ) :
 
@@ -56,7 +64,7 @@ def keysPerFrame( dataRate ) :
     120fps, this will return 0.2 ( 24.0/120.0 ) '''
     if dataRate is None or abs(dataRate) < 0.01 :
         raise ValueError("Invalid data rate: " + str(dataRate) + " - common values are 48.0, 120.0 or 240.0 )")
-    return  om.MTime( 1/ dataRate, om.MTime.kSeconds).asUnits( om.MTime.uiUnit() )
+    return  mayaUnit() / dataRate
 
 
 
@@ -77,9 +85,13 @@ def get(node) :
 
     guessed = guess()
     if guessed is None or guessed < 0.0001 :
-        m.warning("Could not determine interval for: " + str(node) )
+        scene.warning("Could not determine interval for: " + str(node) )
         return None
 
+    if m is None :
+        # no one to ask outside of maya
+        return guessed
+
     fps = framesPerSecond( guessed )
 
     if m.confirmDialog(m="No datarate set for: " + node + " Set as: " + str(fps), b=['Yes', 'No']) == "Yes" :
@@ -95,40 +107,35 @@ def guess(nodes = None) :
     ''' returns a guess for the current framerate of the data, as a fraction of a frame.
         The keys are sampled for the intervals and the most common interval is returned '''
 
-    deltas = {}
+    scn = scene.get()
+
+    if isinstance(nodes, str) : nodes = [nodes]
 
-    if type(nodes) in [ str, unicode ] : nodes = [nodes]
+    if nodes is None : nodes = scn.markers()
 
-    if nodes is None : nodes = m.ls(type = "peelSquareLocator")
+    channels = []
 
     for mkr in nodes :
 
-        if m.nodeType(mkr) == "peelSquareLocator" :
+        if m is not None and m.nodeType(mkr) == "peelSquareLocator" :
             mkr = m.listRelatives(mkr, p=True, f=True)[0]
-            
-            if m.objExists(mkr + ".C3dRate") : 
-                val = m.getAttr( mkr + ".C3dRate" )
-                if val > 0 : return keysPerFrame(val)
 
-        if not m.objExists (mkr + ".tx") : continue
+        val = scn.get_attr( mkr + ".C3dRate" )
+        if val is not None and val > 0 : return keysPerFrame(val)
 
-        keys = m.keyframe( mkr + ".tx", q=True )
-        if keys is None : continue
+        if not scn.exists( mkr + ".tx" ) : continue
 
-        keys = sorted(keys)
+        channels.append( mkr + ".tx" )
 
-        for i in range(1, len(keys)) :
-            diff = round( keys[i] - keys[i-1], 4)
-            if diff not in deltas :
-                deltas[diff] = 1
-            else :
-                deltas[diff] = deltas[diff] + 1
+    keys = scn.fetch_keys( channels )
+    deltas = [ np.round( np.diff( keys[i][0] ), 4 ) for i in channels ]
+    deltas = np.concatenate( deltas + [ np.zeros(0) ] )
 
     if len(deltas) == 0 : return None
 
-    x = sorted( deltas, key = lambda v : deltas[v] )
+    values, counts = np.unique( deltas, return_counts=True )
 
-    return x[-1]
+    return float( values[ np.argmax(counts) ] )
 
 def channelRate( chan ) :
 
@@ -152,8 +159,9 @@ def nodeRate( node ) :
 
     ''' returns the value of node.C3dRate, which is usually created by the peel c3d importer '''
 
-    if m.objExists( node + ".C3dRate" ) :
-        return keysPerFrame( m.getAttr( node + ".C3dRate" ) )
+    rate = scene.get().get_attr( node + ".C3dRate" )
+    if rate is not None :
+        return keysPerFrame( rate )
 
     return None
 
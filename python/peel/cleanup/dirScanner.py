@@ -0,0 +1,134 @@
+# Mocap Cleanup - Alastair Macleod 2016
+# GPL License = http://www.gnu.org/licenses/gpl.txt
+
+import os
+import stat
+import threading
+
+"""
+Directory Scanner Module
+
+Lists directories with os.scandir and remembers each listing along with the mtime of the directory.
+Scanning a directory again only costs a single stat while its mtime is unchanged, the previous listing
+(and the stat results cached on its os.DirEntry objects) is returned with an empty delta.
+
+The mtime of a directory changes when entries are added, removed or renamed, not when a file in it is
+rewritten in place.  Call clear() to force the next scans to read every directory again.
+
+A DirScanner can be shared between threads, e.g. forget() on the ui thread while a session is parsed on a
+background thread, the cached listings are only changed while holding its lock.
+
+"""
+
+
+class Delta(object):
+    """ Names added to and removed from a directory since it was last scanned """
+
+    def __init__(self, added=None, removed=None):
+        self.added = added or []
+        self.removed = removed or []
+
+    def __bool__(self):
+        return len(self.added) > 0 or len(self.removed) > 0
+
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        return "Added: %d  Removed: %d" % (len(self.added), len(self.removed))
+
+
+class Listing(object):
+    """ The contents of a directory, entries is a dict of name: os.DirEntry """
+
+    def __init__(self, path, mtime, entries):
+        self.path = path
+        self.mtime = mtime
+        self.entries = entries
+
+    def is_dir(self, name):
+        entry = self.entries.get(name)
+        return entry is not None and entry.is_dir()
+
+    def dirs(self):
+        """ Sorted names of the sub directories """
+        return sorted(name for name, entry in self.entries.items() if entry.is_dir())
+
+    def files(self, extensions=None):
+        """ Sorted list of os.DirEntry for the files, optionally only those with one of the (lower case)
+        extensions, e.g. ['.c3d'] """
+
+        ret = []
+        for name in sorted(self.entries):
+            entry = self.entries[name]
+            if not entry.is_file():
+                continue
+            if extensions is not None and os.path.splitext(name)[1].lower() not in extensions:
+                continue
+            ret.append(entry)
+
+        return ret
+
+
+class DirScanner(object):
+    """ Caches directory listings by directory mtime """
+
+    def __init__(self):
+        self.listings = {}
+        self.lock = threading.RLock()
+
+    def clear(self):
+        with self.lock:
+            self.listings = {}
+
+    def get(self, path):
+        """ Returns the cached listing of path without checking the directory, or None """
+        with self.lock:
+            return self.listings.get(path)
+
+    def scan(self, path):
+        """ Returns (listing, delta) for the directory.  If the directory has not changed since it was last
+        scanned the cached listing is returned without reading it.  If path is not a directory the listing
+        is None and the delta has the names that were removed """
+
+        previous = self.get(path)
+
+        try:
+            st = os.stat(path)
+            is_dir = stat.S_ISDIR(st.st_mode)
+        except OSError:
+            is_dir = False
+
+        if not is_dir:
+            with self.lock:
+                self.listings.pop(path, None)
+            return None, Delta(removed=[] if previous is None else sorted(previous.entries))
+
+        if previous is not None and previous.mtime == st.st_mtime:
+            return previous, Delta()
+
+        try:
+            entries = dict((entry.name, entry) for entry in os.scandir(path))
+        except OSError as e:
+            print("Could not read directory: " + str(path) + "  " + str(e))
+            with self.lock:
+                self.listings.pop(path, None)
+            return None, Delta(removed=[] if previous is None else sorted(previous.entries))
+
+        listing = Listing(path, st.st_mtime, entries)
+        with self.lock:
+            self.listings[path] = listing
+
+        if previous is None:
+            return listing, Delta(added=sorted(entries))
+
+        added = sorted(set(entries) - set(previous.entries))
+        removed = sorted(set(previous.entries) - set(entries))
+        return listing, Delta(added, removed)
+
+    def forget(self, path):
+        """ Removes the cached listing of path and every directory under it """
+
+        prefix = os.path.join(path, "")
+        with self.lock:
+            for key in [i for i in self.listings if i == path or i.startswith(prefix)]:
+                del self.listings[key]
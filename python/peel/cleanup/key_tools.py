@@ -1,12 +1,16 @@
 # Mocap Cleanup - Alastair Macleod 2016
 # GPL License = http://www.gnu.org/licenses/gpl.txt 
 
-import maya.cmds as m
-import maya.mel as mel
-
-import bisect
+try:
+    import maya.cmds as m
+    import maya.mel as mel
+except ImportError:
+    # the array functions work on the in memory scene (util.scene) outside of maya
+    m = mel = None
+
+import numpy as np
 from peel.cleanup import datarate
-from peel.util import curve
+from peel.util import curve, scene
 import math
 
 
@@ -165,6 +169,25 @@ def fix_name(node):
     return fixed[0]
 
 
+def active_keys(times, interval):
+    """ returns (times, values) of the stepped keys for the .active channel of a marker with keys at times,
+    1 from the first key of each segment and 0 one interval after the last """
+
+    times = np.unique(np.asarray(times, dtype=np.float64))
+    if len(times) == 0:
+        return times, times
+
+    gaps = np.flatnonzero(np.abs(np.diff(times) - interval) > 0.1)
+
+    on = np.concatenate(([times[0]], times[gaps + 1]))
+    off = np.concatenate(([times[0] - interval], times[gaps] + interval, [times[-1] + interval]))
+
+    key_times = np.concatenate((off, on))
+    key_values = np.concatenate((np.zeros(len(off)), np.ones(len(on))))
+    order = np.argsort(key_times, kind='stable')
+    return key_times[order], key_values[order]
+
+
 def set_active_keys(node, delete=False):
     print("Setting active on : " + str(node) + " delete is: " + str(delete))
 
@@ -174,73 +197,51 @@ def set_active_keys(node, delete=False):
     the marker from a square to a cross in the display.
     """
 
-    try:
-        node = fix_name(node)
-    except RuntimeError as e:
-        m.warning(str(e))
-        return
+    scn = scene.get()
+
+    if m is not None:
+        try:
+            node = fix_name(node)
+        except ValueError as e:
+            m.warning(str(e))
+            return
+
+        if m.nodeType(node) != "transform":
+            m.warning("Not a transform while setting active: " + str(node) + '  ' + str(m.nodeType(node)))
+            return
 
     interval = datarate.get(node)
     if interval is None:
-        m.warning("No interval for node while setting active keys: " + str(node))
-        return
-
-    if m.nodeType(node) != "transform":
-        m.warning("Not a transform while setting active: " + str(node) + '  ' + str(m.nodeType(node)))
+        scene.warning("No interval for node while setting active keys: " + str(node))
         return
 
-    if not m.objExists(node):
-        m.warning("Object does not exist while setting active: " + str(node))
+    if not scn.exists(node):
+        scene.warning("Object does not exist while setting active: " + str(node))
         return
 
-    if not m.objExists(node + ".active"):
-        m.warning("Object does not have active channel while setting active keys: " + str(node))
+    if not scn.exists(node + ".active"):
+        scene.warning("Object does not have active channel while setting active keys: " + str(node))
         return
 
     # check the tx time values
-    times = m.keyframe(node + ".tx", q=True, timeChange=True)
-    if times is None:
+    times = scn.fetch_keys([node + ".tx"])[node + ".tx"][0]
+    if len(times) == 0:
 
         print("No keys on: " + str(node))
 
-        conn = m.listConnections(node, d=True, s=False, type='PeelLine', p=True)
-        if delete and (conn is None or len(conn) == 0):
+        conn = None if m is None else m.listConnections(node, d=True, s=False, type='PeelLine', p=True)
+        if delete and m is not None and (conn is None or len(conn) == 0):
             m.delete(node)
         else:
-            m.cutKey(node + '.active')
-            m.setAttr(node + '.active', 0)
+            scn.delete_keys([node + '.active'])
+            scn.set_attr(node + '.active', 0)
         return
 
-    times = sorted(times)
-
-    if len(times) == 0: return
+    # set the active channel when the state changes (stepped)
+    scn.set_keys({node + '.active': active_keys(times, interval)}, stepped=True)
 
-    cdata = curve.fcurve(node, "atv")
-
-    # iterate over each frame and set the active channel when the state changes (stepped)
-    last_frame = None
-
-    for frame in times:
-
-        if last_frame is None:
-            # first frame
-            cdata.data[frame - interval] = 0.0
-            cdata.data[frame] = 1.0
-        else:
-            gapsize = frame - last_frame
-
-            if abs(gapsize - interval) > 0.1:
-                # print str( gapsize ) + '   ' + str(interval) + '  ' + str(  abs(gapsize - interval) ) + '    ' + str(frame)
-                cdata.data[last_frame + interval] = 0.0
-                cdata.data[frame] = 1.0
-
-        last_frame = frame
-
-    cdata.data[times[-1] + interval] = 0
-
-    cdata.apply(stepped=True)
-
-    m.dgdirty(node)
+    if m is not None:
+        m.dgdirty(node)
 
 
 def goto_next_gap():
@@ -271,18 +272,46 @@ def next_gap(item=None, current_time=None):
         return
 
     step = datarate.get(item)
-    times = sorted(m.keyframe(item + ".tx", q=True))
+    if step is None:
+        return None
 
-    if current_time is None: current_time = m.currentTime(q=True)
+    if current_time is None: current_time = scene.get().current_time()
 
-    # for each key-time
-    for i in range(0, len(times) - 1):
+    return curve.gap_index(item + ".tx", step).next_gap(current_time)
 
-        if times[i] < current_time or times[i + 1] - times[i] <= step * 1.95:
-            continue
-        return times[i], times[i + 1]
 
-    return None
+def goto_previous_gap():
+    """ Moves the timeline to the previous gap in .tx """
+
+    gap = previous_gap()
+    if gap is not None:
+        (start, end) = gap
+        m.currentTime(start + (end - start) / 2)
+
+
+def previous_gap(item=None, current_time=None):
+    """
+    Finds the last gap before the current time in the .tx of the current selection
+    @param item: the node to search on
+    @param current_time: time to start the search
+    """
+
+    try:
+        if item is None:
+            item = get_item()
+        if item is None:
+            return
+    except ValueError as e:
+        print("Could not find previous gap: " + str(e))
+        return
+
+    step = datarate.get(item)
+    if step is None:
+        return None
+
+    if current_time is None: current_time = scene.get().current_time()
+
+    return curve.gap_index(item + ".tx", step).previous_gap(current_time)
 
 
 def select_current(id=""):
@@ -749,9 +778,7 @@ def select_empty(threshold=4):
 
 
 def all_markers():
-    markers = m.ls(type='peelSquareLocator', l=True)
-    if markers is None: return []
-    return [m.listRelatives(i, p=True, f=True)[0] for i in markers]
+    return scene.get().markers()
 
 
 def toggle_connect_vis(markers=None, force=None):
@@ -848,42 +875,44 @@ def fill_gap(fill_obj=None, src_obj=None):
         print("Could not find gap to fill")
         return
 
-    # get the values for the keys at the gap
-    gapval = [
-        m.keyframe(fill_obj + ".tx", q=True, time=(start, end), vc=True),
-        m.keyframe(fill_obj + ".ty", q=True, time=(start, end), vc=True),
-        m.keyframe(fill_obj + ".tz", q=True, time=(start, end), vc=True)]
-
-    # get the curve to paste in
-    curve = [
-        m.keyframe(src_obj + ".tx", q=True, time=(start, end), vc=True, tc=True),
-        m.keyframe(src_obj + ".ty", q=True, time=(start, end), vc=True, tc=True),
-        m.keyframe(src_obj + ".tz", q=True, time=(start, end), vc=True, tc=True)]
+    scn = scene.get()
+    chan = [".tx", ".ty", ".tz"]
 
-    startOffset = [
-        gapval[0][0] - curve[0][1],
-        gapval[1][0] - curve[1][1],
-        gapval[2][0] - curve[2][1]]
+    # the keys either side of the gap, and the curve to paste in
+    gap_keys = scn.fetch_keys([fill_obj + i for i in chan], (start, end))
+    src_keys = scn.fetch_keys([src_obj + i for i in chan], (start, end))
 
-    endOffset = [
-        gapval[0][-1] - curve[0][-1],
-        gapval[1][-1] - curve[1][-1],
-        gapval[2][-1] - curve[2][-1]]
+    keys = {}
+    for i in chan:
+        gap_values = gap_keys[fill_obj + i][1]
+        times, values = src_keys[src_obj + i]
+        if len(gap_values) == 0 or len(times) == 0:
+            print("No keys to fill from on " + src_obj + i)
+            return
 
-    chan = [".tx", ".ty", ".tz"]
+        # offset the source so it meets the keys at each end of the gap
+        start_offset = gap_values[0] - values[0]
+        end_offset = gap_values[-1] - values[-1]
+        progress = (times - start) / (end - start)
+        keys[fill_obj + i] = (times, values + start_offset + progress * (end_offset - start_offset))
 
-    for i in range(0, 3):
-        it = iter(curve[i])
-        for k, v in zip(it, it):
-            progress = (k - start) / (end - start)
-            addval = startOffset[i] + progress * (endOffset[i] - startOffset[i])
-            m.setKeyframe(fill_obj + chan[i], t=k, value=v + addval)
-            if i == 1 and m.objExists(fill_obj + ".active"):
-                m.setKeyframe(fill_obj + ".active", t=k, value=1)
+    scn.set_keys(keys, replace=False)
 
     set_active_keys(fill_obj)
 
 
+def linear_fill(times, values, step):
+    """ returns (times, values) of the keys every step between the first and last of the keys, on a line
+    between their values """
+
+    start = times[0]
+    end = times[-1]
+    count = int(np.floor((end - start) / step - 1 + 1e-6))
+    fill_times = start + step * np.arange(1, max(count, 0) + 1)
+    progress = (fill_times - start) / (end - start)
+    return fill_times, values[0] + (values[-1] - values[0]) * progress
+
+
 def fill_gap_linear(item=None, step=None, start=None, end=None):
     try:
         if item is None: item = get_item()
@@ -896,22 +925,19 @@ def fill_gap_linear(item=None, step=None, start=None, end=None):
         return
 
     fill_obj = item
-
-    gapval = [
-        m.keyframe(fill_obj + ".tx", q=True, time=(start, end), vc=True),
-        m.keyframe(fill_obj + ".ty", q=True, time=(start, end), vc=True),
-        m.keyframe(fill_obj + ".tz", q=True, time=(start, end), vc=True)]
+    scn = scene.get()
 
     chan = [".tx", ".ty", ".tz"]
+    gap_keys = scn.fetch_keys([fill_obj + i for i in chan], (start, end))
 
-    ktime = 0
-    for i in range(0, 3):
-        ktime = start + step
-        while ktime <= end - step:
-            progress = (ktime - start) / (end - start)
-            kvalue = (gapval[i][-1] - gapval[i][0]) * progress + gapval[i][0]
-            m.setKeyframe(fill_obj + chan[i], t=ktime, value=kvalue)
-            ktime = ktime + step
+    keys = {}
+    for channel, (times, values) in gap_keys.items():
+        if len(times) == 0:
+            print("No keys at the gap on " + channel)
+            return
+        keys[channel] = linear_fill(times, values, step)
+
+    scn.set_keys(keys, replace=False)
 
     set_active_keys(fill_obj)
 
@@ -959,25 +985,28 @@ def fill(src=None, dst=None):
 
 def fill_channel(gapChannel, fillChannel=None, currentTime=None):
     if currentTime is None:
-        currentTime = m.currentTime(q=True)
+        currentTime = scene.get().current_time()
 
     # get keyframes for the channel that has the gap
     gap_curve_obj = curve.fcurve(*gapChannel.split('.'))
     gap_curve_obj.fetch()
-    gap_curve_keys = gap_curve_obj.keys()  # returns the time values as a sorted list
+    gap_curve_keys = gap_curve_obj.times  # sorted array of the key times
 
     # find the left and right keys of the gap (prev, next)
-    # bisect_left returns the index in the keys list 
-    gap_index = bisect.bisect_left(gap_curve_keys, currentTime)
+    # searchsorted returns the index in the keys array, the same as bisect_left
+    gap_index = int(np.searchsorted(gap_curve_keys, currentTime))
+    if gap_index == 0 or gap_index >= len(gap_curve_keys):
+        raise RuntimeError("Current time is not in a gap on " + gapChannel)
+
     gap_left_key = gap_curve_keys[gap_index - 1]
     gap_right_key = gap_curve_keys[gap_index]
     gap_range_key = gap_right_key - gap_left_key
 
-    gap_left_value = gap_curve_obj[gap_left_key]
-    gap_right_value = gap_curve_obj[gap_right_key]
+    gap_left_value = gap_curve_obj.values[gap_index - 1]
+    gap_right_value = gap_curve_obj.values[gap_index]
 
     # how much does the data change within the gap
-    gap_range_value = gap_curve_obj[gap_right_key] - gap_curve_obj[gap_left_key]
+    gap_range_value = gap_right_value - gap_left_value
 
     if fillChannel is None:
 
@@ -992,13 +1021,9 @@ def fill_channel(gapChannel, fillChannel=None, currentTime=None):
         print(time_range)
         print(value_step)
 
-        key = gap_left_key + rate
-        value = gap_left_value + value_step
-
-        while key < gap_right_key:
-            m.setKeyframe(gapChannel, v=value, t=key)
-            key += rate
-            value += value_step
+        steps = np.arange(1, int(np.ceil(time_range / rate - 1e-6)))
+        new_keys = gap_left_key + steps * rate
+        new_values = gap_left_value + steps * value_step
 
     else:
 
@@ -1007,58 +1032,47 @@ def fill_channel(gapChannel, fillChannel=None, currentTime=None):
         # get the data to fill with
         fill_curve_obj = curve.fcurve(*fillChannel.split('.'))
         fill_curve_obj.fetch()
-        fill_curve_keys = fill_curve_obj.keys()
+        fill_curve_keys = fill_curve_obj.times
 
         # find the start end of the data being used to fill with 
-        fill_left_index = bisect.bisect_left(fill_curve_keys, gap_left_key)
-        fill_right_index = bisect.bisect_right(fill_curve_keys, gap_right_key) - 1
+        fill_left_index = int(np.searchsorted(fill_curve_keys, gap_left_key, side='left'))
+        fill_right_index = int(np.searchsorted(fill_curve_keys, gap_right_key, side='right')) - 1
 
-        if fill_right_index > len(fill_curve_keys):
-            m.error("Not enough keys for fill")
-            return
+        if fill_right_index >= len(fill_curve_keys) or fill_left_index >= fill_right_index:
+            raise RuntimeError("Not enough keys for fill")
 
         if fill_left_index + 1 == fill_right_index:
-            m.error("No keys to fill")
-            return
+            raise RuntimeError("No keys to fill")
 
-        fill_left_key = fill_curve_keys[fill_left_index]
-        fill_right_key = fill_curve_keys[fill_right_index]
-        fill_range_key = fill_right_key - fill_left_key
-
-        fill_left_value = fill_curve_obj[fill_left_key]
-        fill_right_value = fill_curve_obj[fill_right_key]
+        fill_left_value = fill_curve_obj.values[fill_left_index]
+        fill_right_value = fill_curve_obj.values[fill_right_index]
         fill_range_value = fill_right_value - fill_left_value
 
         # print "Gap:         %f-%f  Range: %f" % (gap_left_key,    gap_right_key,    gap_range_key)
         # print "Gap Values:  %f-%f  Range: %f" % (gap_left_value,  gap_right_value,  gap_range_value)
-        # print "Fill:        %f-%f  Range: %f" % (fill_left_key,   fill_right_key,   fill_range_key)
-        # print "Fill Values: %f-%f  Range: %f" % (fill_left_value, fill_right_value, fill_range_value)
 
-        for i in range(fill_left_index, fill_right_index):
-            this_key = fill_curve_keys[i]
-            key_progress = (this_key - gap_left_key) / gap_range_key
+        new_keys = fill_curve_keys[fill_left_index:fill_right_index]
+        key_progress = (new_keys - gap_left_key) / gap_range_key
 
-            this_value = fill_curve_obj[this_key]
-            normalized_fill = this_value - fill_left_value - (key_progress * fill_range_value)
+        this_value = fill_curve_obj.values[fill_left_index:fill_right_index]
+        normalized_fill = this_value - fill_left_value - (key_progress * fill_range_value)
 
-            new_value = gap_left_value + normalized_fill + key_progress * gap_range_value
+        new_values = gap_left_value + normalized_fill + key_progress * gap_range_value
 
-            m.setKeyframe(gapChannel, v=new_value, t=this_key)
+    scene.get().set_keys({gapChannel: (new_keys, new_values)}, replace=False)
 
 
 def find_current_gap(node, currentTime=None):
     if currentTime is None:
-        currentTime = m.currentTime(q=True)
+        currentTime = scene.get().current_time()
 
     # find start and end of the gap
-    gapkeys = sorted(m.keyframe(node + ".tx", q=True))
-    prev = None
-    for i in gapkeys:
-        if i > currentTime:
-            return (prev, i)
-        prev = i
-
-    raise ValueError("Could not find current range")
+    gapkeys = scene.get().fetch_keys([node + ".tx"])[node + ".tx"][0]
+    i = np.searchsorted(gapkeys, currentTime, side='right')
+    if i == len(gapkeys):
+        raise ValueError("Could not find current range")
+
+    return (float(gapkeys[i - 1]) if i > 0 else None, float(gapkeys[i]))
 
 
 def copy_fill_gap(source, target):
@@ -9,7 +9,7 @@ from functools import partial
 
 from peel.cleanup.Qt import QtWidgets, QtCore
 import maya.cmds as m_cmds
-from peel.cleanup import buildCleaning, buildSolving, gui, mocapData, actions, markerset
+from peel.cleanup import buildCleaning, buildSolving, gui, mocapData, actions, markerset, catalog, watcher
 from peel.util import roots
 import peel
 
@@ -108,6 +108,7 @@ class Loader(baseclass1, baseclass2):
         self.setWindowTitle("Mocap Loader")
 
         self.parser = parser
+        self.watcher = None
 
         if self.parser is None:
             # get the current base_dir (set by the menu option)
@@ -118,9 +119,7 @@ class Loader(baseclass1, baseclass2):
                 self.parser = None
 
         if self.parser:
-            self.parser.message.connect(self.get_message)
-            self.parser.error.connect(self.get_error)
-            self.parser.progress.connect(self.get_progress)
+            self.connect_parser()
 
         markerset.load_all()
 
@@ -422,7 +421,10 @@ class Loader(baseclass1, baseclass2):
 
         self.log.append("Setting directory to: " + ret)
         m_cmds.optionVar(stringValue=("peelLoaderDirectory", ret))
+        if self.parser is not None:
+            self.parser.shutdown()
         self.parser = mocapData.Parser(ret)
+        self.connect_parser()
         self.populate_session_combobox()
 
         # Add to recent
@@ -555,6 +557,76 @@ class Loader(baseclass1, baseclass2):
         # populate
         self.update_lists()
 
+    def connect_parser(self):
+        """ Connects the parser's signals to the log, progress window and session lists """
+        self.parser.message.connect(self.get_message)
+        self.parser.error.connect(self.get_error)
+        self.parser.progress.connect(self.get_progress)
+        self.parser.sessionParsed.connect(self.session_parsed)
+
+        # the table shows the rate and range of every take, so read the headers on the parse thread
+        self.parser.prefetch = True
+
+        # keep the catalog up to date with each session that is parsed
+        try:
+            self.parser.catalog = catalog.Catalog()
+        except (catalog.sqlite3.Error, OSError) as e:
+            print("Could not open the catalog: " + str(e))
+
+        # update the lists as files are added, removed or changed
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.watcher = watcher.Watcher(self.parser.base_dir)
+        self.watcher.sessionsChanged.connect(self.sessions_changed)
+        self.watcher.filesChanged.connect(self.files_changed)
+        self.watcher.start()
+
+    def sessions_changed(self, delta):
+        """ Called by the watcher when session directories are added or removed
+        :param delta: the session titles added and removed
+        :type delta: dirScanner.Delta """
+
+        self.log.append("Sessions changed: " + str(delta))
+        self.populate_session_combobox()
+
+    def files_changed(self, title, paths):
+        """ Called by the watcher when files in a session have been added, removed or modified.  The current
+        session is parsed again in the background, other sessions are updated when they are selected.
+        :param title: session title
+        :type title: str
+        :param paths: full paths of the files that have changed
+        :type paths: list """
+
+        if self.parser is None:
+            return
+
+        self.parser.invalidate(paths)
+
+        this_session = self.get_session()
+        if this_session is not None and this_session.title == title:
+            self.parser.parseSessionAsync(this_session, True)
+
+    def showEvent(self, event):
+        if self.watcher is not None:
+            self.watcher.start()
+        super(Loader, self).showEvent(event)
+
+    def closeEvent(self, event):
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.parser is not None:
+            self.parser.cancel()
+        super(Loader, self).closeEvent(event)
+
+    def query_takes(self, **kwargs):
+        """ Returns the takes under the base directory from the catalog without reading the directories,
+        e.g. query_takes(rate=240, has_task='cleaning', missing_task='solving'), see catalog.Catalog.takes """
+
+        if self.parser is None or self.parser.catalog is None:
+            return []
+
+        return self.parser.catalog.takes(base_dir=self.parser.base_dir, **kwargs)
+
     def get_session(self):
         """ Returns the session info of the current selection in the session dropdown(combobox).
         :return session_obj : An object containing the session name and session id. If parser none, returns none.
@@ -566,13 +638,14 @@ class Loader(baseclass1, baseclass2):
     def update_lists(self, _=None):
         """ Updates the mocap table, reference list and character list, based on the selected session.
         Updates self.mocap_table, self.reference_list and self.character_list based on the current
-        tasks - uses data from self.data.sessions[self.selector.currentIndex()] (mocapData.Session) """
+        tasks - uses data from self.data.sessions[self.selector.currentIndex()] (mocapData.Session)
+
+        The session is parsed in the background (cancelling the session that was being parsed) and the lists
+        are filled in by session_parsed when it is ready.  Sessions that have been parsed before are shown
+        straight away and updated if anything has changed. """
 
         # clear current contents
-        self.mocap_table.clearContents()
-        self.mocap_table.setRowCount(0)
-        # self.reference_list.clear()
-        self.character_list.clear()
+        self.clear_lists()
 
         if self.parser is None:
             return
@@ -582,10 +655,38 @@ class Loader(baseclass1, baseclass2):
 
         # mocapData.Session object:
         this_session = self.get_session()
+        if this_session is None:
+            return
+
+        if this_session.parsed:
+            self.populate_lists(this_session)
+
+        self.parser.parseSessionAsync(this_session, True)
+
+    def session_parsed(self, session):
+        """ Called when the parser has finished reading a session, refreshes the lists if it is still current
+        :param session: the session that was parsed
+        :type session: mocapData.Session """
+
+        if session is not self.get_session():
+            return
+
+        self.clear_lists()
+        self.populate_lists(session)
+
+    def clear_lists(self):
+        self.mocap_table.clearContents()
+        self.mocap_table.setRowCount(0)
+        # self.reference_list.clear()
+        self.character_list.clear()
+
+    def populate_lists(self, this_session):
+        """ Fills the mocap table and character list from the tasks of the session
+        :param this_session: session to display
+        :type this_session: mocapData.Session """
 
         try:
             gui.wait(True)
-            self.parser.parseSession(this_session, True)
 
             # task dropdown
             task = self.task_selector_combobox.currentText()
@@ -616,8 +717,10 @@ class Loader(baseclass1, baseclass2):
         :param item: C3DFile object, containing data pertaining to the c3d file.
         :type item: object of class C3DFile """
 
+        # a take whose header could not be read has no rate, its row is added with 'Error' in the columns
+        # that need one
         rate = item.data_rate()
-        rate_scale = float(self.fps_selector.currentText()) / rate
+        rate_scale = float(self.fps_selector.currentText()) / rate if rate else None
 
         self.mocap_table.blockSignals(True)  # don't emit a frame range change event to cause a save
 
@@ -641,17 +744,19 @@ class Loader(baseclass1, baseclass2):
 
             # column 3: number of frames in range
             start, end = item.range()
-            if start is not None and end is not None:
+            if start is not None and end is not None and rate_scale is not None:
                 length = (end - start) * rate_scale
                 self.mocap_table.setItem(row_number, 3, gui.table_item(str(length)))
             else:
                 self.mocap_table.setItem(row_number, 3, gui.table_item('Error'))
 
             # column 4: data rate
-            self.mocap_table.setItem(row_number, 4, gui.table_item(str(rate)))
+            self.mocap_table.setItem(row_number, 4, gui.table_item(str(rate) if rate else 'Error'))
 
             # columns 5, 6: in-frame, out-frame
-            if item.frame_range is not None:
+            if rate_scale is None:
+                print("No rate for: " + item.get_name())
+            elif item.frame_range is not None:
                 in_frame, out_frame = item.frame_range
                 if in_frame is not None:
                     in_val = int(math.floor(in_frame * rate_scale))
@@ -663,7 +768,7 @@ class Loader(baseclass1, baseclass2):
                 print("No range for:" + item.get_name())
 
             # column 7: subjects
-            if 'SUBJECTS' in item.c3d_file.data:
+            if item.c3d_file is not None and 'SUBJECTS' in item.c3d_file.data:
                 subjects = item.c3d_file.data['SUBJECTS']
                 if 'LABEL_PREFIXES' in subjects:
                     prefixes = [word.rstrip() for word in subjects['LABEL_PREFIXES']]
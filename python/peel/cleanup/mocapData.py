@@ -6,10 +6,13 @@ import re
 import json
 import struct
 import traceback
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from peel.cleanup.Qt import QtCore
 
-from peel.cleanup import c3dParser
+from peel.cleanup import c3dParser, c3dIndex, dirScanner, catalog
 
 """
 Mocap Data Module
@@ -17,12 +20,13 @@ Mocap Data Module
 This module contains classes representing instances of motion capture data
 
  * File - Base Class 
- *   C3DFile - Instance of a c3d file
+ *   C3DFile - Instance of a c3d file, the header is read when it is first used
  *   MayaFile - Instance of a maya file (ma/mb)
  * Character - Motion Capture data gets solved on to a character
  * Session - Files are grouped by session
  * Data - QObject that holds a list of sessions, list of character and characterGroups
  * Parser - QObject base class for data parsers that generate Data
+ * ParseJob - A session being parsed on the Parser's background thread
 
 """
 
@@ -98,11 +102,46 @@ class File(object):
         return None  # ?? Is it because it is in the stub? What about (raise NotImplementedError?) revisit. yes raise...
 
 
+class HeaderCache(object):
+    """ Thread safe LRU of parsed c3d headers (c3dParser.C3D) by path, shared by every C3DFile """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.headers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            c3d = self.headers.get(path)
+            if c3d is not None:
+                self.headers.move_to_end(path)
+            return c3d
+
+    def put(self, path, c3d):
+        with self.lock:
+            self.headers[path] = c3d
+            self.headers.move_to_end(path)
+            while len(self.headers) > self.max_size:
+                self.headers.popitem(last=False)
+
+    def discard(self, path):
+        with self.lock:
+            self.headers.pop(path, None)
+
+    def clear(self):
+        with self.lock:
+            self.headers.clear()
+
+
+HEADERS = HeaderCache(5000)
+
+
 class C3DFile(File):
-    """ A C3d file that exists on disk somewhere. """
+    """ A C3d file that exists on disk somewhere.  The header (c3d_file) is read the first time it is needed,
+    from the shared HEADERS cache, the session's c3dIndex or the file itself. """
 
-    def __init__(self, is_local, session_dir, task, file_name, extension):
-        """ Copies the parameter values into class variables. Calls methods to load the file and read the header data.
+    def __init__(self, is_local, session_dir, task, file_name, extension, c3d_file=None, index=None, entry=None):
+        """ Copies the parameter values into class variables.  The header data is loaded when it is first used.
         :param is_local: probably indicates whether the C3D file is stored locally or on th web  #?? not used yet.
         :type is_local: bool
         :param session_dir: Path to the folder containing the session files.
@@ -112,18 +151,85 @@ class C3DFile(File):
         :param file_name: Name of the file
         :type file_name: str
         :param extension: File type
-        :type extension: str """
+        :type extension: str
+        :param c3d_file: Header that has already been parsed
+        :type c3d_file: c3dParser.C3D
+        :param index: The session's index, checked before reading the file
+        :type index: c3dIndex.C3DIndex
+        :param entry: The file's entry in the directory listing, used to validate the index
+        :type entry: os.DirEntry """
         super(C3DFile, self).__init__(session_dir, task, file_name, extension)
         self.is_local = is_local
-        self.frame_range = None
         self.note = None
-        self.c3d_file = None
+        self.index = index
+        self.entry = entry
 
         self.info = {}
 
-        if self.exists():
-            self.c3d_file = c3dParser.load(self.path())
-            self.frame_range = (self.c3d_file.frame1, self.c3d_file.frameN)
+        self._frame_range = None
+        self._c3d_file = None
+        self.header_loaded = False
+
+        if c3d_file is not None:
+            self.set_header(c3d_file)
+
+    @property
+    def c3d_file(self):
+        """ The parsed header, None if the file does not exist or could not be read """
+
+        if not self.header_loaded:
+            header = self.cached_header()
+            if header is None and self.exists():
+                try:
+                    header = c3dParser.load(self.path())
+                except (IOError, OSError, ValueError, IndexError, RuntimeError, struct.error) as e:
+                    print("Could not read c3d header: " + self.path() + "  " + str(e))
+            self.set_header(header)
+
+        return self._c3d_file
+
+    @c3d_file.setter
+    def c3d_file(self, value):
+        self.set_header(value)
+
+    def cached_header(self):
+        """ Returns the header from HEADERS or the session index without reading the c3d file, or None """
+
+        header = HEADERS.get(self.path())
+        if header is None and self.index is not None and self.entry is not None:
+            header = self.index.get(self.task, self.entry)
+            if header is not None:
+                HEADERS.put(self.path(), header)
+        return header
+
+    def set_header(self, c3d):
+        """ Sets the parsed header, adding it to HEADERS and the session index """
+
+        self._c3d_file = c3d
+        self.header_loaded = True
+
+        if c3d is None:
+            return
+
+        if HEADERS.get(self.path()) is not c3d:
+            HEADERS.put(self.path(), c3d)
+            if self.index is not None and self.entry is not None:
+                self.index.set(self.task, self.entry, c3d)
+
+    @property
+    def frame_range(self):
+        """ The in and out frames, from the session's range data or the header """
+
+        if self._frame_range is None:
+            c3d = self.c3d_file
+            if c3d is not None:
+                return c3d.frame1, c3d.frameN
+
+        return self._frame_range
+
+    @frame_range.setter
+    def frame_range(self, value):
+        self._frame_range = value
 
     def __str__(self):
         """ Converts object to string
@@ -159,6 +265,83 @@ class C3DFile(File):
         return self.c3d_file.frame1, self.c3d_file.frameN
 
 
+def versioned_name(name, version):
+    """ Returns the file name (without extension) for a version string, e.g. name_002 """
+    if version is None: return name
+    if not name.endswith("_"):
+        name += "_"
+    return name + version
+
+
+class VersionIndex(object):
+    """ The versions of the maya files in a directory, built from a single dirScanner.Listing with
+    get_version.  Only versions that MayaFile would build a path to (name_001.mb) are counted. """
+
+    def __init__(self, listing=None):
+        self.listing = listing
+        self.files = set()      # normcased file names without extensions
+        self.versions = {}      # normcased name: sorted list of versions
+        self.latest_versions = {}
+
+        if listing is None:
+            return
+
+        for entry in listing.files(['.ma', '.mb']):
+            stem = os.path.splitext(entry.name)[0]
+            self.files.add(os.path.normcase(stem))
+
+            verdata = get_version(entry.name)
+            if not verdata or verdata[1] is None:
+                continue
+
+            name, version, _ = verdata
+            version = int(version)
+            if os.path.normcase(versioned_name(name, "%03d" % version)) != os.path.normcase(stem):
+                continue
+
+            self.versions.setdefault(os.path.normcase(name), set()).add(version)
+
+        for name in self.versions:
+            self.versions[name] = sorted(self.versions[name])
+            self.latest_versions[name] = self.versions[name][-1]
+
+    def has_file(self, file_name):
+        """ True if there is a ma or mb file with the name (without extension) """
+        return os.path.normcase(file_name) in self.files
+
+    def latest(self, name):
+        """ Highest version of name, 0 if there are none """
+        return self.latest_versions.get(os.path.normcase(name), 0)
+
+    def next(self, name):
+        return self.latest(name) + 1
+
+    def all(self, name):
+        """ Sorted list of the versions of name """
+        return list(self.versions.get(os.path.normcase(name), []))
+
+
+# directory listings used for the version indexes, shared by every MayaFile
+version_scanner = dirScanner.DirScanner()
+version_indexes = {}
+
+
+def version_index(dir_path):
+    """ Returns the VersionIndex of the directory, rebuilt when the mtime of the directory changes """
+
+    listing, _ = version_scanner.scan(dir_path)
+    if listing is None:
+        version_indexes.pop(dir_path, None)
+        return VersionIndex()
+
+    index = version_indexes.get(dir_path)
+    if index is None or index.listing is not listing:
+        index = VersionIndex(listing)
+        version_indexes[dir_path] = index
+
+    return index
+
+
 class MayaFile(File):
     """ A ma or mb file that exists on disk somewhere."""
 
@@ -182,21 +365,11 @@ class MayaFile(File):
         super(MayaFile, self).__init__(session_path, task, name, extension)
 
         if version is True:
-            print("True")
-            v = 1
-            self.set_version(v)
-            while self.exists():
-                print("exists: " + str(self.path()))
-                v += 1
-                self.set_version(v)
+            # next version
+            self.set_version(self.versions().latest(self.name) + 1)
         elif version is None:
-            v = 1
-            self.set_version(v)
-            while self.exists():
-                v += 1
-                self.set_version(v)
-            v = v - 1
-            self.set_version(v)
+            # latest version, 0 if there are none
+            self.set_version(self.versions().latest(self.name))
         elif version is False:
             self.version = None
         elif isinstance(version, int):
@@ -205,14 +378,13 @@ class MayaFile(File):
         else:
             self.version = version
 
+    def versions(self):
+        """ Returns the VersionIndex of the task directory """
+        return version_index(os.path.join(self.session_dir, self.task))
+
     def exists(self):
-        ext = self.extension
-        self.extension = ".ma"
-        test1 = os.path.isfile(self.path())
-        self.extension = ".mb"
-        test2 = os.path.isfile(self.path())
-        self.extension = ext
-        return test1 or test2
+        """ True if there is a ma or mb file for this name and version """
+        return self.versions().has_file(self.get_name())
 
     def set_version(self, v):
         self.version = "%03d" % v
@@ -228,11 +400,7 @@ class MayaFile(File):
         return "MayaFile: " + str(self.name) + " Version: " + str(self.get_version())
 
     def get_name(self):
-        if self.version is None: return self.name
-        name = self.name
-        if not name.endswith("_"):
-            name += "_"
-        return name + self.version
+        return versioned_name(self.name, self.version)
 
     def path(self):
         return os.path.join(self.session_dir, self.task, self.get_name() + self.extension)
@@ -260,6 +428,7 @@ class Session:
         self.title = title
         self.id = id
         self.tasks = {}
+        self.parsed = False  # tasks have been read at least once
 
     def empty(self):
         self.tasks = {}
@@ -306,12 +475,37 @@ class Data(QtCore.QObject):
         return 'Sessions: %d   Characters: %d' % (len(self.sessions), len(self.characters))
 
 
+class Cancelled(Exception):
+    """ Raised inside a ParseJob when it has been cancelled """
+    pass
+
+
+class ParseJob(object):
+    """ A session being parsed by Parser.parseSessionAsync """
+
+    def __init__(self, session, mkdir):
+        self.session = session
+        self.mkdir = mkdir
+        self.cancelled = False
+        self.future = None
+
+    def cancel(self):
+        """ The job stops at the next file it reads """
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+
 class Parser(QtCore.QObject):
-    """ Parser base class (QObject) with message attribute """
+    """ Parser base class (QObject) with message attribute.  Signals may be emitted from the parse thread
+    (see parseSessionAsync), Qt queues them to the thread of the connected widgets. """
 
     message = QtCore.Signal(str)
     error = QtCore.Signal(str)
     progress = QtCore.Signal(int, int, int, str)
+    sessionParsed = QtCore.Signal(object)
 
     def __init__(self, base_dir):
         super(Parser, self).__init__()
@@ -319,6 +513,18 @@ class Parser(QtCore.QObject):
         self.data = None
         self.rangeData = None
         self.notesData = None
+        self.workers = 16  # number of c3d files to read at the same time
+        self.scanner = dirScanner.DirScanner()
+        self.session_id = 0
+        self.task_items = {}  # task path: (listing, task type, files) from the last parse
+        self.executor = None  # single thread that runs the parse jobs, one at a time
+        self.stale = []  # paths of files that have changed, see invalidate()
+        self.stale_lock = threading.Lock()
+        self.indexes = {}  # session path: c3dIndex.C3DIndex
+        self.lock = threading.RLock()  # guards task_items and indexes, used by the ui and parse threads
+        self.prefetch = False  # read all the c3d headers while parsing, otherwise they are read when used
+        self.catalog = None  # catalog.Catalog that is updated with each session that is parsed
+        self.job = None
 
     def logMessage(self, value, color=0):
         if color == 1:
@@ -338,51 +544,89 @@ class Parser(QtCore.QObject):
             Each session should have subdirectories for 'c3d' (raw), 'cleaning' and 'solving'.  Session directories
             that do not have task directories with valid files in them will not be added to the list.
 
-            Data is saved in the data.sessions list as Session objects.
+            Data is saved in the data.sessions list as Session objects.  Directories are listed with self.scanner
+            so parsing again only reads the directories that have changed, and existing Session objects are kept.
 
+            Returns a dirScanner.Delta of the session titles added and removed since the last parse.
         """
 
-        self.data = Data()
+        if self.data is None:
+            self.data = Data()
 
         self.logMessage("Loading from directory: " + str(self.base_dir))
 
-        sessionId = 0
+        delta = dirScanner.Delta()
 
         try:
             if self.base_dir is None or not os.path.isdir(self.base_dir):
                 print("Not a directory: " + str(self.base_dir))
-                return
+                return delta
 
         except Exception as e:
             self.logError(e)
             print("Error " + str(e))
             print("While looking for directory: " + str(self.base_dir))
 
-        items = os.listdir(self.base_dir)
+        listing, _ = self.scanner.scan(self.base_dir)
+        if listing is None:
+            return delta
+
+        sessions = dict((i.title, i) for i in self.data.sessions)
+
+        items = listing.dirs()
         # add Session objects to self.data
         for cc, sessionName in enumerate(items):
 
             self.logProgress(0, cc, len(items), sessionName)
 
-            # create a new Session object to hold the data and add it to data.sessions list
-            # give it a number to maintain compat with web data
+            # the session directory is only read again if its mtime has changed
+            session_listing, _ = self.scanner.scan(os.path.join(self.base_dir, sessionName))
 
-            c3ddir = os.path.join(self.base_dir, sessionName, 'c3d')
-            rawdir = os.path.join(self.base_dir, sessionName, 'raw')
+            if session_listing is not None and (session_listing.is_dir('c3d') or session_listing.is_dir('raw')):
 
-            if os.path.isdir(c3ddir) or os.path.isdir(rawdir):
-
-                self.data.sessions.append(Session(sessionName, sessionId))
-
-                sessionId = sessionId + 1
+                if sessionName not in sessions:
+                    # create a new Session object to hold the data and add it to data.sessions list
+                    # give it a number to maintain compat with web data
+                    sessions[sessionName] = Session(sessionName, self.session_id)
+                    self.session_id += 1
+                    delta.added.append(sessionName)
 
             else:
-                print("Not a session directory: " + str(c3ddir))
+                print("Not a session directory: " + os.path.join(self.base_dir, sessionName, 'c3d'))
                 print("Expected this directory to contain a directory called 'c3d' or 'raw':")
                 print("    " + os.path.join(self.base_dir, sessionName))
 
+                if sessionName in sessions:
+                    del sessions[sessionName]
+                    delta.removed.append(sessionName)
+
+        for title in set(sessions) - set(items):
+            del sessions[title]
+            delta.removed.append(title)
+            self.forget_session(title)
+
+        if self.catalog is not None:
+            for title in delta.removed:
+                self.catalog.remove_session(self.base_dir, title)
+
+        self.data.sessions = [sessions[i] for i in items if i in sessions]
+
         self.logProgress(1, 0, 0, '')
 
+        return delta
+
+    def forget_session(self, title):
+        """ Drops the cached listings and files of a session that has been removed """
+
+        session_path = os.path.join(self.base_dir, title)
+        self.scanner.forget(session_path)
+
+        prefix = os.path.join(session_path, "")
+        with self.lock:
+            self.indexes.pop(session_path, None)
+            for task_path in [i for i in self.task_items if i.startswith(prefix)]:
+                del self.task_items[task_path]
+
     def getSessions(self):
         items = [(i.title, i.id) for i in self.data.sessions]
         return sorted(items, key=lambda v: v[0], reverse=True)
@@ -410,35 +654,117 @@ class Parser(QtCore.QObject):
         fp.close()
         return data
 
-    def parseSession(self, sessionObj, mkdir):
+    def parseSessionAsync(self, sessionObj, mkdir=False):
+
+        """ Parses the session on a background thread, cancelling the job in progress.  message and progress
+            are emitted as it runs and sessionParsed is emitted with sessionObj when its tasks have been
+            updated.  Sessions that have been parsed before keep their tasks until the new ones are ready.
+
+            Returns the ParseJob.
+        """
+
+        self.cancel()
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+        job = ParseJob(sessionObj, mkdir)
+        self.job = job
+        job.future = self.executor.submit(self.runJob, job)
+        return job
+
+    def runJob(self, job):
+
+        """ Runs on the parse thread """
+
+        if job.cancelled:
+            return
+
+        try:
+            self.parseSession(job.session, job.mkdir, job)
+        except Cancelled:
+            self.logProgress(5, 0, 0, '')
+            return
+
+        if not job.cancelled:
+            self.sessionParsed.emit(job.session)
+
+    def invalidate(self, paths):
+        """ Marks files that have been added, removed or modified (e.g. by watcher.Watcher) so the next parse
+        reads their directories and headers again.  Safe to call from any thread. """
+
+        with self.stale_lock:
+            self.stale.extend(paths)
+
+    def dropStale(self):
+        """ Drops the cached listings and headers of the files passed to invalidate(), called by parseSession """
+
+        with self.stale_lock:
+            stale, self.stale = self.stale, []
+
+        for path in stale:
+            self.scanner.forget(os.path.dirname(path))
+            HEADERS.discard(path)
+
+    def cancel(self):
+        """ Cancels the parse job that is running, if any """
+
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+
+    def shutdown(self):
+        """ Cancels the running job and stops the parse thread """
+
+        self.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def parseSession(self, sessionObj, mkdir, job=None):
 
         # for each session directory under the root
 
         self.logMessage("Parsing: " + os.path.join(self.base_dir, sessionObj.title))
 
-        sessionObj.empty()
+        self.dropStale()
 
         self.rangeData = self.loadJson(sessionObj.title, "range-data.json")
         self.notesData = self.loadJson(sessionObj.title, "notes-data.json")
 
+        # the tasks are parsed in to a new session so the current ones stay valid until this has finished
+        parsed = Session(sessionObj.title, sessionObj.id)
+
         try:
-            count = self.parseTasks(sessionObj)
+            count = self.parseTasks(parsed, job)
+        except Cancelled:
+            raise
         except Exception as e:
             traceback.print_exc()
             self.logError(sessionObj.title + "  " + str(e))
             print(str(sessionObj), str(e))
+            sessionObj.empty()
             return
 
+        sessionObj.tasks = parsed.tasks
+        sessionObj.parsed = True
+
+        if self.catalog is not None:
+            self.updateCatalog(sessionObj, job)
+
         if count > 0:
             self.logMessage(str(sessionObj.title), color=1)
             self.logMessage("Raw files: " + str(count))
 
-    def parseTasks(self, session_obj):
+    def parseTasks(self, session_obj, job=None):
 
-        """ search the session directory for task directories and add them to the session object """
+        """ search the session directory for task directories and add them to the session object.
+            Task directories that have not changed since the last parse reuse the files found last time. """
 
         session_path = os.path.join(self.base_dir, session_obj.title)
-        if not os.path.isdir(session_path): return
+
+        session_listing, _ = self.scanner.scan(session_path)
+        if session_listing is None: return 0
 
         count = 0
 
@@ -447,41 +773,64 @@ class Parser(QtCore.QObject):
 
         stage = 1
 
+        # c3d headers are read when they are needed, from the session's index if the file has not changed
+        index = self.sessionIndex(session_path)
+        index.clear_seen()
+
         # search data type dir (c3d/raw/cleaning/solving)
-        for taskName in os.listdir(session_path):
+        for taskName in session_listing.dirs():
+
+            if job is not None:
+                job.check()
 
             task_path = os.path.join(session_path, taskName)
 
-            if not os.path.isdir(task_path):
+            listing, _ = self.scanner.scan(task_path)
+            if listing is None:
+                continue
+
+            with self.lock:
+                cached = self.task_items.get(task_path)
+            if cached is not None and cached[0] is listing:
+                # unchanged since the last parse
+                task_type, items = cached[1], cached[2]
+
+                if task_type == "raw":
+                    index.keep(taskName, [i.name + i.extension for i in items])
+                    for c3d_obj in items:
+                        self.apply_session_data(c3d_obj)
+
+                session_obj.addTask(task_type).extend(items)
+                if task_type != "template":
+                    count += len(items)
+
                 continue
 
+            task_type = None
+            items = []
+
             if taskName.lower() in ['c3d', 'raw']:
 
                 stage += 1
 
                 # c3d files
 
-                task = session_obj.addTask("raw")
+                task_type = "raw"
 
-                c3d_items = os.listdir(task_path)
-                for cc, c3dFile in enumerate(c3d_items):
-                    self.logProgress(stage, cc, len(c3d_items), c3dFile)
+                c3d_items = listing.files(['.c3d'])
+                index.keep(taskName, [entry.name for entry in c3d_items])
 
-                    c3d_full_path = os.path.join(task_path, c3dFile)
-                    if not os.path.isfile(c3d_full_path): continue
-                    file_base, ext = os.path.splitext(c3dFile)
-                    if ext.lower() != '.c3d': continue
-                    c3d_obj = C3DFile(True, session_path, taskName, file_base, ext)
+                for entry in c3d_items:
+                    # the directory has changed, files may have been replaced
+                    HEADERS.discard(entry.path)
 
-                    # range data from json file
-                    if self.rangeData is not None and file_base in self.rangeData:
-                        c3d_obj.frame_range = self.rangeData[file_base]
+                    file_base, ext = os.path.splitext(entry.name)
+                    c3d_obj = C3DFile(True, session_path, taskName, file_base, ext, index=index, entry=entry)
 
-                    # notes from json
-                    if self.notesData is not None and file_base in self.notesData:
-                        c3d_obj.note = self.notesData[file_base]
+                    # range data and notes from the json files
+                    self.apply_session_data(c3d_obj)
 
-                    task.append(c3d_obj)
+                    items.append(c3d_obj)
 
                     count += 1
 
@@ -491,18 +840,18 @@ class Parser(QtCore.QObject):
 
                 print("> Found template directory: ", task_path)
 
-                task = session_obj.addTask("template")
+                task_type = "template"
 
-                template_items = os.listdir(task_path)
-                for cc, templateFile in enumerate(template_items):
+                template_items = listing.files()
+                for cc, entry in enumerate(template_items):
 
-                    self.logProgress(stage, cc, len(template_items), templateFile)
+                    self.logProgress(stage, cc, len(template_items), entry.name)
 
-                    verdata = get_version(templateFile)
+                    verdata = get_version(entry.name)
                     if not verdata:
                         continue
 
-                    task.append(MayaFile(session_path, taskName, *verdata))
+                    items.append(MayaFile(session_path, taskName, *verdata))
 
                 stage += 1
 
@@ -511,24 +860,109 @@ class Parser(QtCore.QObject):
 
                 print("> Found " + taskName + " directory: ", task_path)
 
-                task = session_obj.addTask(taskName)
-                taskItems = os.listdir(task_path)
+                task_type = taskName
 
-                for cc, fileName in enumerate(taskItems):
+                taskItems = listing.files()
 
-                    self.logProgress(stage, cc, len(taskItems), fileName)
+                for cc, entry in enumerate(taskItems):
 
-                    fullPath = os.path.join(task_path, fileName)
-                    if not os.path.isfile(fullPath): continue  # skip non-files
+                    self.logProgress(stage, cc, len(taskItems), entry.name)
 
-                    verdata = get_version(fileName)
+                    verdata = get_version(entry.name)
                     if not verdata:
                         continue
-                    task.append(MayaFile(session_path, task, *verdata))
+                    items.append(MayaFile(session_path, taskName, *verdata))
                     count += 1
 
                 stage += 1
 
+            if task_type is None:
+                continue
+
+            with self.lock:
+                self.task_items[task_path] = (listing, task_type, items)
+            session_obj.addTask(task_type).extend(items)
+
+        if self.prefetch:
+            self.loadHeaders(session_obj.getTask("raw") or [], stage, job)
+
+        index.save()
+
         self.logProgress(5, 0, 0, '')
 
         return count
+
+    def updateCatalog(self, session_obj, job=None):
+        """ Adds the parsed session to the catalog, reading the headers of the takes that have changed """
+
+        try:
+            changed = self.catalog.changed_takes(self.base_dir, session_obj)
+            self.loadHeaders(changed, job=job)
+            self.catalog.update_session(self.base_dir, session_obj, self.rangeData, self.notesData, changed)
+        except catalog.sqlite3.Error as e:
+            self.logError("Could not update the catalog: " + str(e))
+
+    def refreshCatalog(self, job=None):
+        """ Parses every session in to the catalog, only the directories and files that have changed are read """
+
+        if self.catalog is None:
+            self.catalog = catalog.Catalog()
+
+        delta = self.parse()
+
+        for title in delta.removed:
+            self.catalog.remove_session(self.base_dir, title)
+
+        for session_obj in self.data.sessions:
+            if job is not None:
+                job.check()
+            self.parseSession(session_obj, False, job)
+
+    def sessionIndex(self, session_path):
+        """ Returns the c3dIndex for the session, which is read once and kept for later parses """
+
+        with self.lock:
+            index = self.indexes.get(session_path)
+            if index is None:
+                index = c3dIndex.C3DIndex(session_path)
+                self.indexes[session_path] = index
+            return index
+
+    def loadHeaders(self, c3d_files, stage=1, job=None):
+        """ Reads the headers of the C3DFiles that have not been loaded yet.  Headers that are not in the
+        HEADERS cache or the session index are read concurrently (see workers) """
+
+        missing = []
+        for item in c3d_files:
+            if item.header_loaded:
+                continue
+            header = item.cached_header()
+            if header is None:
+                missing.append(item)
+            else:
+                item.set_header(header)
+
+        def progress(cc, total, c3d_path):
+            if job is not None:
+                job.check()
+            self.logProgress(stage, cc, total, os.path.basename(c3d_path))
+
+        parsed = c3dParser.load_many([item.path() for item in missing], workers=self.workers, progress=progress,
+                                     return_exceptions=True)
+        for item, header in zip(missing, parsed):
+            if isinstance(header, Exception):
+                # e.g. a file that is still being written, leave it out rather than failing the session
+                print("Could not read c3d header: " + item.path() + "  " + str(header))
+                header = None
+            item.set_header(header)
+
+    def apply_session_data(self, c3d_obj):
+        """ Sets the frame range and note of the C3DFile from the session's range and notes json """
+
+        file_base = c3d_obj.name
+
+        if self.rangeData is not None and file_base in self.rangeData:
+            c3d_obj.frame_range = self.rangeData[file_base]
+
+        if self.notesData is not None and file_base in self.notesData:
+            c3d_obj.note = self.notesData[file_base]
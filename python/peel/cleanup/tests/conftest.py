@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from peel.cleanup import c3dParser
+
+
+@pytest.fixture
+def points():
+    """ (50, 4, 4) points on smooth paths with a zero residual """
+
+    frames, markers = 50, 4
+    rng = np.random.RandomState(0)
+    points = np.zeros((frames, markers, 4), dtype=np.float32)
+    t = np.arange(frames, dtype=np.float32)[:, None]
+    points[..., 0] = np.sin(t / 10.0) * 100 + np.arange(markers) * 50
+    points[..., 1] = np.cos(t / 10.0) * 100
+    points[..., 2] = 1000 + rng.uniform(-1, 1, (frames, markers))
+    return points
+
+
+@pytest.fixture
+def c3d_dir(tmp_path, points):
+    """ A directory with two valid c3d files and two truncated ones """
+
+    labels = ["M%d" % i for i in range(points.shape[1])]
+    for name in ("a.c3d", "b.c3d"):
+        c3dParser.write(str(tmp_path / name), points, labels, 120.0)
+
+    (tmp_path / "empty.c3d").write_bytes(b"")
+    data = (tmp_path / "a.c3d").read_bytes()
+    (tmp_path / "half.c3d").write_bytes(data[:300])
+
+    return tmp_path
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+from peel.cleanup import c3dCache, c3dParser
+
+
+@pytest.fixture
+def take(tmp_path, points):
+    points[5:8, 0, 3] = -1.0
+    path = str(tmp_path / "take.c3d")
+    c3dParser.write(path, points, ["M%d" % i for i in range(points.shape[1])], 120.0)
+    return path
+
+
+def test_sidecar_cache(take, points, monkeypatch):
+    monkeypatch.setattr(c3dCache, "CACHE_DIR", None)
+
+    c3d, decoded, valid = c3dCache.load(take)
+    assert os.path.isdir(take + ".cache")
+    assert not valid[5:8, 0].any() and valid[8:, 0].all()
+
+    cached = c3dCache.read(take)
+    assert cached is not None
+    c3d, mapped, mapped_valid = cached
+    assert isinstance(mapped, np.memmap)
+    np.testing.assert_array_equal(mapped, decoded)
+    np.testing.assert_array_equal(mapped_valid, valid)
+    assert (c3d.frame1, c3d.frameN) == (1, 50)
+
+
+def test_changed_file_not_used(take, monkeypatch):
+    monkeypatch.setattr(c3dCache, "CACHE_DIR", None)
+    c3dCache.load(take)
+
+    st = os.stat(take)
+    os.utime(take, (st.st_atime, st.st_mtime + 10))
+    assert c3dCache.read(take) is None
+
+
+def test_evict(tmp_path, take, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    monkeypatch.setattr(c3dCache, "CACHE_DIR", str(cache_dir))
+
+    c3dCache.load(take)
+    assert len(os.listdir(str(cache_dir))) == 1
+    assert c3dCache.cache_path(take).startswith(str(cache_dir))
+
+    c3dCache.evict(max_size=0)
+    assert os.listdir(str(cache_dir)) == []
+    assert c3dCache.read(take) is None
@@ -0,0 +1,92 @@
+import os
+import threading
+
+import pytest
+
+from peel.cleanup import c3dIndex, c3dParser
+
+
+@pytest.fixture
+def index_dir(tmp_path_factory, monkeypatch):
+    path = tmp_path_factory.mktemp("index")
+    monkeypatch.setattr(c3dIndex, "INDEX_DIR", str(path))
+    return path
+
+
+def entries(path):
+    return dict((entry.name, entry) for entry in os.scandir(str(path)))
+
+
+def test_save_and_read(c3d_dir, index_dir):
+    session = str(c3d_dir.parent)
+    task = c3d_dir.name
+    files = entries(c3d_dir)
+    session_mtime = os.stat(session).st_mtime
+
+    index = c3dIndex.C3DIndex(session)
+    assert index.get(task, files["a.c3d"]) is None
+    index.set(task, files["a.c3d"], c3dParser.load(files["a.c3d"].path))
+    index.save()
+
+    # the index is not written in to the session
+    assert os.path.isfile(index.index_path)
+    assert os.path.dirname(index.index_path) == str(index_dir)
+    assert os.stat(session).st_mtime == session_mtime
+    assert sorted(os.listdir(str(c3d_dir))) == ["a.c3d", "b.c3d", "empty.c3d", "half.c3d"]
+
+    header = c3dIndex.C3DIndex(session).get(task, files["a.c3d"])
+    assert header is not None
+    assert (header.frame1, header.frameN) == (1, 50)
+
+
+def test_changed_file(c3d_dir, index_dir):
+    session, task = str(c3d_dir.parent), c3d_dir.name
+    index = c3dIndex.C3DIndex(session)
+    index.set(task, entries(c3d_dir)["a.c3d"], c3dParser.load(str(c3d_dir / "a.c3d")))
+
+    st = os.stat(str(c3d_dir / "a.c3d"))
+    os.utime(str(c3d_dir / "a.c3d"), (st.st_atime, st.st_mtime + 10))
+
+    assert index.get(task, entries(c3d_dir)["a.c3d"]) is None
+
+
+def test_unseen_entries_removed(c3d_dir, index_dir):
+    session, task = str(c3d_dir.parent), c3d_dir.name
+    files = entries(c3d_dir)
+
+    index = c3dIndex.C3DIndex(session)
+    for name in ("a.c3d", "b.c3d"):
+        index.set(task, files[name], c3dParser.load(files[name].path))
+    index.save()
+
+    index = c3dIndex.C3DIndex(session)
+    index.clear_seen()
+    index.keep(task, ["b.c3d"])
+    index.save()
+
+    assert sorted(c3dIndex.C3DIndex(session).entries) == [task + "/b.c3d"]
+
+
+def test_set_while_saving(c3d_dir, index_dir):
+    session, task = str(c3d_dir.parent), c3d_dir.name
+    entry = entries(c3d_dir)["a.c3d"]
+    header = c3dParser.load(entry.path)
+    index = c3dIndex.C3DIndex(session)
+    errors = []
+
+    def save():
+        try:
+            for _ in range(50):
+                index.save()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=save)
+    thread.start()
+    while thread.is_alive():
+        index.clear_seen()
+        index.set(task, entry, header)
+        index.get(task, entry)
+    thread.join()
+
+    assert errors == []
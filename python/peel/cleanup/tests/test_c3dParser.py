@@ -0,0 +1,166 @@
+import os
+
+import numpy as np
+import pytest
+
+from peel.cleanup import c3dParser
+
+
+@pytest.mark.parametrize("proc_type", [84, 85, 86])
+@pytest.mark.parametrize("scale", [-0.1, 0.1])
+def test_round_trip(tmp_path, points, proc_type, scale):
+    labels = ["M%d" % i for i in range(points.shape[1])]
+    path = str(tmp_path / "take.c3d")
+
+    c3dParser.write(path, points, labels, 120.0, first_frame=5, scale=scale, proc_type=proc_type)
+
+    c3d = c3dParser.load_many([path], points=True)[0]
+    assert c3d.proc_type == proc_type
+    assert c3d.frame1 == 5
+    assert c3d.frameN == 5 + points.shape[0] - 1
+    assert c3d.frame_rate == pytest.approx(120.0)
+    assert c3d.data['POINT']['LABELS'] == labels
+
+    # integer data is stored to the scale factor
+    tolerance = 1e-3 if scale < 0 else abs(scale)
+    np.testing.assert_allclose(c3d.point_data[..., :3], points[..., :3], atol=tolerance)
+
+
+@pytest.mark.parametrize("name", ["empty.c3d", "half.c3d"])
+def test_read_header_truncated(c3d_dir, name):
+    c3d = c3dParser.C3D()
+    c3d.load(str(c3d_dir / name))
+    try:
+        with pytest.raises(ValueError):
+            c3d.read_header()
+    finally:
+        c3d.close()
+
+
+def test_load_many_raises(c3d_dir):
+    paths = [str(c3d_dir / i) for i in ("a.c3d", "empty.c3d", "b.c3d")]
+    with pytest.raises(ValueError):
+        c3dParser.load_many(paths, workers=2)
+
+
+def test_load_many_return_exceptions(c3d_dir):
+    names = ["a.c3d", "empty.c3d", "b.c3d", "half.c3d"]
+    calls = []
+
+    def progress(current, total, path):
+        calls.append(os.path.basename(path))
+
+    results = c3dParser.load_many([str(c3d_dir / i) for i in names], workers=2, progress=progress,
+                                  return_exceptions=True)
+
+    assert sorted(calls) == sorted(names)
+    assert isinstance(results[0], c3dParser.C3D)
+    assert isinstance(results[1], ValueError)
+    assert isinstance(results[2], c3dParser.C3D)
+    assert isinstance(results[3], ValueError)
+    assert results[2].frameN - results[2].frame1 + 1 == 50
+
+
+@pytest.mark.parametrize("value, expected", [
+    ([10, 20, 30, 12], [10, 20, 30, 12]),
+    ("10:20:30;12", [10, 20, 30, 12]),
+    (5, []),
+    ("bad", []),
+    ([[1, 2], [3, 4]], []),
+])
+def test_read_timecode(tmp_path, points, value, expected):
+    path = str(tmp_path / "take.c3d")
+    data = {'TIMECODE': {'USED': 1, 'TIMECODE': value, 'STANDARD': 'PAL'}}
+    c3dParser.write(path, points, ["M%d" % i for i in range(points.shape[1])], 120.0, data=data)
+
+    c3d = c3dParser.load(path)
+    c3d.read_timecode()
+    assert c3d.timecode == expected
+    assert c3d.timecode_used
+
+
+def test_segment_index():
+    mask = np.zeros((20, 2), dtype=bool)
+    mask[2:5, 0] = True
+    mask[8:12, 0] = True
+    mask[15:20, 0] = True
+    mask[:, 1] = True
+
+    index = c3dParser.SegmentIndex(mask, first_frame=1)
+    assert len(index) == 2
+    assert index.segments[0].tolist() == [[3, 5], [9, 12], [16, 20]]
+    assert index.gaps(0).tolist() == [[5, 9], [12, 16]]
+    assert index.gaps(1).tolist() == []
+
+    assert index.segment_at(0, 10) == (9, 12)
+    assert index.segment_at(0, 7) is None
+    assert index.gap_at(0, 7) == (5, 9)
+    assert index.gap_at(0, 1) is None
+
+    assert index.next_gap(0, 1) == (5, 9)
+    assert index.next_gap(0, 6) == (12, 16)
+    assert index.next_gap(0, 13) is None
+    assert index.previous_gap(0, 20) == (12, 16)
+    assert index.previous_gap(0, 15) == (5, 9)
+    assert index.previous_gap(0, 8) is None
+    assert index.next_gap(1, 1) is None
+
+    assert len(c3dParser.SegmentIndex(np.zeros((20, 0), dtype=bool))) == 0
+    assert len(c3dParser.SegmentIndex(np.zeros((0, 0), dtype=bool))) == 0
+
+    empty = c3dParser.SegmentIndex(np.zeros((20, 2), dtype=bool))
+    assert len(empty) == 2
+    assert empty.segments[1].tolist() == []
+    assert empty.segment_at(1, 5) is None
+    assert empty.next_gap(1, 5) is None
+
+
+def test_segment_index_from_file(tmp_path, points):
+    points[10:20, 1, 3] = -1.0
+    path = str(tmp_path / "take.c3d")
+    c3dParser.write(path, points, ["M%d" % i for i in range(points.shape[1])], 120.0, first_frame=1)
+
+    c3d = c3dParser.load(path)
+    index = c3d.segment_index(chunk=7)
+    assert index.segments[0].tolist() == [[1, 50]]
+    assert index.segments[1].tolist() == [[1, 10], [21, 50]]
+
+
+def test_iter_frames(tmp_path, points):
+    path = str(tmp_path / "take.c3d")
+    c3dParser.write(path, points, ["M%d" % i for i in range(points.shape[1])], 120.0, first_frame=3)
+
+    c3d = c3dParser.load(path)
+    chunks = list(c3d.iter_frames(chunk=16))
+    assert [len(frames) for frames, _, _ in chunks] == [16, 16, 16, 2]
+    assert chunks[0][0][0] == 3
+    assert chunks[-1][0][-1] == 52
+    np.testing.assert_allclose(np.concatenate([p for _, p, _ in chunks])[..., :3], points[..., :3], atol=1e-3)
+
+
+def test_map_points(tmp_path, points):
+    path = str(tmp_path / "take.c3d")
+    c3dParser.write(path, points, ["M%d" % i for i in range(points.shape[1])], 120.0)
+
+    window = c3dParser.mmap(path).point_data
+    assert window.shape == points.shape
+    np.testing.assert_allclose(window[10:20, 2], points[10:20, 2], atol=1e-3)
+
+
+def test_write_analog(tmp_path, points):
+    analog = np.arange(points.shape[0] * 4 * 3, dtype=np.float32).reshape(-1, 3)
+    path = str(tmp_path / "take.c3d")
+    c3dParser.write(path, points, ["M%d" % i for i in range(points.shape[1])], 120.0, analog=analog)
+
+    c3d = c3dParser.load(path)
+    assert c3d.analog_channels() == 3
+    np.testing.assert_allclose(c3d.read_analog(chunk=7), analog)
+
+
+def test_writer_validates():
+    with pytest.raises(ValueError):
+        c3dParser.C3DWriter(np.zeros((10, 2, 3)), ["a", "b"], 120.0)
+    with pytest.raises(ValueError):
+        c3dParser.C3DWriter(np.zeros((10, 2, 4)), ["a"], 120.0)
+    with pytest.raises(ValueError):
+        c3dParser.C3DWriter(np.zeros((10, 2, 4)), ["a", "b"], 120.0, proc_type=99)
@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip("peel.cleanup.Qt", exc_type=ImportError)
+
+from peel.cleanup import catalog, mocapData
+
+
+@pytest.fixture
+def session(c3d_dir):
+    """ The valid files in c3d_dir as the raw task of a session, c3d_dir is both the base and session
+    directory so the takes are in the "." task """
+
+    session_obj = mocapData.Session(".", 0)
+    task = session_obj.addTask("raw")
+    for name in ("a", "b"):
+        task.append(mocapData.C3DFile(True, str(c3d_dir), ".", name, ".c3d"))
+    return session_obj
+
+
+def test_update_session(tmp_path_factory, c3d_dir, session):
+    cat = catalog.Catalog(str(tmp_path_factory.mktemp("catalog") / "catalog.db"))
+    base = str(c3d_dir)
+
+    assert len(cat.changed_takes(base, session)) == 2
+    cat.update_session(base, session, {"a": [10, 20]})
+
+    takes = cat.takes(base_dir=base)
+    assert [i['name'] for i in takes] == ["a", "b"]
+    assert takes[0]['rate'] == pytest.approx(120.0)
+    assert (takes[0]['range_in'], takes[0]['range_out']) == (10, 20)
+    assert cat.changed_takes(base, session) == []
+
+
+def test_update_session_uses_changed(tmp_path_factory, c3d_dir, session, monkeypatch):
+    cat = catalog.Catalog(str(tmp_path_factory.mktemp("catalog") / "catalog.db"))
+    base = str(c3d_dir)
+    changed = cat.changed_takes(base, session)
+
+    def fail(*args):
+        raise AssertionError("changed_takes called again")
+
+    monkeypatch.setattr(cat, "changed_takes", fail)
+    cat.update_session(base, session, changed=changed[:1])
+
+    # only the changed take has its header in the catalog, the other only has its range and note updated
+    assert [i['name'] for i in cat.takes(base_dir=base)] == ["a"]
@@ -0,0 +1,92 @@
+import os
+import threading
+
+from peel.cleanup import dirScanner
+
+
+def touch_dir(path, seconds):
+    """ Moves the directory mtime so the scanner sees a change without waiting for the clock """
+    st = os.stat(str(path))
+    os.utime(str(path), (st.st_atime, st.st_mtime + seconds))
+
+
+def test_scan_delta(tmp_path):
+    (tmp_path / "a.c3d").write_bytes(b"")
+    (tmp_path / "sub").mkdir()
+
+    scanner = dirScanner.DirScanner()
+    listing, delta = scanner.scan(str(tmp_path))
+    assert delta.added == ["a.c3d", "sub"]
+    assert listing.dirs() == ["sub"]
+    assert [i.name for i in listing.files(['.c3d'])] == ["a.c3d"]
+
+    again, delta = scanner.scan(str(tmp_path))
+    assert again is listing
+    assert not delta
+
+    (tmp_path / "b.c3d").write_bytes(b"")
+    (tmp_path / "a.c3d").unlink()
+    touch_dir(tmp_path, 10)
+
+    listing, delta = scanner.scan(str(tmp_path))
+    assert delta.added == ["b.c3d"]
+    assert delta.removed == ["a.c3d"]
+
+
+def test_scan_missing(tmp_path):
+    scanner = dirScanner.DirScanner()
+    path = tmp_path / "session"
+    path.mkdir()
+    (path / "a.c3d").write_bytes(b"")
+    scanner.scan(str(path))
+
+    (path / "a.c3d").unlink()
+    path.rmdir()
+
+    listing, delta = scanner.scan(str(path))
+    assert listing is None
+    assert delta.removed == ["a.c3d"]
+    assert scanner.get(str(path)) is None
+
+
+def test_forget(tmp_path):
+    (tmp_path / "session" / "c3d").mkdir(parents=True)
+    (tmp_path / "session2").mkdir()
+
+    scanner = dirScanner.DirScanner()
+    for path in ("session", "session/c3d", "session2"):
+        scanner.scan(str(tmp_path / path))
+
+    scanner.forget(str(tmp_path / "session"))
+    assert scanner.get(str(tmp_path / "session")) is None
+    assert scanner.get(str(tmp_path / "session" / "c3d")) is None
+    assert scanner.get(str(tmp_path / "session2")) is not None
+
+
+def test_forget_while_scanning(tmp_path):
+    paths = []
+    for i in range(50):
+        path = tmp_path / ("session%02d" % i) / "c3d"
+        path.mkdir(parents=True)
+        paths.append(str(path))
+
+    scanner = dirScanner.DirScanner()
+    errors = []
+
+    def scan():
+        try:
+            for _ in range(20):
+                for path in paths:
+                    scanner.scan(path)
+                scanner.clear()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=scan)
+    thread.start()
+    while thread.is_alive():
+        for path in paths:
+            scanner.forget(os.path.dirname(path))
+    thread.join()
+
+    assert errors == []
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from peel.cleanup import key_tools
+from peel.util import curve, scene
+
+
+def test_active_keys():
+    times, values = key_tools.active_keys([1, 2, 3, 7, 8, 12], 1.0)
+    assert times.tolist() == [0, 1, 4, 7, 9, 12, 13]
+    assert values.tolist() == [0, 1, 0, 1, 0, 1, 0]
+
+
+def test_active_keys_empty():
+    times, values = key_tools.active_keys([], 1.0)
+    assert len(times) == 0 and len(values) == 0
+
+
+def test_linear_fill():
+    times, values = key_tools.linear_fill(np.array([10.0, 14.0]), np.array([0.0, 8.0]), 1.0)
+    assert times.tolist() == [11, 12, 13]
+    assert values.tolist() == [2, 4, 6]
+
+
+def test_linear_fill_no_gap():
+    times, values = key_tools.linear_fill(np.array([10.0, 11.0]), np.array([0.0, 1.0]), 1.0)
+    assert len(times) == 0 and len(values) == 0
+
+
+@pytest.fixture
+def gap_scene():
+    """ Markers a and b moving in straight lines at 120fps, a has no keys from frame 10 to 19 """
+
+    frames = np.arange(40, dtype=np.float64)
+    points = np.empty((40, 2, 3))
+    points[:, 0] = np.column_stack((frames * 2, frames * 3 + 1, -frames))
+    points[:, 1] = points[:, 0] + [10.0, 20.0, 30.0]
+    valid = np.ones((40, 2), dtype=bool)
+    valid[10:20, 0] = False
+
+    scn = scene.MemoryScene.from_arrays(["a", "b"], points, valid, rate=120.0, first_frame=0)
+    for name in ("a", "b"):
+        scn.set_attr(name + ".active", 0)
+    scn.time = 15.0
+    scn.expected = points[:, 0]
+
+    previous = scene.current
+    scene.use(scn)
+    curve.clear_gap_indexes()
+    yield scn
+    scene.use(previous)
+    curve.clear_gap_indexes()
+
+
+def assert_filled(scn, node="a"):
+    for axis, attr in enumerate(("tx", "ty", "tz")):
+        times, values = scn.fetch_keys([node + "." + attr])[node + "." + attr]
+        np.testing.assert_array_equal(times, np.arange(40))
+        np.testing.assert_allclose(values, scn.expected[:, axis])
+
+
+def test_find_current_gap(gap_scene):
+    assert key_tools.find_current_gap("a") == (9, 20)
+    assert key_tools.find_current_gap("a", 5) == (5, 6)
+
+
+def test_next_previous_gap(gap_scene):
+    assert key_tools.next_gap("a", 0) == (9, 20)
+    assert key_tools.next_gap("a", 25) is None
+    assert key_tools.previous_gap("a", 30) == (9, 20)
+    assert key_tools.previous_gap("a", 5) is None
+    assert key_tools.next_gap("b", 0) is None
+
+
+def test_fill_gap_linear(gap_scene):
+    key_tools.fill_gap_linear("a")
+    assert_filled(gap_scene)
+
+    # the active channel is keyed on for the whole take now that the gap is filled
+    times, values = gap_scene.fetch_keys(["a.active"])["a.active"]
+    assert times.tolist() == [-1, 0, 40]
+    assert values.tolist() == [0, 1, 0]
+    assert key_tools.next_gap("a", 0) is None
+
+
+def test_fill_gap_from_source(gap_scene):
+    # b drifts away from a and has a bump in the gap
+    frames = np.arange(40)
+    bump = np.where((frames > 9) & (frames < 20), np.sin((frames - 9) * np.pi / 11) * 5, 0)
+    times, values = gap_scene.keys["b.tx"]
+    gap_scene.keys["b.tx"] = (times, values + frames * 0.5 + bump)
+    before = gap_scene.fetch_keys(["a.tx"])["a.tx"]
+
+    key_tools.fill_gap("a", "b")
+
+    # the source is offset to meet the keys at each end of the gap, so the drift is removed and the bump
+    # is kept.  The keys outside of the gap are not changed
+    times, values = gap_scene.fetch_keys(["a.tx"])["a.tx"]
+    np.testing.assert_array_equal(times, frames)
+    keep = (times <= 9) | (times >= 20)
+    np.testing.assert_allclose(values[keep], before[1])
+    np.testing.assert_allclose(values, gap_scene.expected[:, 0] + bump)
+
+
+def test_fill_gap_from_parallel_source(gap_scene):
+    key_tools.fill_gap("a", "b")
+    assert_filled(gap_scene)
+
+
+def test_fill_channel_linear(gap_scene):
+    for attr in ("tx", "ty", "tz"):
+        key_tools.fill_channel("a." + attr)
+    assert_filled(gap_scene)
+
+
+def test_fill_channel_from_source(gap_scene):
+    for attr in ("tx", "ty", "tz"):
+        key_tools.fill_channel("a." + attr, "b." + attr)
+    assert_filled(gap_scene)
+
+
+def test_fill_channel_not_in_gap(gap_scene):
+    with pytest.raises(RuntimeError):
+        key_tools.fill_channel("a.tx", currentTime=50)
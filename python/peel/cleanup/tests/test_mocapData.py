@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("peel.cleanup.Qt", exc_type=ImportError)
+
+from peel.cleanup import mocapData
+
+
+def test_load_headers_skips_truncated(c3d_dir):
+    # the files are in c3d_dir, so the session is its parent and the task is its name
+    session, task = str(c3d_dir.parent), c3d_dir.name
+    items = [mocapData.C3DFile(True, session, task, name, ".c3d") for name in ("a", "empty", "b", "half")]
+
+    parser = mocapData.Parser(session)
+    parser.workers = 2
+    parser.loadHeaders(items)
+
+    assert all(item.header_loaded for item in items)
+    assert items[0].c3d_file is not None
+    assert items[1].c3d_file is None
+    assert items[2].c3d_file is not None
+    assert items[3].c3d_file is None
+    assert items[2].frame_range == (1, 50)
@@ -0,0 +1,91 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("peel.cleanup.Qt", exc_type=ImportError)
+
+from peel.cleanup import watcher
+
+
+def set_mtime(path, mtime):
+    os.utime(str(path), (mtime, mtime))
+
+
+@pytest.fixture
+def base(tmp_path):
+    """ A base directory with one session that has not changed for a week """
+
+    old = time.time() - 7 * 24 * 60 * 60
+    c3d = tmp_path / "session1" / "c3d"
+    c3d.mkdir(parents=True)
+    (c3d / "take1.c3d").write_bytes(b"x")
+    for path in (c3d / "take1.c3d", c3d, c3d.parent, tmp_path):
+        set_mtime(path, old)
+    return tmp_path
+
+
+@pytest.fixture
+def watch(base):
+    w = watcher.Watcher(str(base), native=False)
+    w.sessions = []
+    w.changes = []
+    w.sessionsChanged.connect(w.sessions.append)
+    w.filesChanged.connect(lambda title, paths: w.changes.append((title, paths)))
+    return w
+
+
+def test_first_poll_is_baseline(watch):
+    watch.poll()
+    assert watch.sessions == []
+    assert watch.changes == []
+
+
+def test_session_added(watch, base):
+    watch.poll()
+    (base / "session2" / "c3d").mkdir(parents=True)
+    set_mtime(base, time.time())
+
+    watch.poll()
+    assert [i.added for i in watch.sessions] == [["session2"]]
+
+
+def test_cold_session_checked_after_interval(watch, base):
+    now = time.time()
+    watch.poll(now)
+
+    (base / "session1" / "c3d" / "take2.c3d").write_bytes(b"x")
+    set_mtime(base / "session1" / "c3d", now - 7 * 24 * 60 * 60 + 10)
+
+    # not recent, so the session is only checked again after the cold interval
+    watch.poll(now + 1)
+    assert watch.changes == []
+
+    watch.poll(now + watch.cold_interval + 1)
+    assert watch.changes == [("session1", [str(base / "session1" / "c3d" / "take2.c3d")])]
+
+
+def test_hot_file_modified(watch, base):
+    c3d = base / "session1" / "c3d"
+    set_mtime(c3d, time.time())
+    watch.poll()
+
+    # a take still being written changes size without changing the directory
+    mtime = os.stat(str(c3d)).st_mtime
+    (c3d / "take1.c3d").write_bytes(b"xyz")
+    set_mtime(c3d, mtime)
+
+    watch.poll()
+    assert watch.changes == [("session1", [str(c3d / "take1.c3d")])]
+
+
+def test_index_does_not_make_session_hot(watch, base, monkeypatch, tmp_path_factory):
+    from peel.cleanup import c3dIndex
+
+    monkeypatch.setattr(c3dIndex, "INDEX_DIR", str(tmp_path_factory.mktemp("index")))
+    index = c3dIndex.C3DIndex(str(base / "session1"))
+    index.dirty = True
+    index.save()
+
+    listing, _ = watch.scanner.scan(str(base / "session1"))
+    assert not watch.is_hot(listing, time.time())
@@ -0,0 +1,222 @@
+# Mocap Cleanup - Alastair Macleod 2016
+# GPL License = http://www.gnu.org/licenses/gpl.txt
+
+import os
+import time
+import threading
+
+from peel.cleanup.Qt import QtCore
+
+from peel.cleanup import dirScanner
+
+"""
+Watcher Module
+
+Watches the sessions under a base directory for c3d and maya files that are added, removed or modified
+and emits signals so the Loader can update just what has changed.
+
+The watcher polls on a background thread.  Each poll stats the base directory and the session and task
+directories, a directory is only read again when its mtime changes.  Directories that have changed
+recently (HOT_AGE) are polled every interval and have their files stat'd as well, as a take that is still
+being written changes size without changing the mtime of its directory.  The rest are only checked every
+COLD_INTERVAL seconds.
+
+Where Qt provides a native watcher (QFileSystemWatcher, inotify on linux) the recent directories are
+added to it as well so local changes are picked up without waiting for the next poll.  Native watchers do
+not see changes made by other machines on network drives, so polling is always used.
+
+"""
+
+TASK_DIRS = ('c3d', 'raw', 'cleaning', 'solving', 'template', 'templates')
+EXTENSIONS = ('.c3d', '.ma', '.mb')
+
+HOT_AGE = 24 * 60 * 60
+COLD_INTERVAL = 60.0
+
+
+class Watcher(QtCore.QObject):
+    """ Polls the base directory on a thread and emits:
+
+        sessionsChanged(delta) - dirScanner.Delta of the session directories added and removed
+        filesChanged(title, paths) - full paths of the files added, removed or modified in a session
+    """
+
+    sessionsChanged = QtCore.Signal(object)
+    filesChanged = QtCore.Signal(str, object)
+    hotDirectories = QtCore.Signal(object)
+
+    def __init__(self, base_dir, interval=2.0, native=True):
+        super(Watcher, self).__init__()
+        self.base_dir = base_dir
+        self.interval = interval
+        self.hot_age = HOT_AGE
+        self.cold_interval = COLD_INTERVAL
+
+        self.scanner = dirScanner.DirScanner()
+        self.files = {}     # task path: {name: (size, mtime) or None if the directory is not recent}
+        self.checked = {}   # session title: time the session was last polled
+        self.baseline = True
+
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+
+        self.native = None
+        if native and hasattr(QtCore, 'QFileSystemWatcher'):
+            self.native = QtCore.QFileSystemWatcher(self)
+            self.native.directoryChanged.connect(self.wake)
+            self.hotDirectories.connect(self.set_native_paths)
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="peel-watcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stop_event.set()
+        self.wake_event.set()
+        self.thread.join(5.0)
+        self.thread = None
+
+    def wake(self, _=None):
+        """ Polls now instead of waiting for the interval """
+        self.wake_event.set()
+
+    def set_native_paths(self, paths):
+        """ Watches the directories with the native watcher, runs on the watcher's (main) thread """
+
+        current = set(self.native.directories())
+        paths = set(paths)
+        if current - paths:
+            self.native.removePaths(list(current - paths))
+        if paths - current:
+            self.native.addPaths(list(paths - current))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print("Watcher error: " + str(e))
+
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+
+    def poll(self, now=None):
+        """ Checks the base directory once, emitting the changes since the last poll.  The first poll only
+        records the current state """
+
+        if now is None:
+            now = time.time()
+
+        listing, delta = self.scanner.scan(self.base_dir)
+        if listing is None:
+            return
+
+        baseline = self.baseline
+        self.baseline = False
+
+        if delta and not baseline:
+            self.sessionsChanged.emit(delta)
+
+        for title in delta.removed:
+            self.forget(title)
+
+        hot = []
+
+        for title in listing.dirs():
+
+            # one stat per session, the session directory is only read again if its mtime has changed
+            session_path = os.path.join(self.base_dir, title)
+            session_listing, _ = self.scanner.scan(session_path)
+            if session_listing is None:
+                continue
+
+            # check the task directories if they have changed recently or have not been checked for a while
+            recent = self.is_hot(session_listing, now)
+            if not recent and not baseline and now - self.checked.get(title, 0) < self.cold_interval:
+                continue
+
+            self.checked[title] = now
+
+            changed = self.poll_session(session_listing, now, hot)
+            if changed and not baseline:
+                self.filesChanged.emit(title, changed)
+
+        if self.native is not None:
+            self.hotDirectories.emit(hot)
+
+    def task_paths(self, session_listing):
+        return [os.path.join(session_listing.path, i) for i in session_listing.dirs() if i.lower() in TASK_DIRS]
+
+    def is_hot(self, session_listing, now):
+        """ True if the session or one of its task directories has changed recently """
+
+        if now - session_listing.mtime < self.hot_age:
+            return True
+
+        for task_path in self.task_paths(session_listing):
+            listing = self.scanner.get(task_path)
+            if listing is not None and now - listing.mtime < self.hot_age:
+                return True
+
+        return False
+
+    def poll_session(self, session_listing, now, hot):
+        """ Returns the paths of the files that have changed in the session's task directories """
+
+        changed = []
+
+        for task_path in self.task_paths(session_listing):
+
+            previous = self.scanner.get(task_path)
+            listing, _ = self.scanner.scan(task_path)
+            if listing is None:
+                continue
+
+            recent = now - listing.mtime < self.hot_age
+            if recent:
+                hot.append(task_path)
+            elif listing is previous:
+                # nothing added or removed, and not recent enough to still be written to
+                continue
+
+            # files in recent directories are stat'd to find takes that are still being written, only the
+            # names of the others are compared
+            files = {}
+            for entry in listing.files(EXTENSIONS):
+                if not recent:
+                    files[entry.name] = None
+                    continue
+                try:
+                    stat = os.stat(entry.path)
+                except OSError:
+                    continue
+                files[entry.name] = (stat.st_size, stat.st_mtime)
+
+            old = self.files.get(task_path, {})
+            self.files[task_path] = files
+
+            for name in set(old) | set(files):
+                if name not in old or name not in files:
+                    changed.append(os.path.join(task_path, name))
+                elif old[name] is not None and files[name] is not None and old[name] != files[name]:
+                    changed.append(os.path.join(task_path, name))
+
+        return sorted(changed)
+
+    def forget(self, title):
+        session_path = os.path.join(self.base_dir, title)
+        self.scanner.forget(session_path)
+        self.checked.pop(title, None)
+
+        prefix = os.path.join(session_path, "")
+        for path in [i for i in self.files if i.startswith(prefix)]:
+            del self.files[path]
@@ -20,12 +20,27 @@
 
 
 from __future__ import print_function
-import maya.cmds as m
+try:
+    import maya.cmds as m
+    import maya.OpenMaya as om
+    import maya.OpenMayaAnim as oma
+    from peel.util import vector, dag
+except ImportError:
+    # the array functions and the in memory scene (util.scene) also work outside of maya
+    m = om = oma = vector = dag = None
+
 import math
-import collections
 import bisect
+import numpy as np
+
+from peel.util import scene
+
+
+def maya_only(feature):
+    """ raises a RuntimeError if feature is used outside of maya """
 
-from peel.util import vector, dag
+    if m is None:
+        raise RuntimeError(feature + " is only available in maya")
 
 
 class fcurve(object):
@@ -33,7 +48,11 @@ class fcurve(object):
 
     * self.node - the name of the maya node
     * self.attr - the attribute on the node
-    * self.data - dict of keys -> times/values
+    * self.times - sorted float64 array of the key times
+    * self.values - float64 array of the key values, aligned with self.times
+
+    Keys are added and removed in bulk with set_keys() and delete_keys(), which merge the arrays rather
+    than inserting one key at a time.
     """
 
     def __init__(self, node=None, attr=None):
@@ -44,7 +63,23 @@ class fcurve(object):
         else:
             self.node = node
             self.attr = attr
-        self.data = {}
+        self.clear()
+
+    def clear(self):
+        """ removes all the keys """
+        self.times = np.zeros(0, dtype=np.float64)
+        self.values = np.zeros(0, dtype=np.float64)
+
+    @property
+    def data(self):
+        """ dict of time: value, a copy of the keys """
+        return dict(zip(self.times.tolist(), self.values.tolist()))
+
+    @data.setter
+    def data(self, value):
+        self.clear()
+        if value:
+            self.set_keys(list(value.keys()), list(value.values()))
 
     def fetch(self, sl=False, use_api=False):
         """ get the data from maya """
@@ -52,77 +87,122 @@ class fcurve(object):
         if self.node is None or self.attr is None:
             raise ValueError("Invalid parameters for node/attr")
 
+        if use_api or sl:
+            maya_only("Reading keys with use_api or sl")
+
         if use_api:
             curve = dag.anim_curve(self.node, self.attr, create=False)
             n = curve.numKeys()
+            times = np.empty(n, dtype=np.float64)
+            values = np.empty(n, dtype=np.float64)
             for i in range(n):
-                v = curve.value(i)
-                t = curve.time(i).value()
-                self.data[t] = v
+                values[i] = curve.value(i)
+                times[i] = curve.time(i).value()
+        elif sl:
+
+            node_attr = self.node + '.' + self.attr
+            times = m.keyframe(node_attr, q=True, sl=sl)
+            values = m.keyframe(node_attr, q=True, vc=True, sl=sl)
+            if times is None or values is None:
+                print("no keys")
+                return
+
         else:
 
             node_attr = self.node + '.' + self.attr
-            k = m.keyframe(node_attr, q=True, sl=sl)
-            v = m.keyframe(node_attr, q=True, vc=True, sl=sl)
-            if k is None or v is None:
+            times, values = scene.get().fetch_keys([node_attr])[node_attr]
+            if len(times) == 0:
                 print("no keys")
                 return
-            self.data = dict(zip(k, v))
+
+        self.clear()
+        self.set_keys(times, values)
 
     def apply(self, stepped=False, use_api=False, create=False):
 
-        """ apply the data to maya """
+        """ apply the data to the scene """
 
-        if not m.objExists(self.node):
+        scn = scene.get()
+        node_attr = self.node + '.' + self.attr
+
+        if not scn.exists(self.node):
             if not create:
-                m.error("Node does not exist: " + self.node)
-            else:
+                raise RuntimeError("Node does not exist: " + self.node)
+            elif m is not None:
                 m.spaceLocator(name=self.node)
 
-        if not m.objExists(self.node + '.' + self.attr):
+        if not scn.exists(node_attr):
             if not create:
-                m.error("Channel does not exist: " + self.node + '.' + self.attr)
-            else:
+                raise RuntimeError("Channel does not exist: " + node_attr)
+            elif m is not None:
                 m.addAttr(self.node, ln=self.attr, k=True)
 
         if use_api:
+            maya_only("Applying keys with use_api")
             dag.apply_curve(self.node, self.attr, self.data, stepped)
-        else:
-            m.cutKey(self.node + '.' + self.attr)
-            for k, v in self.data.items():
-                m.setKeyframe(self.node + '.' + self.attr, t=k, v=v)
+            return
+
+        scn.set_keys({node_attr: (self.times, self.values)}, stepped=stepped)
 
     def keys(self):
         """ return the keys """
-        return sorted(list(self.data.keys()))
+        return self.times.tolist()
+
+    def find(self, time):
+        """ returns the index of the key at time, or None """
+        i = np.searchsorted(self.times, time)
+        if i < len(self.times) and self.times[i] == time:
+            return int(i)
+        return None
 
-    def values(self):
-        """ return the values """
-        return [i[1] for i in sorted(self.data.items())]
+    def __len__(self):
+        return len(self.times)
 
     def __getitem__(self, index):
-        """ array method """
-        return self.data[index]
+        """ array method, returns the value of the key at time index """
+        i = self.find(index)
+        if i is None:
+            raise KeyError(index)
+        return float(self.values[i])
 
     def __setitem__(self, index, value):
         """ array set method """
-        self.data[index] = value
+        self.set_keys([index], [value])
+
+    def set_keys(self, times, values):
+        """ merges the keys in to the curve, replacing the values of any keys already at the same times """
+
+        times = np.asarray(times, dtype=np.float64).ravel()
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(times) != len(values):
+            raise ValueError("Times and values are different lengths")
+
+        if len(times) == 0:
+            return
+
+        # np.unique keeps the first of each time, so put the new keys first
+        all_times = np.concatenate((times, self.times))
+        all_values = np.concatenate((values, self.values))
+        self.times, first = np.unique(all_times, return_index=True)
+        self.values = all_values[first]
+
+    def delete_keys(self, times):
+        """ removes the keys at the given times """
+
+        keep = ~np.isin(self.times, np.asarray(times, dtype=np.float64))
+        self.times = self.times[keep]
+        self.values = self.values[keep]
 
     def check_valid(self):
-        if self.data is None or len(self.data) == 0:
-            raise RuntimeError("No keys on " + self.node + "." + self.attr)
+        if len(self.times) == 0:
+            raise RuntimeError("No keys on " + str(self.node) + "." + str(self.attr))
 
     def offset(self, value):
 
         """ offset the data in memory by a value, does not modify the scene - needs applied """
 
         self.check_valid()
-
-        newdata = {}
-        for k, v in self.data.items():
-            newdata[k + value] = v
-
-        self.data = newdata
+        self.times = self.times + value
 
     def zero(self):
 
@@ -130,12 +210,41 @@ class fcurve(object):
 
         self.check_valid()
 
-        start = min(self.data.keys())
+        start = self.times[0]
         if start == 0.0:
             return
 
         self.offset(-start)
 
+    def copy(self, times=None, values=None):
+        ret = fcurve(self.node, self.attr)
+        ret.times = self.times.copy() if times is None else times
+        ret.values = self.values.copy() if values is None else values
+        return ret
+
+    def slice(self, start, end):
+
+        """ returns a new fcurve with the keys from start to end (inclusive) """
+
+        a = np.searchsorted(self.times, start, side='left')
+        b = np.searchsorted(self.times, end, side='right')
+        return self.copy(self.times[a:b].copy(), self.values[a:b].copy())
+
+    def resample(self, rate, start=None, end=None):
+
+        """ returns a new fcurve with a key every rate frames from start to end, linearly interpolated """
+
+        self.check_valid()
+
+        if start is None:
+            start = self.times[0]
+        if end is None:
+            end = self.times[-1]
+
+        count = int(np.floor((end - start) / rate + 1e-6)) + 1
+        times = start + np.arange(max(count, 0), dtype=np.float64) * rate
+        return self.copy(times, np.interp(times, self.times, self.values))
+
     def selectKeys(self, keys):
 
         """ select the provided keys in the fcurve editor """
@@ -147,57 +256,67 @@ class fcurve(object):
 
 
 class channel(object):
-    """ A channel has x,y and z tranlsation keys a fixed time step apart (rate) """
+    """ A channel has x,y and z tranlsation keys a fixed time step apart (rate)
+
+    * self.times - sorted float64 array of the key times
+    * self.points - (n, 3) float64 array of the translation at each key
+    """
 
     def __init__(self, node, rate, timeRange=None):
 
-        """ create an empty channel.  Data is set to an empty dict """
+        """ create an empty channel """
         self.node = node
         self.rate = rate
         self.timeRange = timeRange
-        self.data = {}
+        self.times = np.zeros(0, dtype=np.float64)
+        self.points = np.zeros((0, 3), dtype=np.float64)
+
+    @property
+    def data(self):
+        """ dict of time: (x, y, z), a copy of the keys """
+        return dict(zip(self.times.tolist(), [tuple(i) for i in self.points.tolist()]))
+
+    @data.setter
+    def data(self, value):
+        items = sorted(value.items()) if value else []
+        self.times = np.array([i[0] for i in items], dtype=np.float64)
+        self.points = np.array([i[1] for i in items], dtype=np.float64).reshape(-1, 3)
 
     def fetch(self):
 
-        """ populate self.data with keys from the maya scene. """
+        """ populate self.times and self.points with keys from the scene. """
 
         if self.node is None:
             raise ValueError("no node specified")
 
-        if self.timeRange:
-
-            kx = m.keyframe(self.node + '.tx', q=True, t=self.timeRange)
-            ky = m.keyframe(self.node + '.ty', q=True, t=self.timeRange)
-            kz = m.keyframe(self.node + '.tz', q=True, t=self.timeRange)
-
-            vx = m.keyframe(self.node + '.tx', q=True, vc=True, t=self.timeRange)
-            vy = m.keyframe(self.node + '.ty', q=True, vc=True, t=self.timeRange)
-            vz = m.keyframe(self.node + '.tz', q=True, vc=True, t=self.timeRange)
-
-        else:
-
-            kx = m.keyframe(self.node + '.tx', q=True)
-            ky = m.keyframe(self.node + '.ty', q=True)
-            kz = m.keyframe(self.node + '.tz', q=True)
+        channels = [self.node + '.tx', self.node + '.ty', self.node + '.tz']
+        keys = scene.get().fetch_keys(channels, self.timeRange or None)
+        (kx, vx), (ky, vy), (kz, vz) = [keys[i] for i in channels]
 
-            vx = m.keyframe(self.node + '.tx', q=True, vc=True)
-            vy = m.keyframe(self.node + '.ty', q=True, vc=True)
-            vz = m.keyframe(self.node + '.tz', q=True, vc=True)
+        if not np.array_equal(kx, ky): raise RuntimeError("Keys not aligned")
+        if not np.array_equal(kx, kz): raise RuntimeError("Keys not aligned")
 
-        if kx != ky: raise RuntimeError("Keys not aligned")
-        if kx != kz: raise RuntimeError("Keys not aligned")
+        self.times = kx
+        self.points = np.column_stack((vx, vy, vz)).reshape(-1, 3)
 
-        self.data = dict(zip(kx, zip(vx, vy, vz)))
+    def __len__(self):
+        return len(self.times)
 
     def __getitem__(self, item):
-        return vector.Vector(self.data[item])
+        i = np.searchsorted(self.times, item)
+        if i == len(self.times) or self.times[i] != item:
+            raise KeyError(item)
+        if vector is None:
+            # outside of maya there is no Vector, return the x, y, z row
+            return self.points[i].copy()
+        return vector.Vector(data=self.points[i].tolist())
 
     def neighbour_keys(self, frame=None):
 
         if frame is None:
-            frame = m.currentTime(q=True)
+            frame = scene.get().current_time()
 
-        keys = sorted(self.data.keys())
+        keys = self.times.tolist()
         if len(keys) < 2:
             return None, None, None
         pos = bisect.bisect_left(keys, frame)
@@ -215,47 +334,17 @@ class channel(object):
 
     def deltas(self):
 
-        """ returns the physical distance (length) between keys.  returns (keys, deltas) """
+        """ returns the speed (distance / time) between keys.  returns (keys, deltas) as arrays, deltas has
+        one less item than keys """
 
-        keys, vals = zip(*sorted(self.data.items()))
-        deltas = []
+        return self.times, speeds(self.times, self.points)
 
-        for i in range(1, len(keys)):
-            p2 = vals[i - 1]
-            p1 = vals[i]
-            deltav = math.sqrt(sum([(b - a) * (b - a) for a, b in zip(p1, p2)]))
-            deltat = keys[i] - keys[i - 1]
-            deltas.append(deltav / deltat)
-
-        return keys, deltas
-
-    def spikes(self, width, limit):
+    def spikes(self, width, limit, average='mean'):
 
         """ uses the deltas to determine where possible spikes in the data may be.
          returns a list of keys where the spikes happen """
 
-        keys, deltas = self.deltas()
-
-        # create a 'width' sized deque and load it with the head of the data
-        deck = collections.deque(deltas[:width])
-
-        # slide the deck over the list keeping a moving average
-
-        res = []
-        for i in range(width, len(deltas)):
-            halfset = sorted(list(deck))[:width / 2]
-            average = sum(halfset) / len(halfset)
-            res.append(average)
-            deck.popleft()
-            deck.append(deltas[i])
-
-        out = []
-        for i in range(len(deltas)):
-            rval = res[i] if i < len(res) else res[-1]
-            dif = deltas[i] / rval
-            if dif > limit: out.append(keys[i + 1])
-
-        return out
+        return spike_frames(self.times, self.points, width, limit, average).tolist()
 
     def find_spikes(self, limit=30, debug=False, time=None):
 
@@ -263,14 +352,11 @@ class channel(object):
         Finds moments where the data maintains the rate, but the key value
         shifts more than a moving average """
 
-        if self.data is None or len(self.data) is None:
-            return None
-
-        if len(self.data) < 2:
+        if len(self.times) < 2:
             return None
 
-        # sort the keys and values by time
-        keys, vals = zip(*sorted(self.data.items()))
+        keys = self.times.tolist()
+        vals = [tuple(i) for i in self.points.tolist()]
 
         res = []
         last_delta = None
@@ -308,28 +394,322 @@ class channel(object):
 
     def find_swaps(self, other):
 
-        k1, v1 = zip(*sorted(self.data.items()))
-        k2, v2 = zip(*sorted(other.data.items()))
+        """ returns the keys where this channel and other fit better with their data swapped, see
+        markerset_swaps() to check a whole markerset """
 
-        ret = []
+        # keys on both channels, where the key before is also on both
+        common = np.isin(self.times, other.times)
+        index = np.flatnonzero(common[1:] & common[:-1]) + 1
+        if len(index) == 0:
+            return []
 
-        for  i in range(1, len(k1) -1):
+        a1 = self.points[index - 1]
+        a2 = self.points[index]
+        b1 = other.points[np.searchsorted(other.times, self.times[index - 1])]
+        b2 = other.points[np.searchsorted(other.times, self.times[index])]
 
-            t1 = k1[i-1]
-            t2 = k1[i]
+        # delta1 + delta2 > swap1 + swap2, expanded
+        cost = -2.0 * np.einsum('ij,ij->i', a1 - b1, a2 - b2)
+        return self.times[index[cost > 0]].tolist()
 
-            if t1 not in k2 or t2 not in k2:
-                continue
 
-            delta1 = sum([(b - a) * (b - a) for a, b in zip(self.data[t1], self.data[t2])])
-            delta2 = sum([(b - a) * (b - a) for a, b in zip(other.data[t1], other.data[t2])])
-            swap1 = sum([(b - a) * (b - a) for a, b in zip(self.data[t1], other.data[t2])])
-            swap2 = sum([(b - a) * (b - a) for a, b in zip(other.data[t1], self.data[t2])])
+def speeds(times, points):
+    """ returns the speed (distance / time) between each key and the one before it, for (n,) times and
+    (n, 3) points """
 
-            if delta1 + delta2 > swap1 + swap2:
-                ret.append(t2)
+    times = np.asarray(times, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+    if len(times) < 2:
+        return np.zeros(0, dtype=np.float64)
 
-        return ret
+    delta = np.diff(points, axis=0)
+    return np.sqrt(np.einsum('ij,ij->i', delta, delta)) / np.diff(times)
+
+
+def rolling_windows(values, width):
+    """ returns a read only (len(values) - width + 1, width) strided view of each window in values """
+
+    values = np.ascontiguousarray(values)
+    count = len(values) - width + 1
+    stride = values.strides[0]
+    return np.lib.stride_tricks.as_strided(values, shape=(count, width), strides=(stride, stride),
+                                           writeable=False)
+
+
+def rolling_min(values, width):
+    """ returns the minimum of each width sized window in values, by combining windows of doubling size """
+
+    out = values
+    span = 1
+    while span * 2 <= width:
+        out = np.minimum(out[:-span], out[span:])
+        span *= 2
+
+    if span < width:
+        out = np.minimum(out[:len(out) - (width - span)], out[width - span:])
+
+    return out
+
+
+def rolling_mean(values, width):
+    """ returns the mean of each width sized window in values """
+
+    total = np.concatenate(([0.0], np.cumsum(values)))
+    return (total[width:] - total[:-width]) / width
+
+
+def window_average(windows, average='mean'):
+    """ returns the typical value of each row of windows.  'mean' is the mean of the lower half of the
+    window, so a spike in the window does not raise it, 'median' is the window median """
+
+    width = windows.shape[1]
+
+    if average == 'median':
+        return np.median(windows, axis=1)
+
+    if average == 'mean':
+        half = max(1, width // 2)
+        return np.partition(windows, half - 1, axis=1)[:, :half].mean(axis=1)
+
+    raise ValueError("Invalid average: " + str(average))
+
+
+def pad_windows(values, n):
+    """ extends the per window values (one for each window start, n - width + 1 of them) to n items.  As in
+    the original spike finder the last window is not used, the keys from n - width - 1 on all use the window
+    that starts there.  If there is only one window every key uses it """
+
+    if len(values) > 1:
+        values = values[:-1]
+    return np.concatenate((values, np.full(n - len(values), values[-1])))
+
+
+def rolling_baseline(deltas, width, average='mean'):
+    """ returns the typical speed in the width keys starting at each delta, see window_average() """
+
+    deltas = np.asarray(deltas, dtype=np.float64)
+    n = len(deltas)
+    if n == 0:
+        return deltas
+
+    width = max(1, min(int(width), n))
+    return pad_windows(window_average(rolling_windows(deltas, width), average), n)
+
+
+def spike_frames(times, points, width=10, limit=3, average='mean'):
+    """ returns the keys (array) where the speed is more than limit times the rolling baseline speed, see
+    rolling_baseline() """
+
+    times = np.asarray(times, dtype=np.float64)
+    return times[1:][speed_spikes(speeds(times, points), width, limit, average)]
+
+
+def speed_spikes(deltas, width=10, limit=3, average='mean'):
+    """ returns the indices of the deltas that are more than limit times their rolling baseline.
+
+    The baseline is never less than the window minimum, and the lower half mean is never more than the
+    window mean, so only the deltas between the two bounds need the baseline of their window worked out """
+
+    n = len(deltas)
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    width = max(1, min(int(width), n))
+
+    candidates = np.nonzero(deltas > limit * pad_windows(rolling_min(deltas, width), n))[0]
+
+    if average == 'mean':
+        above_mean = deltas[candidates] > limit * pad_windows(rolling_mean(deltas, width), n)[candidates]
+        spikes = candidates[above_mean]
+        candidates = candidates[~above_mean]
+    else:
+        spikes = candidates[:0]
+
+    if len(candidates):
+        windows = rolling_windows(deltas, width)[np.minimum(candidates, max(0, n - width - 1))]
+        baseline = window_average(windows, average)
+        spikes = np.union1d(spikes, candidates[deltas[candidates] > limit * baseline])
+
+    return spikes
+
+
+def markerset_spikes(times, points, valid=None, width=10, limit=3, average='mean'):
+    """ finds the spikes on every marker in one call.
+
+    times - (frames,) key times
+    points - (frames, markers, 3) array of positions, e.g. from a c3d
+    valid - optional (frames, markers) bool array, frames that are not valid are gaps and are skipped
+
+    returns a list with an array of spike keys for each marker """
+
+    times = np.asarray(times, dtype=np.float64)
+    points = np.asarray(points)
+    if len(times) < 2:
+        return [times[:0] for _ in range(points.shape[1])]
+
+    # distance each marker moves between frames, worked out for all the markers at once in frame order
+    # then stored marker major so each marker's distances are contiguous
+    step = np.diff(points, axis=0)
+    distances = np.ascontiguousarray(np.sqrt(np.einsum('fmi,fmi->fm', step, step)).T, dtype=np.float64)
+    del step
+
+    if valid is None:
+        frame_times = np.diff(times)
+        return [times[1:][speed_spikes(i / frame_times, width, limit, average)] for i in distances]
+
+    valid = np.ascontiguousarray(np.asarray(valid, dtype=bool).T)
+
+    ret = []
+    for marker in range(points.shape[1]):
+        frames = np.flatnonzero(valid[marker])
+        if len(frames) < 2:
+            ret.append(times[:0])
+            continue
+
+        # keys either side of a gap are not on consecutive frames, work out the distance across the gap
+        deltas = distances[marker][frames[:-1]]
+        gaps = np.flatnonzero(np.diff(frames) > 1)
+        if len(gaps):
+            across = points[frames[gaps + 1], marker] - points[frames[gaps], marker]
+            deltas[gaps] = np.linalg.norm(np.asarray(across, dtype=np.float64), axis=1)
+
+        keys = times[frames]
+        ret.append(keys[1:][speed_spikes(deltas / np.diff(keys), width, limit, average)])
+
+    return ret
+
+
+def spikes(nodes, width=10, limit=3, timeRange=None, average='mean'):
+    """ returns a dict of node: list of spike keys for each of the nodes in the scene """
+
+    times, points, valid = markerset(nodes, timeRange)
+    found = markerset_spikes(times, points, valid, width, limit, average)
+    return dict((node, i.tolist()) for node, i in zip(nodes, found))
+
+
+SWAP_BLOCK = 32
+SWAP_CHUNK = 16384
+
+
+def markerset_swaps(points, radius, valid=None, times=None, block=SWAP_BLOCK, min_cost=0.0):
+    """ finds frames where two markers look to have swapped labels, for every pair of markers in one call.
+
+    points - (frames, markers, 3) array of positions, e.g. from a c3d
+    radius - how close (in the units of points) a marker has to be to the other marker's last position
+    valid - optional (frames, markers) bool array, frames that are not valid are gaps and are skipped
+    times - optional (frames,) key times to return instead of frame numbers
+
+    A pair swaps on a frame if each marker is within radius of where the other one was on the frame before,
+    and the positions fit better with the labels swapped.  The cost is how much better they fit, the
+    squared distance the two markers move with their labels as they are minus the squared distance with
+    them swapped, so the separation between the markers has reversed.
+
+    The frames are split in to blocks and only pairs whose bounding boxes for the block are within radius
+    of each other are checked (sweep and prune along x).
+
+    returns [(frame, marker_a, marker_b, cost), ...] with the highest cost first """
+
+    points = np.asarray(points)
+    frames, markers = points.shape[:2]
+    if frames < 2 or markers < 2:
+        return []
+
+    # block j checks the changes on to frames j*block+1 .. (j+1)*block, so it needs one frame either side
+    blocks = (frames - 2) // block + 1
+    pts = np.full((blocks * block + 1, markers, 3), np.nan, dtype=np.result_type(points.dtype, np.float32))
+    pts[:frames] = points
+    if valid is not None:
+        pts[:frames][~np.asarray(valid, dtype=bool)] = np.nan
+
+    body = pts[:-1].reshape(blocks, block, markers, 3)
+    lo = np.fmin(np.fmin.reduce(body, axis=1), pts[block::block])
+    hi = np.fmax(np.fmax.reduce(body, axis=1), pts[block::block])
+    del body
+
+    # broad phase: sort the boxes in each block by x, then compare each box with the ones after it in the
+    # sorted order until none of them start within radius of the end of a box
+    order = np.argsort(lo[:, :, 0], axis=1)
+    lo = np.take_along_axis(lo, order[:, :, None], axis=1)
+    hi = np.take_along_axis(hi, order[:, :, None], axis=1) + radius
+
+    lo_x = lo[:, :, 0]
+    hi_x = hi[:, :, 0]
+    lo_y, lo_z, hi_y, hi_z = [np.ascontiguousarray(i).ravel() for i in
+                              (lo[:, :, 1], lo[:, :, 2], hi[:, :, 1], hi[:, :, 2])]
+    order = order.ravel()
+
+    pair_block = []
+    pair_a = []
+    pair_b = []
+    for k in range(1, markers):
+        j, i = np.nonzero(lo_x[:, k:] <= hi_x[:, :-k])
+        if len(j) == 0:
+            break
+        first = j * markers + i
+        second = first + k
+        near = (lo_y[second] <= hi_y[first]) & (lo_y[first] <= hi_y[second])
+        near &= (lo_z[second] <= hi_z[first]) & (lo_z[first] <= hi_z[second])
+        pair_block.append(j[near])
+        pair_a.append(order[first[near]])
+        pair_b.append(order[second[near]])
+
+    if not pair_block:
+        return []
+
+    pair_block = np.concatenate(pair_block)
+    pair_a = np.concatenate(pair_a)
+    pair_b = np.concatenate(pair_b)
+
+    # narrow phase: check every change in the block for each pair
+    steps = np.arange(1, block + 1)
+    radius_sq = radius * radius
+    found = []
+
+    for start in range(0, len(pair_block), SWAP_CHUNK):
+        j = pair_block[start:start + SWAP_CHUNK]
+        a = pair_a[start:start + SWAP_CHUNK, None]
+        b = pair_b[start:start + SWAP_CHUNK, None]
+        frame = j[:, None] * block + steps
+
+        a1 = pts[frame - 1, a].astype(np.float64)
+        b1 = pts[frame - 1, b].astype(np.float64)
+        a2 = pts[frame, a].astype(np.float64)
+        b2 = pts[frame, b].astype(np.float64)
+
+        cost = -2.0 * np.einsum('ijk,ijk->ij', a1 - b1, a2 - b2)
+        with np.errstate(invalid='ignore'):
+            hit = cost > min_cost
+            hit &= np.einsum('ijk,ijk->ij', a1 - b2, a1 - b2) < radius_sq
+            hit &= np.einsum('ijk,ijk->ij', b1 - a2, b1 - a2) < radius_sq
+
+        row, col = np.nonzero(hit)
+        pair = np.sort(np.column_stack((a[row, 0], b[row, 0])), axis=1)
+        found.append((frame[row, col], pair[:, 0], pair[:, 1], cost[row, col]))
+
+    frame, a, b, cost = [np.concatenate(i) for i in zip(*found)]
+    rank = np.argsort(-cost, kind='stable')
+
+    if times is not None:
+        frame = np.asarray(times)[frame]
+
+    return list(zip(frame[rank].tolist(), a[rank].tolist(), b[rank].tolist(), cost[rank].tolist()))
+
+
+def markerset(nodes, timeRange=None):
+    """ fetches the translation keys of the nodes in the scene in to arrays.
+    returns (times, points, valid) - the times are every key time on any of the nodes, points is a
+    (times, nodes, 3) array and valid is False where the node does not have a key """
+
+    return scene.get().fetch_points(nodes, timeRange or None)
+
+
+def swaps(nodes, radius, timeRange=None):
+    """ returns [(time, node_a, node_b, cost), ...] for the marker swaps between the nodes in the scene,
+    see markerset_swaps() """
+
+    times, points, valid = markerset(nodes, timeRange)
+    events = markerset_swaps(points, radius, valid, times)
+    return [(t, nodes[a], nodes[b], cost) for t, a, b, cost in events]
 
 
 def ls():
@@ -351,47 +731,202 @@ def get_keys(node_chan):
     """ returns a list of the keys (times) for the node.attr, or None """
 
     if '.' not in node_chan: node_chan += '.tx'
-    keys = sorted(m.keyframe(node_chan, q=True))
-    if keys is None: return None
+    keys = scene.get().fetch_keys([node_chan])[node_chan][0]
     if len(keys) < 1: return None
-    return keys
+    return keys.tolist()
 
 
-def current_segment_or_gap(node_chan, rate):
-    """ returns ( 'gap' | 'segment', ( in, out ) ) or None """
+class GapIndex(object):
+    """ The key times of a node.channel as an array, with the segments of keys and the gaps between them.
+
+    * self.times - sorted float64 array of the key times
+    * self.starts, self.ends - the first and last key of each segment
+    * self.dirty - set when the keys may have changed, the next query fetches them again
+
+    Keys more than twice the rate apart are a gap.  Queries use a binary search, so they do not depend on
+    the length of the take.  See gap_index() for the cached index of a node.channel """
+
+    def __init__(self, node_chan, rate):
+        if '.' not in node_chan: node_chan += '.tx'
+        self.node_chan = node_chan
+        self.rate = rate
+        self.dirty = True
+        self.set_keys([])
+
+    def invalidate(self):
+        self.dirty = True
+
+    def update(self):
+        """ fetches the keys from the scene if they may have changed """
+
+        scn = scene.get()
+
+        if not self.dirty:
+            # keys added or removed without the callback firing, e.g. a deleted curve
+            if scn.key_count(self.node_chan) == len(self.times):
+                return
 
-    ct = m.currentTime(q=True)
+        self.set_keys(scn.fetch_keys([self.node_chan])[self.node_chan][0])
 
-    r = rate * 0.5
+    def set_keys(self, times):
+        """ builds the segments and gaps from the key times """
 
-    seg = segments(node_chan, rate)
-    if seg is None or len(seg) == 0: return None
+        self.times = np.unique(np.asarray(times, dtype=np.float64))
+        self.dirty = False
 
-    if ct < seg[0][0] - r:
-        return 'before', seg[0][0]
+        if len(self.times) == 0:
+            self.starts = self.ends = self.times
+            return
+
+        breaks = np.flatnonzero(np.round(np.diff(self.times), 2) - self.rate * 1.99 > 0)
+        self.starts = self.times[np.concatenate(([0], breaks + 1))]
+        self.ends = self.times[np.concatenate((breaks, [len(self.times) - 1]))]
 
-    if ct > seg[-1][1] + r:
-        return 'after', seg[-1][1]
+    def __len__(self):
+        return len(self.times)
 
-    last = None
-    for i, o in seg:
-        # segments are greedy ( add r )
-        if i - r < ct and ct < o + r:
-            return ('segment', (i, o))
-        if last is not None and last < ct and ct < i:
-            return ('gap', (last, i))
-        last = o
+    def segments(self):
+        """ returns [(first key, last key), ...] for each group of keys """
+        return list(zip(self.starts.tolist(), self.ends.tolist()))
+
+    def gaps(self):
+        """ returns [(key before, key after), ...] for each gap """
+        return list(zip(self.ends[:-1].tolist(), self.starts[1:].tolist()))
+
+    def segment_at(self, frame):
+        """ returns (first key, last key) of the segment containing frame, or None.  Segments are greedy
+        by half the rate """
+
+        r = self.rate * 0.5
+        i = np.searchsorted(self.starts, frame + r, side='left') - 1
+        if i < 0 or frame >= self.ends[i] + r:
+            return None
+        return float(self.starts[i]), float(self.ends[i])
+
+    def gap_at(self, frame):
+        """ returns (key before, key after) of the gap containing frame, or None """
+
+        i = np.searchsorted(self.starts, frame, side='right')
+        if i == 0 or i == len(self.starts) or self.ends[i - 1] >= frame:
+            return None
+        return float(self.ends[i - 1]), float(self.starts[i])
+
+    def next_gap(self, frame):
+        """ returns the first gap that starts at or after frame as (key before, key after), or None """
+
+        i = np.searchsorted(self.ends[:-1], frame, side='left')
+        if i >= len(self.ends) - 1:
+            return None
+        return float(self.ends[i]), float(self.starts[i + 1])
+
+    def previous_gap(self, frame):
+        """ returns the last gap that ends at or before frame as (key before, key after), or None """
+
+        i = np.searchsorted(self.starts[1:], frame, side='right') - 1
+        if i < 0:
+            return None
+        return float(self.ends[i]), float(self.starts[i + 1])
+
+    def current(self, frame):
+        """ returns ('before' | 'after', key) outside of the keys, otherwise ('segment' | 'gap', (in, out)),
+        or None if there are no keys """
+
+        if len(self.times) == 0:
+            return None
+
+        r = self.rate * 0.5
+
+        if frame < self.starts[0] - r:
+            return 'before', float(self.starts[0])
+
+        if frame > self.ends[-1] + r:
+            return 'after', float(self.ends[-1])
+
+        seg = self.segment_at(frame)
+        if seg is not None:
+            return 'segment', seg
+
+        gap = self.gap_at(frame)
+        if gap is not None:
+            return 'gap', gap
+
+        return None
+
+
+gap_indexes = {}
+gap_callbacks = []
+
+
+def gap_index(node_chan, rate):
+    """ returns the GapIndex for the node.channel, the index is kept until the keys change """
+
+    if '.' not in node_chan: node_chan += '.tx'
+
+    add_gap_callbacks()
+
+    index = gap_indexes.get(node_chan)
+    if index is None or index.rate != rate:
+        index = GapIndex(node_chan, rate)
+        gap_indexes[node_chan] = index
+
+    index.update()
+    return index
+
+
+def invalidate_gap_indexes(*args):
+    """ marks every index as dirty, called when any anim curve is edited """
+    for index in gap_indexes.values():
+        index.dirty = True
+
+
+def clear_gap_indexes(*args):
+    gap_indexes.clear()
+
+
+def add_gap_callbacks():
+    """ registers the maya callbacks that invalidate the gap indexes, once """
+
+    if gap_callbacks:
+        return
+
+    if oma is None:
+        # outside of maya the in memory scene does not have callbacks, call invalidate_gap_indexes()
+        gap_callbacks.append(None)
+        return
+
+    try:
+        gap_callbacks.append(oma.MAnimMessage.addAnimCurveEditedCallback(invalidate_gap_indexes))
+        gap_callbacks.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeNew, clear_gap_indexes))
+        gap_callbacks.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeOpen, clear_gap_indexes))
+    except (AttributeError, RuntimeError) as e:
+        print("Could not add gap index callbacks: " + str(e))
+        gap_callbacks.append(None)
+
+
+def current_segment_or_gap(node_chan, rate):
+    """ returns ( 'gap' | 'segment', ( in, out ) ) or None """
+
+    ct = scene.get().current_time()
+    return gap_index(node_chan, rate).current(ct)
+
+
+currentSegmentOrGap = current_segment_or_gap
 
 
 def current_spike_segment(node, rate, sampleWidth=10, limit=3):
-    sel = m.ls(sl=True)[0]
-    seg = current_segment_or_gap(sel, rate)
-    if seg[0] != 'segment':
+    """ returns the (in, out) of the current segment on the node, narrowed to the spikes either side of the
+    current time, or None if the current time is not in a segment """
+
+    if node is None:
+        node = m.ls(sl=True)[0]
+
+    seg = current_segment_or_gap(node, rate)
+    if seg is None or seg[0] != 'segment':
         return None
     inPoint, outPoint = seg[1]
-    ct = m.currentTime(q=True)
+    ct = scene.get().current_time()
 
-    c = channel(sel, rate, seg[1])
+    c = channel(node, rate, seg[1])
     c.fetch()
     spikes = c.spikes(sampleWidth, limit)
 
@@ -405,40 +940,23 @@ def current_spike_segment(node, rate, sampleWidth=10, limit=3):
     return inPoint, outPoint
 
 
-def segments(node_chan, rate):
-    """ returns groups of keys clustered togther (opposite of gaps) """
+currentSpikeSegment = current_spike_segment
 
-    keys = getKeys(node_chan)
-    if keys is None: return None
 
-    # only one key so make that the only segment
-    if len(keys) == 1:
-        return [(keys[0], keys[0])]
+def segments(node_chan, rate):
+    """ returns groups of keys clustered togther (opposite of gaps) """
 
-    res = []
-    current = keys[0]
-    for i in range(1, len(keys)):
-        delta = keys[i] - keys[i - 1]
-        if round(delta, 2) - rate * 1.99 > 0:
-            res.append((current, keys[i - 1]))
-            current = keys[i]
-
-    res.append((current, keys[-1]))
-    return res
+    index = gap_index(node_chan, rate)
+    if len(index) == 0: return None
+    return index.segments()
 
 
 def gaps(node_chan, rate):
-    """ returns the keys right before a gap on the node.channel """
-
-    keys = getKeys(node_chan)
-    if keys is None: return
+    """ returns the keys right before and after each gap on the node.channel """
 
-    res = []
-    for i in range(1, len(keys)):
-        delta = keys[i] - keys[i - 1]
-        if round(delta, 2) - rate * 1.99 > 0:
-            res.append((keys[i - 1], keys[i]))
-    return res
+    index = gap_index(node_chan, rate)
+    if len(index) == 0: return None
+    return index.gaps()
 
 
 def select_keys(node_chan, keys):
@@ -467,10 +985,12 @@ def zero(nodes, start_frame=0):
             channel = m.listConnections(curve_node, d=True, p=True)[0]
             curve_obj = fcurve(channel)
             curve_obj.fetch(use_api=True)
-            if start is None or min(curve_obj.data.keys()) < start:
-                start = min(curve_obj.data.keys())
-            if end is None or max(curve_obj.data.keys()) > end:
-                end = max(curve_obj.data.keys())
+            if len(curve_obj) == 0:
+                continue
+            if start is None or curve_obj.times[0] < start:
+                start = curve_obj.times[0]
+            if end is None or curve_obj.times[-1] > end:
+                end = curve_obj.times[-1]
             curves.append(curve_obj)
 
     if start is None:
@@ -0,0 +1,389 @@
+# Copyright (c) 2021 Alastair Macleod
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Scene Module
+
+The cleanup tools read and write the scene through a Scene object rather than calling maya.cmds for
+each key, so the same code can work on a maya scene or on arrays in memory.
+
+Keys are passed around as a dict of channel (node.attr): (times, values), both sorted float64 arrays.
+
+MayaScene reads each curve with one keyframe query and replaces a curve with one setAttr on its .ktv
+array.  Keys set with replace=False are inserted, so the rest of the curve and its tangents are kept and
+filling a gap only touches the keys in the gap.
+
+MemoryScene holds the keys and attributes in dicts, use from_arrays() to load a (frames, markers, 3)
+array, e.g. from a c3d, and run the tools without maya.
+
+get() returns the scene the tools use, MayaScene inside of maya.  Call use() to set a different one.
+
+"""
+
+import abc
+
+try:
+    import maya.cmds as m
+    import maya.OpenMaya as om
+except ImportError:
+    # the in memory scene is used outside of maya, e.g. to run the cleanup tools on the farm
+    m = om = None
+
+import numpy as np
+
+EMPTY = np.zeros(0, dtype=np.float64)
+
+
+class Scene(abc.ABC):
+    """ Interface for the operations the cleanup tools need from a scene """
+
+    @abc.abstractmethod
+    def fetch_keys(self, channels, time_range=None):
+        """ returns {channel: (times, values)} for each of the channels, optionally only the keys within
+        time_range (start, end).  Channels without keys have empty arrays """
+
+    @abc.abstractmethod
+    def set_keys(self, keys, replace=True, stepped=False):
+        """ keys is {channel: (times, values)}.  If replace is True the keys replace all the keys on each
+        channel, otherwise they are merged with the current keys """
+
+    @abc.abstractmethod
+    def delete_keys(self, channels, time_range=None):
+        """ removes the keys on the channels, or only those within time_range (start, end) """
+
+    @abc.abstractmethod
+    def key_count(self, channel):
+        """ returns the number of keys on node.attr """
+
+    @abc.abstractmethod
+    def markers(self):
+        """ returns the full names of the marker transforms """
+
+    @abc.abstractmethod
+    def exists(self, name):
+        """ True if the node or node.attr exists """
+
+    @abc.abstractmethod
+    def get_attr(self, node_attr, default=None):
+        """ returns the value of node.attr, or default if it does not exist """
+
+    @abc.abstractmethod
+    def set_attr(self, node_attr, value):
+        """ sets node.attr, adding a float attribute if it does not exist """
+
+    @abc.abstractmethod
+    def current_time(self):
+        """ returns the current frame """
+
+    @abc.abstractmethod
+    def fps(self):
+        """ frames per second of the scene time unit """
+
+    def fetch_points(self, nodes, time_range=None):
+        """ returns (times, points, valid) for the translate keys on the nodes.  The times are every key time
+        on any of the nodes, points is a (times, nodes, 3) array and valid is False where the node does
+        not have a key """
+
+        channels = [node + '.' + attr for node in nodes for attr in ('tx', 'ty', 'tz')]
+        keys = self.fetch_keys(channels, time_range)
+
+        times = np.unique(np.concatenate([keys[i][0] for i in channels] + [EMPTY]))
+        points = np.zeros((len(times), len(nodes), 3), dtype=np.float64)
+        valid = np.zeros((len(times), len(nodes)), dtype=bool)
+
+        for i, node in enumerate(nodes):
+            key_times = keys[node + '.tx'][0]
+            for axis, attr in enumerate(('tx', 'ty', 'tz')):
+                if not np.array_equal(keys[node + '.' + attr][0], key_times):
+                    raise RuntimeError("Keys not aligned on: " + str(node))
+                points[np.searchsorted(times, key_times), i, axis] = keys[node + '.' + attr][1]
+            valid[np.searchsorted(times, key_times), i] = True
+
+        return times, points, valid
+
+    def set_points(self, nodes, times, points, valid=None):
+        """ replaces the translate keys on the nodes with (times, nodes, 3) points, skipping the frames that
+        are not valid """
+
+        times = np.asarray(times, dtype=np.float64)
+        points = np.asarray(points, dtype=np.float64)
+
+        keys = {}
+        for i, node in enumerate(nodes):
+            mask = slice(None) if valid is None else np.asarray(valid[:, i], dtype=bool)
+            for axis, attr in enumerate(('tx', 'ty', 'tz')):
+                keys[node + '.' + attr] = (times[mask], points[mask, i, axis])
+
+        self.set_keys(keys)
+
+
+def in_range(times, values, time_range):
+    """ returns the times and values from start to end (inclusive) """
+
+    if time_range is None:
+        return times, values
+    a = np.searchsorted(times, time_range[0], side='left')
+    b = np.searchsorted(times, time_range[1], side='right')
+    return times[a:b], values[a:b]
+
+
+def merge_keys(times, values, new_times, new_values):
+    """ merges the new keys in to the sorted times and values, the new values replace keys at the same time """
+
+    all_times = np.concatenate((np.asarray(new_times, dtype=np.float64), times))
+    all_values = np.concatenate((np.asarray(new_values, dtype=np.float64), values))
+    times, first = np.unique(all_times, return_index=True)
+    return times, all_values[first]
+
+
+class MayaScene(Scene):
+    """ Reads and writes the keys in the maya scene """
+
+    def fetch_keys(self, channels, time_range=None):
+
+        ret = {}
+        for channel in channels:
+            if time_range is None:
+                times = m.keyframe(channel, q=True)
+                values = m.keyframe(channel, q=True, vc=True)
+            else:
+                times = m.keyframe(channel, q=True, t=tuple(time_range))
+                values = m.keyframe(channel, q=True, vc=True, t=tuple(time_range))
+
+            if not times:
+                ret[channel] = (EMPTY, EMPTY)
+                continue
+
+            times = np.asarray(times, dtype=np.float64)
+            order = np.argsort(times, kind='stable')
+            ret[channel] = (times[order], np.asarray(values, dtype=np.float64)[order])
+
+        return ret
+
+    def set_keys(self, keys, replace=True, stepped=False):
+
+        for channel, (times, values) in keys.items():
+            times = np.asarray(times, dtype=np.float64)
+            values = np.asarray(values, dtype=np.float64)
+            if len(times) != len(values):
+                raise ValueError("Times and values are different lengths on " + str(channel))
+
+            # sorted, with one key for each time
+            times, values = merge_keys(EMPTY, EMPTY, times, values)
+
+            if replace:
+                self.replace_keys(channel, times, values, stepped)
+            else:
+                self.insert_keys(channel, times, values, stepped)
+
+    def replace_keys(self, channel, times, values, stepped=False):
+        """ replaces the curve's keys with one setAttr on its .ktv array """
+
+        m.cutKey(channel)
+        if len(times) == 0:
+            return
+
+        # key the first frame to create the curve, then set all the keys on it with one setAttr
+        m.setKeyframe(channel, t=times[0], v=values[0])
+        anim_curve = m.listConnections(channel, s=True, d=False, type="animCurve")[0]
+        data = np.column_stack((times, values)).ravel().tolist()
+        m.setAttr(anim_curve + ".ktv[0:%d]" % (len(times) - 1), *data)
+        if stepped:
+            m.keyTangent(anim_curve, ott="step")
+
+    def insert_keys(self, channel, times, values, stepped=False):
+        """ adds the keys to the curve, keeping the other keys and their tangents.  Only the keys within the
+        range of the new keys are read, so filling a gap does not depend on the length of the curve """
+
+        if len(times) == 0:
+            return
+
+        current = self.fetch_keys([channel], (times[0], times[-1]))[channel][0]
+        existing = np.isin(times, current)
+
+        for time, value, exists in zip(times.tolist(), values.tolist(), existing.tolist()):
+            if exists:
+                m.keyframe(channel, e=True, t=(time, time), absolute=True, valueChange=value)
+            elif stepped:
+                m.setKeyframe(channel, t=time, v=value, ott="step")
+            else:
+                m.setKeyframe(channel, t=time, v=value)
+
+    def delete_keys(self, channels, time_range=None):
+        for channel in channels:
+            if time_range is None:
+                m.cutKey(channel)
+            else:
+                m.cutKey(channel, t=tuple(time_range))
+
+    def key_count(self, channel):
+        return m.keyframe(channel, q=True, keyframeCount=True) or 0
+
+    def markers(self):
+        shapes = m.ls(type='peelSquareLocator', l=True)
+        if not shapes: return []
+        return [m.listRelatives(i, p=True, f=True)[0] for i in shapes]
+
+    def exists(self, name):
+        return m.objExists(name)
+
+    def get_attr(self, node_attr, default=None):
+        if not m.objExists(node_attr):
+            return default
+        return m.getAttr(node_attr)
+
+    def set_attr(self, node_attr, value):
+        if not m.objExists(node_attr):
+            node, attr = node_attr.split('.', 1)
+            m.addAttr(node, ln=attr, at='float')
+        m.setAttr(node_attr, value)
+
+    def current_time(self):
+        return m.currentTime(q=True)
+
+    def fps(self):
+        return om.MTime(1, om.MTime.kSeconds).asUnits(om.MTime.uiUnit())
+
+
+class MemoryScene(Scene):
+    """ A scene held in memory
+
+    * self.keys - dict of channel: (times, values)
+    * self.attrs - dict of node.attr: value
+    * self.nodes - list of the marker names
+    """
+
+    def __init__(self, fps=120.0):
+        self.keys = {}
+        self.attrs = {}
+        self.nodes = []
+        self.time = 0.0
+        self.frame_rate = fps
+
+    @classmethod
+    def from_arrays(cls, names, points, valid=None, rate=None, first_frame=1, fps=None):
+        """ returns a scene with a marker for each name keyed with (frames, markers, 3) points.  rate is the
+        frames per second of the data, C3dRate is set on the markers when it is given.  The scene runs at
+        the rate of the data unless fps is given """
+
+        if fps is None:
+            fps = rate or 120.0
+
+        scene = cls(fps)
+        points = np.asarray(points)
+        step = 1.0 if rate is None else fps / float(rate)
+        times = first_frame + np.arange(points.shape[0], dtype=np.float64) * step
+
+        scene.nodes = list(names)
+        scene.set_points(scene.nodes, times, points, valid)
+        if rate is not None:
+            for name in scene.nodes:
+                scene.attrs[name + '.C3dRate'] = float(rate)
+
+        return scene
+
+    def fetch_keys(self, channels, time_range=None):
+
+        ret = {}
+        for channel in channels:
+            times, values = self.keys.get(channel, (EMPTY, EMPTY))
+            ret[channel] = in_range(times, values, time_range)
+        return ret
+
+    def set_keys(self, keys, replace=True, stepped=False):
+
+        for channel, (times, values) in keys.items():
+            times = np.asarray(times, dtype=np.float64)
+            values = np.asarray(values, dtype=np.float64)
+            if len(times) != len(values):
+                raise ValueError("Times and values are different lengths on " + str(channel))
+
+            if replace:
+                times, values = merge_keys(EMPTY, EMPTY, times, values)
+            else:
+                current = self.keys.get(channel, (EMPTY, EMPTY))
+                times, values = merge_keys(current[0], current[1], times, values)
+
+            self.keys[channel] = (times, values)
+            node = channel.split('.')[0]
+            if node not in self.nodes:
+                self.nodes.append(node)
+
+    def delete_keys(self, channels, time_range=None):
+        for channel in channels:
+            if channel not in self.keys:
+                continue
+            if time_range is None:
+                del self.keys[channel]
+                continue
+            times, values = self.keys[channel]
+            keep = (times < time_range[0]) | (times > time_range[1])
+            self.keys[channel] = (times[keep], values[keep])
+
+    def key_count(self, channel):
+        return len(self.keys.get(channel, (EMPTY, EMPTY))[0])
+
+    def markers(self):
+        return list(self.nodes)
+
+    def exists(self, name):
+        if '.' not in name:
+            return name in self.nodes
+        return name in self.attrs or name in self.keys
+
+    def get_attr(self, node_attr, default=None):
+        return self.attrs.get(node_attr, default)
+
+    def set_attr(self, node_attr, value):
+        self.attrs[node_attr] = value
+
+    def current_time(self):
+        return self.time
+
+    def fps(self):
+        return self.frame_rate
+
+
+current = None
+
+
+def get():
+    """ returns the scene the cleanup tools read and write """
+
+    global current
+    if current is None:
+        current = MayaScene() if m is not None else MemoryScene()
+    return current
+
+
+def use(scene):
+    """ sets the scene the cleanup tools use, None goes back to the default """
+
+    global current
+    current = scene
+
+
+def warning(message):
+    """ shows a warning in maya, or prints it """
+
+    if m is not None:
+        m.warning(message)
+    else:
+        print("Warning: " + message)
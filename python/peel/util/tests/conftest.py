@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from peel.util import curve, scene
+
+
+@pytest.fixture
+def memory_scene():
+    """ Uses an empty MemoryScene for the test """
+
+    previous = scene.current
+    scn = scene.MemoryScene(fps=120.0)
+    scene.use(scn)
+    curve.clear_gap_indexes()
+    yield scn
+    scene.use(previous)
+    curve.clear_gap_indexes()
+
+
+@pytest.fixture
+def take():
+    """ (names, points, valid) for 3 markers over 100 frames on smooth paths """
+
+    frames = np.arange(100, dtype=np.float64)[:, None]
+    points = np.empty((100, 3, 3), dtype=np.float64)
+    points[..., 0] = np.sin(frames / 20.0) * 100 + np.arange(3) * 200
+    points[..., 1] = np.cos(frames / 20.0) * 100
+    points[..., 2] = 1000.0
+    valid = np.ones((100, 3), dtype=bool)
+    return ["a", "b", "c"], points, valid
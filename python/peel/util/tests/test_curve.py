@@ -0,0 +1,126 @@
+import collections
+
+import numpy as np
+import pytest
+
+from peel.util import curve
+
+
+def reference_spikes(deltas, width, limit):
+    """ The original deque based spike finder, returning delta indices """
+
+    deck = collections.deque(deltas[:width])
+    res = []
+    for i in range(width, len(deltas)):
+        halfset = sorted(deck)[:width // 2]
+        res.append(sum(halfset) / len(halfset))
+        deck.popleft()
+        deck.append(deltas[i])
+
+    return [i for i in range(len(deltas)) if deltas[i] / (res[i] if i < len(res) else res[-1]) > limit]
+
+
+@pytest.mark.parametrize("width", [2, 5, 10])
+def test_speed_spikes_matches_reference(width):
+    rng = np.random.RandomState(1)
+    deltas = rng.uniform(1.0, 2.0, 200)
+    deltas[[3, 50, 120, 195, 198]] *= rng.uniform(2.0, 8.0, 5)
+
+    expected = reference_spikes(deltas.tolist(), width, 3)
+    assert curve.speed_spikes(deltas, width, 3).tolist() == expected
+
+
+def test_rolling_baseline_tail():
+    deltas = np.arange(1, 21, dtype=np.float64)
+    baseline = curve.rolling_baseline(deltas, 4)
+
+    # the lower half mean of each window, the keys from n - width - 1 on use the window that starts there
+    expected = [(deltas[i] + deltas[i + 1]) / 2 for i in range(16)]
+    expected += [expected[-1]] * 4
+    np.testing.assert_allclose(baseline, expected)
+
+
+def test_rolling_baseline_single_window():
+    deltas = np.array([1.0, 2.0, 3.0, 4.0])
+    np.testing.assert_allclose(curve.rolling_baseline(deltas, 10), [1.5] * 4)
+
+
+def test_rolling_min_mean():
+    rng = np.random.RandomState(2)
+    values = rng.uniform(0, 10, 50)
+    windows = curve.rolling_windows(values, 7)
+    np.testing.assert_allclose(curve.rolling_min(values, 7), windows.min(axis=1))
+    np.testing.assert_allclose(curve.rolling_mean(values, 7), windows.mean(axis=1))
+
+
+@pytest.mark.skipif(curve.m is not None, reason="runs outside of maya")
+def test_channel_outside_maya(memory_scene, take):
+    names, points, valid = take
+    memory_scene.set_points(names, np.arange(1, 101, dtype=np.float64), points)
+
+    chan = curve.channel("b", 1.0)
+    chan.fetch()
+    assert len(chan) == 100
+    np.testing.assert_allclose(np.asarray(chan[10]), points[9, 1])
+    with pytest.raises(KeyError):
+        chan[0.5]
+
+
+def test_gap_index():
+    index = curve.GapIndex("m.tx", 1.0)
+    index.set_keys([1, 2, 3, 10, 11, 20, 21, 22])
+
+    assert index.segments() == [(1, 3), (10, 11), (20, 22)]
+    assert index.gaps() == [(3, 10), (11, 20)]
+
+    assert index.next_gap(0) == (3, 10)
+    assert index.next_gap(3) == (3, 10)
+    assert index.next_gap(4) == (11, 20)
+    assert index.next_gap(12) is None
+
+    assert index.previous_gap(25) == (11, 20)
+    assert index.previous_gap(20) == (11, 20)
+    assert index.previous_gap(19) == (3, 10)
+    assert index.previous_gap(5) is None
+
+    assert index.current(5) == ('gap', (3, 10))
+    assert index.current(2) == ('segment', (1, 3))
+    assert index.current(-5) == ('before', 1)
+    assert index.current(30) == ('after', 22)
+
+
+def test_gap_index_cache(memory_scene):
+    memory_scene.set_keys({"m.tx": ([1, 2, 3, 10, 11], [0] * 5)})
+
+    index = curve.gap_index("m", 1.0)
+    assert index.gaps() == [(3, 10)]
+    assert curve.gap_index("m.tx", 1.0) is index
+
+    # keys added outside of maya are found by the key count check
+    memory_scene.set_keys({"m.tx": ([20, 21], [0, 0])}, replace=False)
+    assert curve.gap_index("m.tx", 1.0).gaps() == [(3, 10), (11, 20)]
+
+
+def test_markerset_spikes(take):
+    names, points, valid = take
+    points = points.copy()
+    points[40, 1] += 100.0
+    valid[60:70, 2] = False
+
+    found = curve.markerset_spikes(np.arange(100, dtype=np.float64), points, valid)
+    assert [i.tolist() for i in found] == [[], [40.0, 41.0], []]
+
+
+def test_markerset_swaps(take):
+    names, points, valid = take
+    points = points.copy()
+    points[:, 1] = points[:, 0] + [5.0, 0, 0]
+    points[50:, [0, 1]] = points[50:, [1, 0]]
+
+    found = curve.markerset_swaps(points, 10.0, valid)
+    assert len(found) == 1
+    frame, a, b, cost = found[0]
+    assert (frame, a, b) == (50, 0, 1)
+    assert cost > 0
+
+    assert curve.markerset_swaps(take[1], 10.0, valid) == []
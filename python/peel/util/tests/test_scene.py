@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from peel.util import scene
+
+
+def test_scene_is_abstract():
+    with pytest.raises(TypeError):
+        scene.Scene()
+
+
+@pytest.mark.skipif(scene.m is not None, reason="runs outside of maya")
+def test_get_outside_maya(memory_scene):
+    scene.use(None)
+    assert isinstance(scene.get(), scene.MemoryScene)
+
+
+def test_from_arrays_round_trip(take):
+    names, points, valid = take
+    valid[10:20, 1] = False
+
+    scn = scene.MemoryScene.from_arrays(names, points, valid, rate=120.0, first_frame=5, fps=24.0)
+    assert scn.markers() == names
+    assert scn.get_attr("a.C3dRate") == 120.0
+    assert scn.key_count("b.tx") == 90
+
+    times, fetched, fetched_valid = scn.fetch_points(names)
+    np.testing.assert_allclose(times, 5 + np.arange(100) * 0.2)
+    np.testing.assert_array_equal(fetched_valid, valid)
+    np.testing.assert_allclose(fetched[valid], points[valid])
+
+
+def test_fetch_keys_range(take):
+    names, points, valid = take
+    scn = scene.MemoryScene.from_arrays(names, points, valid)
+
+    times, values = scn.fetch_keys(["a.tx"], (10, 19))["a.tx"]
+    np.testing.assert_array_equal(times, np.arange(10, 20))
+    np.testing.assert_allclose(values, points[9:19, 0, 0])
+
+    empty = scn.fetch_keys(["missing.tx"])["missing.tx"]
+    assert len(empty[0]) == 0 and len(empty[1]) == 0
+
+
+def test_set_and_delete_keys():
+    scn = scene.MemoryScene()
+    scn.set_keys({"a.tx": ([3, 1, 2], [30, 10, 20])})
+    np.testing.assert_array_equal(scn.fetch_keys(["a.tx"])["a.tx"][0], [1, 2, 3])
+
+    # merged keys replace the keys at the same time
+    scn.set_keys({"a.tx": ([2, 4], [200, 400])}, replace=False)
+    times, values = scn.fetch_keys(["a.tx"])["a.tx"]
+    np.testing.assert_array_equal(times, [1, 2, 3, 4])
+    np.testing.assert_array_equal(values, [10, 200, 30, 400])
+
+    scn.delete_keys(["a.tx"], (2, 3))
+    np.testing.assert_array_equal(scn.fetch_keys(["a.tx"])["a.tx"][0], [1, 4])
+
+    with pytest.raises(ValueError):
+        scn.set_keys({"a.ty": ([1, 2], [1])})
+
+
+def test_fetch_points_not_aligned():
+    scn = scene.MemoryScene()
+    scn.set_keys({"a.tx": ([1, 2], [0, 0]), "a.ty": ([1, 3], [0, 0]), "a.tz": ([1, 2], [0, 0])})
+    with pytest.raises(RuntimeError):
+        scn.fetch_points(["a"])
+
+
+class FakeCmds(object):
+    """ Records the maya.cmds calls MayaScene makes on a single curve """
+
+    def __init__(self, times, values):
+        self.times = list(times)
+        self.values = list(values)
+        self.calls = []
+
+    def keyframe(self, channel, q=False, e=False, t=None, vc=False, **kwargs):
+        if e:
+            self.calls.append(('edit', t[0], kwargs['valueChange']))
+            return
+        keys = [(k, v) for k, v in zip(self.times, self.values) if t is None or t[0] <= k <= t[1]]
+        return [v if vc else k for k, v in keys]
+
+    def setKeyframe(self, channel, t, v, **kwargs):
+        self.calls.append(('key', t, v))
+
+    def cutKey(self, channel, **kwargs):
+        self.calls.append(('cut',))
+
+    def listConnections(self, channel, **kwargs):
+        return ['curve1']
+
+    def setAttr(self, attr, *values):
+        self.calls.append(('setAttr', attr, list(values)))
+
+    def keyTangent(self, curve, **kwargs):
+        self.calls.append(('tangent', kwargs))
+
+
+def test_maya_insert_keys(monkeypatch):
+    times = np.concatenate((np.arange(501), np.arange(503, 1000))).astype(np.float64)
+    cmds = FakeCmds(times, np.zeros(len(times)))
+    monkeypatch.setattr(scene, "m", cmds)
+
+    # a gap fill, the key at 500 already exists and is edited in place
+    scene.MayaScene().set_keys({"a.tx": ([502, 500, 501], [2, 0.5, 1])}, replace=False)
+
+    assert cmds.calls == [('edit', 500, 0.5), ('key', 501, 1), ('key', 502, 2)]
+
+
+def test_maya_replace_keys(monkeypatch):
+    cmds = FakeCmds([], [])
+    monkeypatch.setattr(scene, "m", cmds)
+
+    scene.MayaScene().set_keys({"a.tx": ([3, 1, 3, 2], [30, 10, 31, 20])})
+    assert cmds.calls == [('cut',), ('key', 1, 10), ('setAttr', 'curve1.ktv[0:2]', [1, 10, 2, 20, 3, 30])]
+
+    with pytest.raises(ValueError):
+        scene.MayaScene().set_keys({"a.tx": ([1, 2], [1])})
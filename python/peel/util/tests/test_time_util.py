@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from peel.util import time_util
+
+
+@pytest.mark.parametrize("rate, drop", [(24.0, False), (25.0, False), (30.0, False), (29.97, True),
+                                        (59.94, True)])
+def test_round_trip(rate, drop):
+    # a little over an hour, through several ten minute boundaries
+    frames = np.arange(0, int(round(rate)) * 60 * 61, 7)
+    h, m, s, f = time_util.frames_to_timecode(frames, rate, drop)
+    np.testing.assert_array_equal(time_util.timecode_frames(h, m, s, f, rate, drop), frames)
+
+
+@pytest.mark.parametrize("rate, frame, expected", [
+    (29.97, 1799, (0, 0, 59, 29)),
+    (29.97, 1800, (0, 1, 0, 2)),
+    (29.97, 17981, (0, 9, 59, 29)),
+    (29.97, 17982, (0, 10, 0, 0)),
+    (29.97, 107892, (1, 0, 0, 0)),
+    (59.94, 3599, (0, 0, 59, 59)),
+    (59.94, 3600, (0, 1, 0, 4)),
+    (59.94, 35964, (0, 10, 0, 0)),
+])
+def test_drop_frame(rate, frame, expected):
+    assert tuple(int(i) for i in time_util.frames_to_timecode(frame, rate, True)) == expected
+    assert int(time_util.timecode_frames(*expected, rate=rate, drop=True)) == frame
+
+
+def test_dropped_numbers_skipped():
+    h, m, s, f = time_util.frames_to_timecode(np.arange(0, 30 * 60 * 20), 29.97, True)
+    # frames 0 and 1 are skipped at the start of each minute, except every tenth minute
+    skipped = (s == 0) & (f < 2)
+    assert np.all(m[skipped] % 10 == 0)
+
+
+def test_wraps_at_24_hours():
+    frames = time_util.timecode_frames(23, 59, 59, 24, 25.0) + 1
+    assert tuple(int(i) for i in time_util.frames_to_timecode(frames, 25.0)) == (0, 0, 0, 0)
+
+
+def test_take_timecodes():
+    # 120Hz take starting at 01:00:00:00 with 30fps timecode, 4 subframes per frame
+    h, m, s, f, sub = time_util.take_timecodes(np.arange(8), 120.0, (1, 0, 0, 0), 30.0)
+    assert h.tolist() == [1] * 8
+    assert f.tolist() == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert sub.tolist() == [0, 1, 2, 3, 0, 1, 2, 3]
@@ -19,13 +19,24 @@
 # THE SOFTWARE.
 
 
-import maya.cmds as m
-import maya.OpenMaya as om
+try:
+    import maya.cmds as m
+    import maya.OpenMaya as om
+except ImportError:
+    # the timecode functions are also used outside of maya, e.g. by the c3d parser
+    m = om = None
+
 import math
 import json
 import subprocess
 import os.path
 
+import numpy as np
+
+
+# TIMECODE:STANDARD names in c3d files
+TIMECODE_STANDARDS = {"PAL": 25.0, "SECAM": 25.0, "EBU": 25.0, "NTSC": 29.97, "SMPTE": 30.0, "FILM": 24.0}
+
 
 class Timecode(object):
     def __init__(self, value=None, rate=None, fraction=0.0):
@@ -122,6 +133,67 @@ class Timecode(object):
         return t
 
 
+def drop_count(rate):
+    """ Number of frame numbers skipped each minute by drop frame timecode, 2 for 29.97, 4 for 59.94 """
+    return int(round(rate)) // 15
+
+
+def timecode_frames(h, m, s, f, rate, drop=False):
+    """ Converts timecode values (ints or arrays) to a frame count from 00:00:00:00 """
+
+    nominal = int(round(rate))
+    h, m, s, f = [np.asarray(i, dtype=np.int64) for i in (h, m, s, f)]
+    minutes = h * 60 + m
+
+    frames = (minutes * 60 + s) * nominal + f
+    if drop:
+        frames = frames - drop_count(rate) * (minutes - minutes // 10)
+
+    return frames
+
+
+def frames_to_timecode(frames, rate, drop=False):
+    """ Converts frame counts from 00:00:00:00 (int or array) to (h, m, s, f) int64 arrays, wrapping at 24 hours """
+
+    nominal = int(round(rate))
+    frames = np.asarray(frames, dtype=np.int64)
+
+    if drop:
+        dropped = drop_count(rate)
+        per_ten = nominal * 600 - dropped * 9
+        per_minute = nominal * 60 - dropped
+        tens, rem = np.divmod(frames, per_ten)
+        frames = frames + dropped * 9 * tens + np.where(rem > dropped, dropped * ((rem - dropped) // per_minute), 0)
+
+    seconds, f = np.divmod(frames, nominal)
+    minutes, s = np.divmod(seconds, 60)
+    h, m = np.divmod(minutes, 60)
+
+    return h % 24, m, s, f
+
+
+def take_timecodes(frames, rate, start, standard, drop=False, subframes=0):
+    """ Returns the timecode of each frame in a take as (h, m, s, f, subframe) int64 arrays.
+
+    :param frames: frame numbers at rate, frame n is n / rate seconds after the start timecode
+    :param rate: capture rate
+    :param start: (h, m, s, f) timecode of the take at the standard rate
+    :param standard: timecode rate, e.g. 29.97
+    :param drop: drop frame timecode
+    :param subframes: subframes per timecode frame, by default rate / standard """
+
+    if subframes <= 0:
+        subframes = max(1, int(round(rate / standard)))
+
+    # work in whole subframes, the small offset stops exact multiples landing on the previous frame
+    frames = np.asarray(frames, dtype=np.float64)
+    position = np.floor(frames * standard * subframes / rate + 1e-6).astype(np.int64)
+    tc_frames, subframe = np.divmod(position, subframes)
+
+    h, m, s, f = frames_to_timecode(timecode_frames(*start, rate=standard, drop=drop) + tc_frames, standard, drop)
+    return h, m, s, f, subframe
+
+
 def fps():
     second = om.MTime(1.0, om.MTime.kSeconds)
     return second.asUnits(om.MTime().uiUnit())
@@ -232,12 +304,30 @@ def tc_node():
     st = m.playbackOptions(q=True, min=True)
     en = m.playbackOptions(q=True, max=True)
 
-    for i in range(int(st), int(en)):
-        t = Timecode(float(i), fps())
-        m.setKeyframe(tc, at="tx", v=t.h, t=(i))
-        m.setKeyframe(tc, at="ty", v=t.m, t=(i))
-        m.setKeyframe(tc, at="tz", v=t.s, t=(i))
-        m.setKeyframe(tc, at="rx", v=t.f, t=(i))
+    frames = np.arange(int(st), int(en))
+    if len(frames) == 0:
+        return
+
+    h, mm, s, f = frames_to_timecode(frames, fps())
+
+    # the values are keyed as they were with setKeyframe, in the ui units of the scene
+    distance = om.MDistance(1.0, om.MDistance.uiUnit()).asCentimeters()
+    angle = om.MAngle(1.0, om.MAngle.uiUnit()).asRadians()
+
+    set_keys(tc, "tx", frames, h * distance, "animCurveTL")
+    set_keys(tc, "ty", frames, mm * distance, "animCurveTL")
+    set_keys(tc, "tz", frames, s * distance, "animCurveTL")
+    set_keys(tc, "rx", frames, f * angle, "animCurveTA")
+
+
+def set_keys(node, attr, times, values, curve_type):
+    """ Keys all the values on to node.attr with one setAttr on a new anim curve.  The .ktv values are
+    in maya's internal units, centimeters for animCurveTL and radians for animCurveTA """
+
+    curve = m.createNode(curve_type, name=node + "_" + attr)
+    keys = np.column_stack((times, values)).astype(np.float64).ravel().tolist()
+    m.setAttr(curve + ".ktv[0:%d]" % (len(times) - 1), *keys)
+    m.connectAttr(curve + ".output", node + "." + attr)
 
 
 def timecode_start(optical_root):
@@ -269,7 +359,7 @@ def c3d_start(optical_root):
     first_field = m.getAttr(optical_root + ".C3dFirstField")
     c3d_rate = m.getAttr(optical_root + ".C3dRate")
 
-    return start_tc + Timecode(first_field, c3d_rate)
+    return start_tc + Timecode(float(first_field), c3d_rate)
 
 
 def now():